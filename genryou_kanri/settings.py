@@ -137,6 +137,47 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache（外部サービス不要）
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# 'locmem'   : プロセスごとのメモリ。MAX_ENTRIES 件を超えると古く使われていない順に削除（単一プロセス向け）
+# 'file'     : CACHE_DIR のファイル。gunicorn の複数ワーカーで共有できる
+# 'database' : SQLite のテーブル。複数ワーカーで共有できる（python manage.py createcachetable が必要）
+MATERIAL_CACHE_BACKEND = 'locmem'
+
+CACHE_DIR = BASE_DIR / 'cache'
+
+_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'genryou-kanri',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+    },
+    'database': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'genryou_cache',
+    },
+}
+
+CACHES = {
+    'default': {
+        **_CACHE_BACKENDS[MATERIAL_CACHE_BACKEND],
+        'TIMEOUT': 300,
+        'KEY_PREFIX': 'genryou',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+            'CULL_FREQUENCY': 4,  # 上限に達したら 1/4 を削除
+        },
+    }
+}
+
+# キャッシュの保持秒数（materials アプリ）
+MATERIAL_STATS_CACHE_TIMEOUT = 300        # 原料統計
+MATERIAL_LIST_PAGE_CACHE_TIMEOUT = 60     # 一覧ページの取得結果
+
 # Logging configuration
 LOGGING = {
     'version': 1,
@@ -1,17 +1,32 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.shortcuts import render, redirect
 from django.urls import path
 from django.contrib import messages
+from django.core.cache import cache
 from django.http import HttpResponse
-from .models import Material
+from django.utils import timezone
+from .models import Material, Formulation, FormulationCost, FormulationLine, ImportJob, Product, PurifiedWaterException
+from .caching import (
+    COUNTER_FLUSH_INTERVAL, cache_backend_info, cache_counters, reset_cache_counters,
+)
+from .costing import mark_costs_stale
 from .csv_loader import MaterialCSVLoader
-import csv
+from .export import MATERIAL_EXPORT_COLUMNS, streaming_csv_response
+from .projections import ADMIN_CHANGELIST_FIELDS
+from .search import search_materials
+from .stats import invalidate_material_stats
+
+class MaterialChangeList(ChangeList):
+    """一覧に表示する列だけを読み込む（原料は40列近くあるため）"""
+
+    def get_queryset(self, request, exclude_parameters=None):
+        return super().get_queryset(request, exclude_parameters).only(*ADMIN_CHANGELIST_FIELDS)
+
 
 @admin.register(Material)
 class MaterialAdmin(admin.ModelAdmin):
-    list_display = (
-        'material_id', 'material_name', 'manufacturer', 'supplier', 'unit_price', 'is_active', 'created_at', 'updated_at'
-    )
+    list_display = ADMIN_CHANGELIST_FIELDS
     list_filter = ('is_active', 'material_category', 'manufacturer')
     search_fields = ('material_id', 'material_name', 'manufacturer', 'supplier')
     list_editable = ('is_active',)
@@ -19,11 +34,24 @@ class MaterialAdmin(admin.ModelAdmin):
 
     actions = ['export_csv', 'activate_materials', 'deactivate_materials']
 
+    def get_changelist(self, request, **kwargs):
+        return MaterialChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        """一覧画面と同じ正規化テキスト検索を使う"""
+        if not search_term:
+            return queryset, False
+        return search_materials(queryset, search_term), False
+
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
             path('import-csv/', self.import_csv, name='materials_material_import_csv'),
             path('analyze-csv/', self.analyze_csv, name='materials_material_analyze_csv'),
+            path(
+                'cache-stats/', self.admin_site.admin_view(self.cache_stats),
+                name='materials_material_cache_stats',
+            ),
         ]
         return custom_urls + urls
 
@@ -92,51 +120,134 @@ CSV読み込み完了！
         response['Content-Disposition'] = 'attachment; filename=\"csv_analysis.txt\"'
         return response
 
-    def export_csv(self, request, queryset):
-        """選択された原料をCSVエクスポート"""
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename=\"materials_export.csv\"'
-        response.write('\ufeff')  # BOM for Excel
-
-        writer = csv.writer(response)
-        writer.writerow([
-            '原料ID', '原料名', 'メーカー', '発注先', '分類', '単価', '正袋重量',
-            'ラベル用備考', '原料区分', '有効', '作成日時', '更新日時'
-        ])
-
-        for material in queryset:
-            writer.writerow([
-                material.material_id,
-                material.material_name,
-                material.manufacturer,
-                material.supplier,
-                material.category,
-                material.unit_price,
-                material.main_bag_weight,
-                material.label_note,
-                material.material_category,
-                '有効' if material.is_active else '無効',
-                material.created_at.strftime('%Y-%m-%d %H:%M:%S') if material.created_at else "",
-                material.updated_at.strftime('%Y-%m-%d %H:%M:%S') if material.updated_at else "",
-            ])
+    def cache_stats(self, request):
+        """キャッシュの設定とヒット・ミスの回数"""
+        if request.method == 'POST':
+            action = request.POST.get('action')
+            if action == 'reset_counters':
+                reset_cache_counters()
+                self.message_user(request, "キャッシュの回数をリセットしました", level=messages.SUCCESS)
+            elif action == 'clear_cache':
+                cache.clear()
+                self.message_user(request, "キャッシュをすべて削除しました", level=messages.SUCCESS)
+            return redirect('.')
 
-        return response
+        context = {
+            'title': 'キャッシュ状況',
+            'backend': cache_backend_info(),
+            'counters': cache_counters(),
+            'flush_interval': COUNTER_FLUSH_INTERVAL,
+            'opts': self.model._meta,
+            'has_permission': True,
+        }
+        return render(request, 'admin/materials/material/cache_stats.html', context)
+
+    def export_csv(self, request, queryset):
+        """選択された原料をCSVエクスポート（BOM付きUTF-8、ストリーミング）"""
+        return streaming_csv_response(
+            queryset.order_by('material_id'), MATERIAL_EXPORT_COLUMNS, 'materials_export.csv', encoding='utf-8-sig'
+        )
 
     export_csv.short_description = '選択された原料をCSV出力'
 
     def activate_materials(self, request, queryset):
         """選択された原料を有効化"""
-        count = queryset.update(is_active=True)
+        # updated_at も更新する（取り込み状態の照合で管理画面の変更を検知させるため）
+        count = queryset.update(is_active=True, updated_at=timezone.now())
+        invalidate_material_stats()
         self.message_user(request, f'{count}件の原料を有効化しました。')
 
     activate_materials.short_description = '選択された原料を有効化'
 
     def deactivate_materials(self, request, queryset):
         """選択された原料を無効化"""
-        count = queryset.update(is_active=False)
+        count = queryset.update(is_active=False, updated_at=timezone.now())
+        invalidate_material_stats()
         self.message_user(request, f'{count}件の原料を無効化しました。')
 
     deactivate_materials.short_description = '選択された原料を無効化'
 
 
+class FormulationLineInline(admin.TabularInline):
+    model = FormulationLine
+    fields = ('input_group_no', 'material', 'material_name', 'quantity_kg', 'weighing_type', 'usage_status')
+    raw_id_fields = ('material',)
+    extra = 0
+
+
+@admin.register(Formulation)
+class FormulationAdmin(admin.ModelAdmin):
+    list_display = ('factory', 'product_id', 'pattern', 'product_name', 'customer', 'updated_at')
+    list_filter = ('factory',)
+    search_fields = ('product_id', 'product_name')
+    ordering = ('factory', 'product_id', 'pattern')
+    inlines = [FormulationLineInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        mark_costs_stale(formulation_ids=[form.instance.pk])
+
 
+@admin.register(FormulationLine)
+class FormulationLineAdmin(admin.ModelAdmin):
+    list_display = (
+        'formulation', 'material_cd', 'material_name', 'quantity_kg', 'weighing_type', 'usage_status'
+    )
+    list_filter = ('formulation__factory', 'usage_status', 'weighing_type')
+    search_fields = ('formulation__product_id', 'formulation__product_name', 'material__material_id', 'material_name')
+    list_select_related = ('formulation',)
+    raw_id_fields = ('formulation', 'material')
+    ordering = ('formulation', 'input_group_no')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        mark_costs_stale(formulation_ids=[obj.formulation_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        mark_costs_stale(formulation_ids=[obj.formulation_id])
+
+    def delete_queryset(self, request, queryset):
+        formulation_ids = list(queryset.values_list('formulation_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        mark_costs_stale(formulation_ids=formulation_ids)
+
+
+@admin.register(FormulationCost)
+class FormulationCostAdmin(admin.ModelAdmin):
+    list_display = (
+        'formulation', 'material_cost', 'total_quantity_kg', 'line_count', 'unpriced_line_count', 'is_stale', 'computed_at'
+    )
+    list_filter = ('is_stale', 'formulation__factory')
+    search_fields = ('formulation__product_id', 'formulation__product_name')
+    list_select_related = ('formulation',)
+    readonly_fields = [field.name for field in FormulationCost._meta.fields]
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = (
+        'factory', 'product_id', 'allocation_id', 'product_name', 'customer',
+        'batch_volume_a', 'batch_unit_a', 'yield_count_a', 'yield_unit_a', 'fill_volume', 'updated_at'
+    )
+    list_filter = ('factory',)
+    search_fields = ('product_id', 'product_name', 'customer')
+    ordering = ('factory', 'product_id', 'allocation_id')
+
+
+@admin.register(PurifiedWaterException)
+class PurifiedWaterExceptionAdmin(admin.ModelAdmin):
+    list_display = ('factory', 'product_id', 'material_cd', 'item_name', 'unit', 'price', 'fill_price', 'updated_at')
+    list_filter = ('factory', 'material_cd')
+    search_fields = ('product_id', 'material_cd')
+    ordering = ('factory', 'product_id', 'material_cd')
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'kind', 'status', 'filename', 'processed_rows', 'total_rows',
+        'created_count', 'updated_count', 'error_count', 'created_at', 'finished_at'
+    )
+    list_filter = ('kind', 'status')
+    readonly_fields = [field.name for field in ImportJob._meta.fields]
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MaterialsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'materials'
+
+    def ready(self):
+        # 統計キャッシュ破棄・原料費再計算用のシグナルを登録
+        from . import costing, purified_water, stats  # noqa: F401
+        from .search import ensure_fts_triggers_after_migrate
+
+        # テーブルを作り直すマイグレーションで消えた全文検索のトリガーを復元
+        post_migrate.connect(ensure_fts_triggers_after_migrate, sender=self)
@@ -0,0 +1,145 @@
+# materials/caching.py - 原料アプリのキャッシュ（名前空間付きキー・ヒット率の集計）
+"""
+原料アプリのキャッシュは必ずここの関数を通して使う。
+
+    stats = cache_get('stats', version)  # キーは 'materials:stats:<version>'
+    cache_set('stats', version, value=stats, timeout=300)
+    cache_get('list', version, digest)   # キーは 'materials:list:<version>:<digest>'
+
+- キーは 'materials:<名前空間>[:<部分>...]'（CACHES の KEY_PREFIX / VERSION はその前に付く）
+- 名前空間ごとにヒット・ミス・保存・削除の回数を数え、管理画面（原料 → キャッシュ状況）に表示する
+
+回数はプロセス内で数え、COUNTER_FLUSH_INTERVAL 秒ごとにキャッシュへ加算する。
+ファイル・データベースのキャッシュでは複数のワーカーの合計になる（加算は排他しないため概数）。
+LocMemCache ではプロセスごとの値になる。
+
+キャッシュの種類は settings.MATERIAL_CACHE_BACKEND で選ぶ（settings.py の CACHES を参照）。
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_NAMESPACE = 'materials'
+
+# 名前空間 → 管理画面での表示名
+NAMESPACES = {
+    'stats': '原料統計',
+    'list': '一覧ページ',
+}
+
+COUNTER_KINDS = ('hits', 'misses', 'sets', 'deletes')
+COUNTER_FLUSH_INTERVAL = getattr(settings, 'MATERIAL_CACHE_COUNTER_FLUSH_INTERVAL', 10)
+
+_counters = Counter()
+_counters_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def cache_key(namespace, *parts):
+    """名前空間付きのキャッシュキー（'materials:stats' / 'materials:list:<部分>:<部分>'）"""
+    return ':'.join([KEY_NAMESPACE, namespace, *map(str, parts)])
+
+
+def _counter_key(namespace, kind):
+    return cache_key('_counters', namespace, kind)
+
+
+def _record(namespace, kind):
+    with _counters_lock:
+        _counters[namespace, kind] += 1
+        due = time.monotonic() - _last_flush >= COUNTER_FLUSH_INTERVAL
+    if due:
+        flush_cache_counters()
+
+
+def cache_get(namespace, *parts):
+    """キャッシュの値を返す（なければ None）"""
+    value = cache.get(cache_key(namespace, *parts))
+    _record(namespace, 'misses' if value is None else 'hits')
+    return value
+
+
+def cache_set(namespace, *parts, value, timeout):
+    cache.set(cache_key(namespace, *parts), value, timeout)
+    _record(namespace, 'sets')
+
+
+def cache_add(namespace, *parts, value, timeout):
+    """キーがないときだけ保存する（保存したら True）"""
+    added = cache.add(cache_key(namespace, *parts), value, timeout)
+    if added:
+        _record(namespace, 'sets')
+    return added
+
+
+def cache_delete(namespace, *parts):
+    cache.delete(cache_key(namespace, *parts))
+    _record(namespace, 'deletes')
+
+
+def flush_cache_counters():
+    """プロセス内で数えた回数をキャッシュ上の合計に加算する"""
+    global _last_flush
+    with _counters_lock:
+        pending = dict(_counters)
+        _counters.clear()
+        _last_flush = time.monotonic()
+    for (namespace, kind), amount in pending.items():
+        key = _counter_key(namespace, kind)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            # add の直後に追い出された場合
+            cache.set(key, amount, None)
+
+
+def cache_counters():
+    """
+    名前空間ごとの回数を返す（管理画面用）
+
+    Returns:
+        list: [{'namespace', 'label', 'hits', 'misses', 'sets', 'deletes', 'hit_rate'}, ...]
+    """
+    flush_cache_counters()
+    totals = cache.get_many([_counter_key(namespace, kind) for namespace in NAMESPACES for kind in COUNTER_KINDS])
+
+    rows = []
+    for namespace in NAMESPACES:
+        row = {'namespace': namespace, 'label': NAMESPACES[namespace]}
+        for kind in COUNTER_KINDS:
+            row[kind] = totals.get(_counter_key(namespace, kind), 0)
+        lookups = row['hits'] + row['misses']
+        row['hit_rate'] = row['hits'] / lookups * 100 if lookups else None
+        rows.append(row)
+    return rows
+
+
+def reset_cache_counters():
+    with _counters_lock:
+        _counters.clear()
+    cache.delete_many([_counter_key(namespace, kind) for namespace in NAMESPACES for kind in COUNTER_KINDS])
+
+
+def cache_backend_info():
+    """使用中のキャッシュの設定と現在の件数（件数を数えられない場合は None）"""
+    config = settings.CACHES['default']
+    entries = None
+    if hasattr(cache, '_cache'):
+        # LocMemCache
+        entries = len(cache._cache)
+    elif hasattr(cache, '_list_cache_files'):
+        # FileBasedCache
+        entries = len(cache._list_cache_files())
+    return {
+        'backend': config['BACKEND'].rsplit('.', 1)[-1],
+        'location': str(config.get('LOCATION', '')),
+        'timeout': cache.default_timeout,
+        'max_entries': cache._max_entries,
+        'entries': entries,
+        'key_prefix': cache.key_prefix,
+        'version': cache.version,
+    }
@@ -0,0 +1,201 @@
+# materials/column_mapping.py - CSV列 → Material フィールドの対応表（全取り込み共通）
+"""
+CSVの列名は Material の各フィールドの verbose_name と同じなので、対応表はモデル定義から作る。
+
+- MATERIAL_FIELDS: 列名 → FieldSpec(フィールド名, 変換関数)（モジュール読み込み時に1回だけ作る）
+- get_column_plan(columns): ファイルのヘッダーごとに 列位置 → フィールド の対応を作ってキャッシュ
+- ColumnPlan.convert(df): 列ごとにまとめて変換した DataFrame（index は df と同じ）
+
+変換関数は Series を受け取り、前後の空白を除いた文字列（欠損は ''）の object 配列を返す。
+列ごとに1回だけ処理し、正規表現はモジュール読み込み時にコンパイルしておく。
+（文字列の Series.str は要素ごとのオーバーヘッドが大きいため、object 配列を直接処理する）
+"""
+import hashlib
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from .models import Material, normalize_search_text
+
+FieldSpec = namedtuple('FieldSpec', ['field', 'label', 'converter'])
+
+# CSVからは読み込まないフィールド
+EXCLUDED_FIELDS = ('id', 'is_active', 'created_at', 'updated_at')
+
+
+_AMOUNT_NOISE_RE = re.compile(r'[,¥￥\s]')
+_PATH_SEPARATOR_RE = re.compile(r'[\\/]+')
+
+
+def as_text(values):
+    """文字列に揃えて前後の空白を除く（欠損は ''）"""
+    values = values.to_numpy(dtype=object, na_value='')
+    return np.array(
+        [value.strip() if value.__class__ is str else str(value).strip() for value in values],
+        dtype=object,
+    )
+
+
+def clean_amount(values):
+    """
+    単価・重量: カンマ・通貨記号・空白を除く
+
+    空欄は空欄のまま（数値版のフィールドは NULL = 単価未設定）。記号だけの値は '0'
+    """
+    return np.array(
+        [(_AMOUNT_NOISE_RE.sub('', value) or '0') if value else '' for value in as_text(values)],
+        dtype=object,
+    )
+
+
+def clean_image_path(values):
+    """画像パス: "images\\1.jpg" → "images/1.jpg"（区切りの連続・先頭の / も除く）"""
+    return np.array(
+        [_PATH_SEPARATOR_RE.sub('/', value).lstrip('/') if value else value for value in as_text(values)],
+        dtype=object,
+    )
+
+
+def parse_unique(values, parser):
+    """数値への変換は値の種類ごとに1回だけ行う（同じ単価・重量の行が多いため）"""
+    parsed = {value: parser(value) if value else None for value in set(values)}
+    return [parsed[value] for value in values]
+
+
+# フィールドごとの変換関数（ここにないフィールドは as_text）
+FIELD_CONVERTERS = {
+    'unit_price': clean_amount,
+    'main_bag_weight': clean_amount,
+    'image_path': clean_image_path,
+}
+
+
+def _build_registry():
+    registry = {}
+    for field in Material._meta.concrete_fields:
+        if field.name in EXCLUDED_FIELDS or not field.editable:
+            continue
+        label = str(field.verbose_name)
+        registry[label] = FieldSpec(field.name, label, FIELD_CONVERTERS.get(field.name, as_text))
+    return registry
+
+
+MATERIAL_FIELDS = _build_registry()
+FIELD_SPECS = {spec.field: spec for spec in MATERIAL_FIELDS.values()}
+
+# 変換関数の処理内容を変えたら上げる（同じファイルでも読み込み直させる）
+CONVERTER_VERSION = 2
+
+# 対応表・変換関数が変わったことの検出用（取り込み状態の記録に使う）
+REGISTRY_SIGNATURE = hashlib.sha256(
+    ';'.join([
+        f'v{CONVERTER_VERSION}',
+        *(f'{label}={spec.field}:{spec.converter.__name__}' for label, spec in MATERIAL_FIELDS.items()),
+    ]).encode()
+).hexdigest()[:16]
+
+
+def convert_column(values, field):
+    """1列をフィールドの変換関数で変換する"""
+    return FIELD_SPECS[field].converter(values)
+
+
+class ColumnPlan:
+    """ファイルのヘッダーから作った 列位置 → FieldSpec の対応"""
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.entries = []
+        seen = set()
+        for index, column in enumerate(self.columns):
+            spec = MATERIAL_FIELDS.get(str(column).strip())
+            # 同じ列名が複数あるときは最初の列を使う
+            if spec and spec.field not in seen:
+                seen.add(spec.field)
+                self.entries.append((index, column, spec))
+
+    @property
+    def fields(self):
+        return [spec.field for _, _, spec in self.entries]
+
+    @property
+    def mapping(self):
+        """フィールド名 → 列名"""
+        return {spec.field: column for _, column, spec in self.entries}
+
+    def has(self, field):
+        return any(spec.field == field for _, _, spec in self.entries)
+
+    def column_for(self, field):
+        for _, column, spec in self.entries:
+            if spec.field == field:
+                return column
+        return None
+
+    @property
+    def has_search_sources(self):
+        """search_text の元になるフィールドがすべて列にあるか（ないときは書き込み後に再計算する）"""
+        return all(self.has(field) for field in Material.SEARCH_SOURCE_FIELDS)
+
+    def value_fields(self, exclude=('material_id',), derived=True):
+        """書き込み対象のフィールド名（derived=True なら数値版・検索用テキストのフィールドも含む）"""
+        fields = [field for field in self.fields if field not in exclude]
+        if derived:
+            fields += [
+                Material.NUMERIC_SHADOW_FIELDS[field][0]
+                for field in fields if field in Material.NUMERIC_SHADOW_FIELDS
+            ]
+            if self.has_search_sources:
+                fields.append('search_text')
+        return fields
+
+    def convert(self, df, exclude=(), derived=False):
+        """
+        列位置で取り出し、列ごとに変換した DataFrame を返す
+
+        Args:
+            df (DataFrame): self.columns と同じ並びの列を持つ
+            exclude (tuple): 変換しないフィールド
+            derived (bool): True なら数値版のフィールド（unit_price_value など）と search_text も追加する
+        """
+        data = {}
+        for index, _, spec in self.entries:
+            if spec.field in exclude:
+                continue
+            data[spec.field] = spec.converter(df.iloc[:, index])
+
+        if derived:
+            for source, (target, parser) in Material.NUMERIC_SHADOW_FIELDS.items():
+                if source in data:
+                    data[target] = parse_unique(data[source], parser)
+            if self.has_search_sources:
+                data['search_text'] = self._search_text(df, data)
+
+        return pd.DataFrame(data, index=df.index, dtype=object)
+
+    def _search_text(self, df, data):
+        """検索対象の列を正規化して連結する（正規化は値の種類ごとに1回だけ）"""
+        positions = {spec.field: index for index, _, spec in self.entries}
+        columns = []
+        for field in Material.SEARCH_SOURCE_FIELDS:
+            # 除外したフィールド（アップロード時の原料IDなど）も検索用テキストには含める
+            values = data[field] if field in data else convert_column(df.iloc[:, positions[field]], field)
+            normalized = {value: normalize_search_text(value) for value in set(values)}
+            columns.append([normalized[value] for value in values])
+        return ['\n'.join(parts) for parts in zip(*columns)]
+
+    def __repr__(self):
+        return f'ColumnPlan({len(self.entries)}/{len(self.columns)} 列)'
+
+
+@lru_cache(maxsize=32)
+def _cached_plan(columns):
+    return ColumnPlan(columns)
+
+
+def get_column_plan(columns):
+    """ヘッダー（列名の並び）ごとにキャッシュした ColumnPlan を返す"""
+    return _cached_plan(tuple(str(column) for column in columns))
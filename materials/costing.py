@@ -0,0 +1,210 @@
+# materials/costing.py - 配合 × 原料単価 による原料費の集計
+import logging
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Formulation, FormulationCost, FormulationLine, Material
+from .purified_water import get_water_index
+
+logger = logging.getLogger(__name__)
+
+# 発注単位 → 単価をkgあたりに換算する係数
+# 未登録の単位（錠・包・空欄など）はkgあたりに換算できないため、単価未設定の明細として数える
+PRICE_UNIT_FACTORS = {'kg': 1, 'L': 1, 'g': 1000}
+
+COST_FIELDS = ['material_cost', 'total_quantity_kg', 'line_count', 'unpriced_line_count']
+
+# IN句に渡すIDの最大件数（SQLiteの変数上限対策）
+ID_CHUNK_SIZE = 500
+
+
+def _to_float(values):
+    """Decimal/None の列を float の numpy 配列に変換（None は NaN）"""
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=float)
+
+
+def compute_costs(formulation_ids=None):
+    """
+    配合明細と原料単価を突き合わせて配合ごとの原料費を計算する
+
+    明細と原料をそれぞれ1クエリで取得し、pandas の merge / groupby で一括計算する。
+    精製水例外リストに該当する明細は、例外の単価（価格 / 単位、kgあたり）で計算する。
+
+    Args:
+        formulation_ids (list): 対象の配合ID（None の場合は全件）
+
+    Returns:
+        DataFrame: index=formulation_id, columns=COST_FIELDS
+    """
+    lines = FormulationLine.objects.all()
+    if formulation_ids is not None:
+        lines = lines.filter(formulation_id__in=formulation_ids)
+
+    line_df = pd.DataFrame.from_records(
+        list(lines.values_list(
+            'formulation_id', 'formulation__product_id', 'formulation__factory', 'material_id', 'quantity_kg'
+        )),
+        columns=['formulation_id', 'product_id', 'factory', 'material_cd', 'quantity_kg'],
+    )
+    if line_df.empty:
+        return pd.DataFrame(columns=COST_FIELDS, index=pd.Index([], name='formulation_id'))
+
+    materials = Material.objects.all()
+    if formulation_ids is not None:
+        materials = materials.filter(material_id__in=lines.values('material_id'))
+    material_df = pd.DataFrame.from_records(
+        list(materials.values_list('material_id', 'unit_price_value', 'order_unit')),
+        columns=['material_cd', 'unit_price', 'order_unit'],
+    )
+
+    df = line_df.merge(material_df, on='material_cd', how='left')
+    quantity = _to_float(df['quantity_kg'])
+    factor = df['order_unit'].fillna('').str.strip().map(PRICE_UNIT_FACTORS).to_numpy(dtype=float)
+    price_per_kg = _to_float(df['unit_price']) * factor
+
+    water_index = get_water_index()
+    if water_index:
+        overrides = [
+            water_index.get(key)
+            for key in zip(df['product_id'], df['factory'], df['material_cd'])
+        ]
+        override_price = _to_float([o.price_per_unit if o else None for o in overrides])
+        has_override = np.array([o is not None for o in overrides], dtype=bool)
+        price_per_kg = np.where(has_override, override_price, price_per_kg)
+
+    df = pd.DataFrame({
+        'formulation_id': df['formulation_id'],
+        'material_cost': np.nan_to_num(quantity * price_per_kg),
+        'total_quantity_kg': np.nan_to_num(quantity),
+        'line_count': 1,
+        'unpriced_line_count': np.isnan(price_per_kg).astype(int),
+    })
+    return df.groupby('formulation_id')[COST_FIELDS].sum()
+
+
+def refresh_costs(formulation_ids=None):
+    """
+    原料費を再計算して FormulationCost に書き込む
+
+    Args:
+        formulation_ids (list): 再計算する配合ID（None の場合は全件）
+
+    Returns:
+        int: 更新した配合数
+    """
+    if formulation_ids is None:
+        formulation_ids = list(Formulation.objects.values_list('id', flat=True))
+        if not formulation_ids:
+            return 0
+        costs = compute_costs()
+    else:
+        formulation_ids = list(formulation_ids)
+        if not formulation_ids:
+            return 0
+        costs = pd.concat([
+            compute_costs(formulation_ids[start:start + ID_CHUNK_SIZE])
+            for start in range(0, len(formulation_ids), ID_CHUNK_SIZE)
+        ])
+
+    objs = []
+    for formulation_id in formulation_ids:
+        if formulation_id in costs.index:
+            row = costs.loc[formulation_id]
+            values = {
+                'material_cost': Decimal(str(round(row['material_cost'], 2))),
+                'total_quantity_kg': Decimal(str(round(row['total_quantity_kg'], 6))),
+                'line_count': int(row['line_count']),
+                'unpriced_line_count': int(row['unpriced_line_count']),
+            }
+        else:
+            values = {}
+        objs.append(FormulationCost(formulation_id=formulation_id, is_stale=False, **values))
+
+    FormulationCost.objects.bulk_create(
+        objs,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['formulation'],
+        update_fields=COST_FIELDS + ['is_stale', 'computed_at'],
+    )
+    logger.info(f"原料費再計算: {len(objs)}件")
+    return len(objs)
+
+
+def mark_costs_stale(material_ids=None, formulation_ids=None):
+    """
+    単価・配合の変更で影響を受ける原料費を「再計算待ち」にする
+
+    再計算はトランザクションのコミット後に行う（画面の表示時には再計算しない）。
+    再計算に失敗しても書き込み自体は取り消さず、ログに残して次の書き込みで再計算する。
+
+    Args:
+        material_ids (list): 単価が変わった原料ID
+        formulation_ids (list): 明細が変わった配合ID
+    """
+    material_ids = list(material_ids or [])
+    for start in range(0, len(material_ids), ID_CHUNK_SIZE):
+        affected = FormulationLine.objects.filter(
+            material_id__in=material_ids[start:start + ID_CHUNK_SIZE]
+        ).values('formulation_id')
+        FormulationCost.objects.filter(formulation_id__in=affected).update(is_stale=True)
+
+    formulation_ids = list(formulation_ids or [])
+    for start in range(0, len(formulation_ids), ID_CHUNK_SIZE):
+        FormulationCost.objects.filter(
+            formulation_id__in=formulation_ids[start:start + ID_CHUNK_SIZE]
+        ).update(is_stale=True)
+
+    transaction.on_commit(refresh_stale_costs, robust=True)
+
+
+def refresh_stale_costs():
+    """再計算待ちと未計算の配合だけを再計算する"""
+    stale_ids = set(FormulationCost.objects.filter(is_stale=True).values_list('formulation_id', flat=True))
+    stale_ids.update(Formulation.objects.filter(cost__isnull=True).values_list('id', flat=True))
+    if not stale_ids:
+        return 0
+    return refresh_costs(stale_ids)
+
+
+def summarize_by_product(queryset=None):
+    """製品（工場・製品ID）単位の原料費（パターン間の最小・最大・平均）"""
+    queryset = queryset if queryset is not None else FormulationCost.objects.all()
+    return (
+        queryset
+        .values('formulation__factory', 'formulation__product_id', 'formulation__product_name')
+        .annotate(
+            pattern_count=Count('formulation'),
+            min_cost=Min('material_cost'),
+            max_cost=Max('material_cost'),
+            avg_cost=Avg('material_cost'),
+        )
+        .order_by('formulation__factory', 'formulation__product_id')
+    )
+
+
+def summarize_by_factory(queryset=None):
+    """工場単位の原料費合計・平均"""
+    queryset = queryset if queryset is not None else FormulationCost.objects.all()
+    return (
+        queryset
+        .values('formulation__factory')
+        .annotate(
+            pattern_count=Count('formulation'),
+            total_cost=Sum('material_cost'),
+            avg_cost=Avg('material_cost'),
+        )
+        .order_by('formulation__factory')
+    )
+
+
+@receiver(post_save, sender=Material)
+def _mark_stale_on_material_save(sender, instance, **kwargs):
+    # 管理画面などで単価が変わった場合。一括読み込みは呼び出し側で mark_costs_stale を呼ぶ
+    mark_costs_stale(material_ids=[instance.material_id])
@@ -1,64 +1,38 @@
 # materials/csv_loader.py - 画像パス正規化対応版
-import pandas as pd
 import os
 from django.conf import settings
 from .models import Material
-from decimal import Decimal
+from .column_mapping import get_column_plan
+from .costing import ID_CHUNK_SIZE, mark_costs_stale
+from .encoding import detect_file_encoding, read_csv
+from .import_jobs import ImportProgress
+from .import_state import (
+    compute_row_hashes, file_content_hash, get_import_state, invalidate_import_state, save_import_state,
+)
+from .search import refresh_search_text
+from .stats import invalidate_material_stats
+from .tracing import Trace
 import logging
-import chardet
-import re
 from django.db import transaction
+from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
 
 class MaterialCSVLoader:
-    def __init__(self):
+    OVERWRITE_MODES = ('update', 'replace', 'skip', 'delta')
+    # 既存行を差分で更新するモード（行ハッシュによる読み飛ばしの対象）
+    INCREMENTAL_MODES = ('update', 'delta')
+    DEFAULT_BATCH_SIZE = 500
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
         self.data_dir = os.path.join(settings.BASE_DIR, 'data')
         self.csv_file = '原料マスタ詳細.csv'
-
-    def normalize_image_path(self, image_path):
-        """
-        画像パスを正規化する関数
-
-        入力例: "images\1.jpg" または "images\\1.jpg"
-        出力例: "images/1.jpg"
-        """
-        if not image_path or pd.isna(image_path) or image_path == '':
-            return ''
-
-        # 文字列に変換
-        path = str(image_path).strip()
-
-        # 空文字チェック
-        if not path:
-            return ''
-
-        # バックスラッシュをフォワードスラッシュに変換
-        path = path.replace('\\', '/')
-
-        # 複数のスラッシュを単一のスラッシュに変換
-        path = re.sub(r'/+', '/', path)
-
-        # 先頭のスラッシュを除去
-        path = path.lstrip('/')
-
-        print(f"画像パス正規化: '{image_path}' → '{path}'")
-        return path
+        self.batch_size = batch_size
 
     def detect_encoding_comprehensive(self, file_path):
-        encodings_to_try = ['cp932', 'shift_jis', 'utf-8', 'utf-8-sig']
-        try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read(50000)
-                detected = chardet.detect(raw_data)
-                if detected['encoding'] and detected['confidence'] > 0.3:
-                    detected_encoding = detected['encoding']
-                    if detected_encoding not in encodings_to_try:
-                        encodings_to_try.insert(0, detected_encoding)
-        except Exception as e:
-            print(f"chardet error: {e}")
-        return encodings_to_try
+        """ファイル先頭だけでエンコーディングを1つに決める（共通の判定を使用）"""
+        return detect_file_encoding(file_path)
 
     def find_csv_files(self):
         if not os.path.exists(self.data_dir):
@@ -66,166 +40,194 @@ class MaterialCSVLoader:
         return [os.path.join(self.data_dir, f) for f in os.listdir(self.data_dir) if f.endswith('.csv')]
 
     def create_column_mapping(self, columns):
-        mapping = {}
-        for col in columns:
-            if col == '原料ID':
-                mapping['material_id'] = col
-            if col == '原料名':
-                mapping['material_name'] = col
-            if col == '製造所':
-                mapping['manufacturer'] = col
-            if col == '販売者':
-                mapping['supplier'] = col
-            if col == '分類':
-                mapping['category'] = col
-            if col == '単価':
-                mapping['unit_price'] = col
-            if col == '正袋重量':
-                mapping['main_bag_weight'] = col
-            if col == 'ラベル用備考':
-                mapping['label_note'] = col
-            if col == '原料区分':
-                mapping['material_category'] = col
-            if col == '荷姿':
-                mapping['packaging'] = col
-            if col == '品質管理備考':
-                mapping['qc_note'] = col
-            if col == '使用剤形':
-                mapping['usage_form'] = col
-            if col == '規格':
-                mapping['standard'] = col
-            if col == '商品名':  # 商品名の追加
-                mapping['product_name'] = col
-            if col == '画像パス':  # 画像パスの追加
-                mapping['image_path'] = col
-        return mapping
-
-    def clean_and_convert_value(self, value, field_name=''):
-        """値のクリーニングと変換"""
-        if pd.isna(value) or value == '':
-            return ''
-
-        value_str = str(value).strip()
-
-        # 画像パスの特別処理
-        if field_name == 'image_path':
-            return self.normalize_image_path(value_str)
-
-        # 数値フィールドの処理
-        if field_name in ['unit_price', 'main_bag_weight']:
-            cleaned = re.sub(r'[,¥\s]', '', value_str)
-            return cleaned if cleaned else '0'
-
-        return value_str
+        """フィールド名 → CSV列名（共通の対応表 column_mapping から作る）"""
+        return get_column_plan(columns).mapping
 
     def load_materials(self):
         """従来のload_materials（互換性維持）"""
         return self.load_materials_with_overwrite('update')
 
-    def load_materials_with_overwrite(self, overwrite_mode='update'):
+    def load_materials_with_overwrite(self, overwrite_mode='update', batch_size=None, progress=None):
         """
         上書きモード対応のCSV読み込み
 
+        既存の原料IDを1クエリで取得してメモリ上で差分を取り、
+        bulk_create / bulk_update でバッチ単位に書き込む（バッチごとにコミット）。
+
         Args:
             overwrite_mode (str):
                 'update' - 既存データを更新（推奨）
                 'replace' - 既存データを削除して新規作成
                 'skip' - 既存データをスキップ
+                'delta' - 差分のみ反映し、CSVから消えた原料を無効化
+            batch_size (int): 1回の一括SQLで処理する件数（省略時は self.batch_size）
+            progress (ImportProgress): 進捗の通知先（バックグラウンドジョブ用）
         """
+        if overwrite_mode not in self.OVERWRITE_MODES:
+            return {'success': False, 'error': f'不明な上書きモード: {overwrite_mode}'}
+        batch_size = batch_size or self.batch_size
+        progress = progress or ImportProgress()
+        # 区間ごとの所要時間と件数を、取り込み1回につき1行だけログに出す
+        trace = Trace('import.materials', logger, mode=overwrite_mode)
+
         try:
             csv_files = self.find_csv_files()
             if not csv_files:
+                trace.status = 'failed'
                 return {'success': False, 'error': 'CSVファイルが見つかりません'}
 
             file_path = csv_files[0]
-            encodings = self.detect_encoding_comprehensive(file_path)
-            df = None
-            used_encoding = None
-
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding, dtype=str)
-                    used_encoding = encoding
-                    print(f"CSVファイルを {encoding} で読み込み成功")
-                    break
-                except Exception as e:
-                    print(f"エンコーディング {encoding} で読み込み失敗: {e}")
-                    continue
-
-            if df is None:
-                return {'success': False, 'error': 'CSVファイルを読み込めません'}
-
-            df = df.fillna('')
-            mapping = self.create_column_mapping(df.columns)
-
-            if 'material_id' not in mapping:
+            source = os.path.basename(file_path)
+            trace.set(source=source)
+            with trace.span('hash'):
+                content_hash = file_content_hash(file_path)
+                state = get_import_state(source)
+
+            # 前回取り込んだファイルと内容が同じなら読み込まない
+            if overwrite_mode in self.INCREMENTAL_MODES and state and state.content_hash == content_hash:
+                trace.set(file_unchanged=True)
+                with trace.span('write'):
+                    if overwrite_mode == 'delta':
+                        flags = self._sync_active_flags(set(state.row_hashes))
+                    else:
+                        # 読み込む場合と同じく全データを有効化する（管理画面で無効化した原料も戻す）
+                        reactivated = Material.objects.filter(is_active=False).update(is_active=True)
+                        flags = {'deactivated': 0, 'reactivated': reactivated}
+                    if any(flags.values()):
+                        invalidate_material_stats()
+                        save_import_state(
+                            source, state.content_hash, state.encoding, state.columns,
+                            state.row_hashes, state.row_count,
+                        )
+                updated = state.row_count if overwrite_mode == 'update' else 0
+                trace.counters.update(rows=state.row_count, unchanged=state.row_count, **flags)
+                progress.start(state.row_count)
+                progress.update(state.row_count, updated=updated)
+                return {
+                    'success': True,
+                    'created': 0,
+                    'updated': updated,
+                    'skipped': 0,
+                    'total_rows': state.row_count,
+                    'encoding_used': state.encoding,
+                    'columns': state.columns,
+                    'overwrite_mode': overwrite_mode,
+                    'errors': [],
+                    'image_paths_processed': 0,
+                    'unchanged': state.row_count,
+                    'file_unchanged': True,
+                    **flags,
+                }
+
+            # decode はエンコーディング判定、parse は本体のデコードを含む pd.read_csv
+            with trace.span('decode'):
+                detect_file_encoding(file_path)
+            with trace.span('parse'):
+                df, used_encoding = read_csv(file_path, dtype=str)
+                df = df.fillna('')
+            trace.set(encoding=used_encoding)
+            trace.count('rows', len(df))
+            plan = get_column_plan(df.columns)
+
+            if not plan.has('material_id'):
+                trace.status = 'failed'
                 return {'success': False, 'error': '原料ID列が見つかりません'}
 
+            # 前回と行ハッシュが同じ行は、更新・差分モードでは読み飛ばす
+            id_column = plan.column_for('material_id')
+            with trace.span('hash'):
+                row_hashes = compute_row_hashes(df, id_column)
+                previous_hashes = {}
+                if overwrite_mode in self.INCREMENTAL_MODES and state and state.columns == list(df.columns):
+                    previous_hashes = state.row_hashes
+                unchanged_ids = {
+                    material_id for material_id, row_hash in row_hashes.items()
+                    if previous_hashes.get(material_id) == row_hash
+                }
+                target = df
+                if unchanged_ids:
+                    target = df[~df[id_column].str.strip().isin(unchanged_ids)]
+            hash_unchanged = len(df) - len(target)
+
             created = 0
-            updated = 0
+            updated = hash_unchanged
             skipped = 0
-            errors = []
             image_path_processed = 0
 
-            print(f"データ処理開始: {len(df)}行")
+            progress.start(len(df))
 
-            with transaction.atomic():
-                for idx, row in df.iterrows():
-                    try:
-                        material_id = self.clean_and_convert_value(row[mapping['material_id']], 'material_id')
-
-                        if not material_id:
-                            skipped += 1
-                            continue
-
-                        values = {}
-                        for field, col in mapping.items():
-                            if field != 'material_id':
-                                cleaned_value = self.clean_and_convert_value(row[col], field)
-                                values[field] = cleaned_value
-
-                                # 画像パス処理のログ
-                                if field == 'image_path' and cleaned_value:
-                                    image_path_processed += 1
-                                    print(f"画像パス処理 {image_path_processed}: {row[col]} → {cleaned_value}")
-
-                        # 上書きモード処理
-                        if overwrite_mode == 'update':
-                            # 既存データを更新、なければ新規作成
-                            material, was_created = Material.objects.update_or_create(
-                                material_id=material_id,
-                                defaults=values
-                            )
-                            if was_created:
-                                created += 1
-                            else:
-                                updated += 1
-
-                        elif overwrite_mode == 'replace':
-                            # 既存データを削除してから新規作成
-                            Material.objects.filter(material_id=material_id).delete()
-                            values['material_id'] = material_id
-                            Material.objects.create(**values)
-                            created += 1
+            # 1. 列ごとにまとめて変換し、行ごとに原料ID → 値の辞書にする（DBアクセスなし）
+            with trace.span('clean'):
+                fields = plan.value_fields()
+                converted = plan.convert(target, derived=True)
+                if 'image_path' in converted:
+                    image_path_processed = int((converted['image_path'] != '').sum())
 
-                        elif overwrite_mode == 'skip':
-                            # 既存データがあればスキップ
-                            if Material.objects.filter(material_id=material_id).exists():
-                                skipped += 1
-                            else:
-                                values['material_id'] = material_id
-                                Material.objects.create(**values)
-                                created += 1
-
-                    except Exception as e:
-                        error_msg = f"行{idx + 1}: {str(e)}"
-                        errors.append(error_msg)
-                        print(f"エラー: {error_msg}")
+                rows = {}
+                columns = [converted[field].tolist() for field in fields]
+                for material_id, *values in zip(converted['material_id'].tolist(), *columns):
+                    if not material_id:
                         skipped += 1
                         continue
 
-            # 全データを有効化
-            Material.objects.all().update(is_active=True)
+                    # ファイル内の重複ID（後の行を使う）
+                    if material_id in rows:
+                        trace.detail('ファイル内で重複した原料ID: %s', material_id)
+                        if overwrite_mode == 'skip':
+                            skipped += 1
+                            continue
+                        if overwrite_mode in self.INCREMENTAL_MODES:
+                            updated += 1
+                        else:
+                            created += 1
+                    rows[material_id] = dict(zip(fields, values))
+
+            # 2. 既存IDを1クエリで取得し、メモリ上で差分を計算して一括反映
+            with trace.span('diff'):
+                current_values = Material.objects.values_list('material_id', 'id', *fields)
+                if unchanged_ids:
+                    # 変更のあった行だけを照合する
+                    ids = list(rows)
+                    existing = {
+                        row[0]: (row[1], row[2:])
+                        for start in range(0, len(ids), ID_CHUNK_SIZE)
+                        for row in current_values.filter(material_id__in=ids[start:start + ID_CHUNK_SIZE])
+                    }
+                else:
+                    existing = {row[0]: (row[1], row[2:]) for row in current_values}
+            # 読み込み済みの行（原料ID空・解析エラー・ファイル内重複）の件数を進捗の起点にする
+            offset = {'processed': len(df) - len(rows), 'created': created, 'updated': updated, 'skipped': skipped}
+            result_counts = self._bulk_apply(
+                rows, existing, fields, overwrite_mode, batch_size, progress, offset, trace=trace
+            )
+
+            mark_costs_stale(material_ids=result_counts['changed_ids'])
+            if not plan.has_search_sources:
+                # 検索対象の列が足りないファイルは、書き込んだ行の検索用テキストをDBの値から作り直す
+                refresh_search_text(result_counts['changed_ids'])
+
+            created += result_counts['created']
+            updated += result_counts['updated']
+            skipped += result_counts['skipped']
+            errors = result_counts['errors']
+
+            with trace.span('write'):
+                if overwrite_mode == 'delta':
+                    # CSVから消えた原料を無効化し、CSVに戻った原料を有効化する
+                    flags = self._sync_active_flags(set(row_hashes))
+                    # 差分モードでは実際に内容が変わった行だけを更新件数にする
+                    updated -= hash_unchanged + result_counts['unchanged']
+                else:
+                    # 全データを有効化（無効な行だけを更新）
+                    Material.objects.filter(is_active=False).update(is_active=True)
+                    flags = {'deactivated': 0, 'reactivated': 0}
+                invalidate_material_stats()
+
+                # 読み込んだ内容をDBに反映できたときだけハッシュを記録する
+                if overwrite_mode in ('update', 'replace', 'delta') and not errors:
+                    save_import_state(source, content_hash, used_encoding, df.columns, row_hashes, len(df))
+                else:
+                    invalidate_import_state(source)
 
             result = {
                 'success': True,
@@ -237,17 +239,158 @@ class MaterialCSVLoader:
                 'columns': list(df.columns),
                 'overwrite_mode': overwrite_mode,
                 'errors': errors[:5] if errors else [],
-                'image_paths_processed': image_path_processed
+                'image_paths_processed': image_path_processed,
+                'unchanged': result_counts['unchanged'] + hash_unchanged,
+                **flags,
             }
 
-            print(f"処理完了: 作成{created}, 更新{updated}, スキップ{skipped}, 画像パス処理{image_path_processed}")
+            trace.counters.update(
+                created=created, updated=updated, skipped=skipped,
+                unchanged=result['unchanged'], image_paths=image_path_processed, **flags,
+            )
             return result
 
         except Exception as e:
             error_msg = f"CSV読み込みエラー: {str(e)}"
-            print(error_msg)
+            trace.status = 'error'
+            trace.set(error=str(e))
+            logger.exception(error_msg)
             return {'success': False, 'error': error_msg}
 
+        finally:
+            trace.emit(logging.ERROR if trace.status == 'error' else None)
+
+    def _bulk_apply(self, rows, existing, fields, overwrite_mode, batch_size, progress=None, offset=None,
+                    trace=None):
+        """
+        メモリ上で差分を取り、batch_size 件ずつ一括SQLで反映する
+
+        バッチごとにトランザクションをコミットするため、大きなファイルでも
+        SQLite の書き込みロックを長時間保持しない。
+
+        Args:
+            rows (dict): 原料ID → フィールド値の辞書
+            existing (dict): DB上の原料ID → (主キー, 現在値のタプル)
+            fields (list): 書き込み対象フィールド名
+            progress (ImportProgress): バッチごとの進捗の通知先
+            offset (dict): 進捗に加算する読み込み段階の件数
+            trace (Trace): 差分計算（diff）と書き込み（write）の所要時間の記録先
+        """
+        progress = progress or ImportProgress()
+        offset = offset or {}
+        trace = trace or Trace('import.materials.apply', logger)
+        counts = {'created': 0, 'updated': 0, 'skipped': 0, 'unchanged': 0, 'changed_ids': [], 'errors': []}
+        items = list(rows.items())
+
+        for start in range(0, len(items), batch_size):
+            to_create = []
+            to_upsert = []
+            to_delete = {}  # 置換モードで削除する既存行（原料ID → 主キー）
+
+            with trace.span('diff'):
+                for material_id, values in items[start:start + batch_size]:
+                    current = existing.get(material_id)
+                    if current is None:
+                        to_create.append(Material(material_id=material_id, **values))
+                        counts['created'] += 1
+                    elif overwrite_mode in self.INCREMENTAL_MODES:
+                        counts['updated'] += 1
+                        if current[1] == tuple(values[field] for field in fields):
+                            counts['unchanged'] += 1
+                        else:
+                            to_upsert.append(Material(material_id=material_id, **values))
+                    elif overwrite_mode == 'replace':
+                        to_delete[material_id] = current[0]
+                        to_create.append(Material(material_id=material_id, **values))
+                        counts['created'] += 1
+                    else:
+                        counts['skipped'] += 1
+
+            with trace.span('write'):
+                try:
+                    with transaction.atomic():
+                        self._write_rows(list(to_delete.values()), to_create, to_upsert, fields, batch_size)
+                    written = to_create + to_upsert
+                except Exception:
+                    # 失敗したバッチだけ1行ずつ書き直し、書き込めなかった行をエラーとして記録する
+                    trace.count('batch_fallbacks')
+                    written = []
+                    for obj, kind in [(obj, 'created') for obj in to_create] + [(obj, 'updated') for obj in to_upsert]:
+                        pk = to_delete.get(obj.material_id)
+                        try:
+                            with transaction.atomic():
+                                self._write_rows(
+                                    [pk] if pk else [], [obj] if kind == 'created' else [],
+                                    [obj] if kind == 'updated' else [], fields, batch_size,
+                                )
+                            written.append(obj)
+                        except Exception as e:
+                            message = f"原料ID {obj.material_id}: {e}"
+                            trace.detail('行処理エラー %s', message)
+                            counts['errors'].append(message)
+                            progress.error(None, obj.material_id, str(e))
+                            counts[kind] -= 1
+                            counts['skipped'] += 1
+
+            counts['changed_ids'].extend(obj.material_id for obj in written)
+            progress.update(
+                offset.get('processed', 0) + min(start + batch_size, len(items)),
+                created=offset.get('created', 0) + counts['created'],
+                updated=offset.get('updated', 0) + counts['updated'],
+                skipped=offset.get('skipped', 0) + counts['skipped'],
+            )
+
+        return counts
+
+    def _write_rows(self, to_delete, to_create, to_upsert, fields, batch_size):
+        """削除（置換モード）・新規作成・更新を一括SQLで書き込む（呼び出し側で transaction.atomic() の中から呼ぶ）"""
+        if to_delete:
+            Material.objects.filter(pk__in=to_delete).delete()
+
+        if to_create:
+            Material.objects.bulk_create(to_create, batch_size=batch_size)
+
+        if to_upsert:
+            # INSERT ... ON CONFLICT(material_id) DO UPDATE で既存行を更新
+            Material.objects.bulk_create(
+                to_upsert,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['material_id'],
+                update_fields=fields + ['updated_at'],
+            )
+
+    def _sync_active_flags(self, file_ids):
+        """
+        原料ID・有効フラグだけを1クエリで取得して集合の差分を取り、
+        CSVにない有効な原料を無効化・CSVにある無効な原料を有効化する
+
+        Args:
+            file_ids (set): CSVに含まれる原料ID
+
+        Returns:
+            dict: {'deactivated': 件数, 'reactivated': 件数}
+        """
+        removed = []
+        restored = []
+        for material_id, is_active in Material.objects.values_list('material_id', 'is_active'):
+            if material_id in file_ids:
+                if not is_active:
+                    restored.append(material_id)
+            elif is_active:
+                removed.append(material_id)
+
+        if removed or restored:
+            now = timezone.now()
+            with transaction.atomic():
+                for ids, is_active in ((removed, False), (restored, True)):
+                    for start in range(0, len(ids), ID_CHUNK_SIZE):
+                        Material.objects.filter(material_id__in=ids[start:start + ID_CHUNK_SIZE]).update(
+                            is_active=is_active, updated_at=now
+                        )
+            logger.debug(f"有効フラグを同期: 無効化{len(removed)}件, 有効化{len(restored)}件")
+        return {'deactivated': len(removed), 'reactivated': len(restored)}
+
     def analyze_csv_structure(self):
         """CSV構造分析（既存メソッド）"""
         try:
@@ -256,32 +399,24 @@ class MaterialCSVLoader:
                 return {'success': False, 'error': 'CSVファイルが見つかりません'}
 
             file_path = csv_files[0]
-            encodings = self.detect_encoding_comprehensive(file_path)
+            df, encoding = read_csv(file_path, nrows=5)
 
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding, nrows=5)
-
-                    # 重複チェック
-                    duplicates = 0
-                    unique_ids = 0
-                    if '原料ID' in df.columns:
-                        duplicates = df['原料ID'].duplicated().sum()
-                        unique_ids = df['原料ID'].nunique()
-
-                    return {
-                        'success': True,
-                        'encoding': encoding,
-                        'total_rows': len(df),
-                        'columns': list(df.columns),
-                        'duplicates_in_sample': duplicates,
-                        'unique_ids_in_sample': unique_ids,
-                        'recommended_mapping': self.create_column_mapping(df.columns)
-                    }
-                except Exception:
-                    continue
+            # 重複チェック
+            duplicates = 0
+            unique_ids = 0
+            if '原料ID' in df.columns:
+                duplicates = df['原料ID'].duplicated().sum()
+                unique_ids = df['原料ID'].nunique()
 
-            return {'success': False, 'error': '読み込み可能なエンコーディングが見つかりません'}
+            return {
+                'success': True,
+                'encoding': encoding,
+                'total_rows': len(df),
+                'columns': list(df.columns),
+                'duplicates_in_sample': duplicates,
+                'unique_ids_in_sample': unique_ids,
+                'recommended_mapping': self.create_column_mapping(df.columns)
+            }
 
         except Exception as e:
             return {'success': False, 'error': str(e)}
\ No newline at end of file
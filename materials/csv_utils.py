@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
-import pandas as pd
 import os
 from django.conf import settings
-from .models import Material, Prod
-from decimal import Decimal
+from .column_mapping import get_column_plan
+from .encoding import read_csv
+from .models import Material
+from .product_loader import ProductCSVLoader
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class CSVDataLoader:
-    """CSV Data Loader Class"""F
+    """CSV Data Loader Class"""
 
     def __init__(self):
         self.data_dir = os.path.join(settings.BASE_DIR, 'data')
@@ -41,61 +42,29 @@ class CSVDataLoader:
             if not file_path:
                 raise FileNotFoundError("Material master file not found")
 
-            # Try different encodings
-            encodings = ['cp932', 'shift_jis', 'utf-8', 'utf-8-sig']
-            df = None
-
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(file_path, encoding=encoding, dtype=str)
-                    logger.info(f"Successfully loaded with encoding: {encoding}")
-                    break
-                except UnicodeDecodeError:
-                    continue
-
-            if df is None:
-                raise ValueError("Cannot read CSV file with any encoding")
+            df, encoding = read_csv(file_path, dtype=str)
+            logger.info(f"Successfully loaded with encoding: {encoding}")
 
             # Data cleaning
             df = df.fillna('')
             available_columns = df.columns.tolist()
             logger.info(f"Available columns: {available_columns}")
 
+            # Column mapping shared with the other material importers
+            plan = get_column_plan(available_columns)
+            if not plan.has('material_id'):
+                raise ValueError("Material ID column not found")
+            converted = plan.convert(df)
+            names = converted['material_name'] if 'material_name' in converted else [''] * len(df)
+            prices = converted['unit_price'] if 'unit_price' in converted else ['0'] * len(df)
+
             materials_created = 0
             materials_updated = 0
 
-            for _, row in df.iterrows():
-                # Get material ID
-                material_id = None
-                for col in available_columns:
-                    if any(keyword in col for keyword in ['ID', 'id', 'CD', 'cd']):
-                        if pd.notna(row[col]) and str(row[col]).strip():
-                            material_id = str(row[col]).strip()
-                            break
-
+            for material_id, material_name, unit_price in zip(converted['material_id'], names, prices):
                 if not material_id:
                     continue
 
-                # Get material name
-                material_name = ''
-                for col in available_columns:
-                    if any(keyword in col for keyword in ['name', 'Name']):
-                        if pd.notna(row[col]):
-                            material_name = str(row[col]).strip()
-                            break
-
-                # Get unit price
-                unit_price = Decimal('0')
-                for col in available_columns:
-                    if any(keyword in col for keyword in ['price', 'Price']):
-                        if pd.notna(row[col]):
-                            try:
-                                price_str = str(row[col]).replace(',', '').replace('¥', '')
-                                unit_price = Decimal(price_str) if price_str else Decimal('0')
-                                break
-                            except:
-                                pass
-
                 # Save to database
                 material, created = Material.objects.get_or_create(
                     material_id=material_id,
@@ -129,6 +98,12 @@ class CSVDataLoader:
                 'error': str(e)
             }
 
+    def load_product_master(self):
+        """Load Product Master CSV (製品ID管理.csv)"""
+        loader = ProductCSVLoader()
+        loader.data_dir = self.data_dir
+        return loader.load_products()
+
     def get_csv_info(self):
         """Get CSV file information"""
         csv_info = {}
@@ -0,0 +1,89 @@
+# materials/data_version.py - 原料データの版（画面キャッシュ・ETag 用）
+"""
+原料データが変わるたびに新しい版（トークン）を発行する。
+
+- 取り込み・管理画面の操作・save()/delete() で呼ばれる invalidate_material_stats() が bump_data_version() を呼ぶ
+- 画面側は版をキャッシュキーと ETag に含める（版が変われば自動的に作り直し）
+- 一覧ページは取得結果をキャッシュする（HTML は CSRF トークン・メッセージを含むためキャッシュしない）
+
+Last-Modified は秒単位で同じ秒の更新を区別できないため使わない。
+
+版はキャッシュではなくDB（DataVersion）に置く。プロセスごとのキャッシュ（LocMemCache）で
+複数のワーカーを動かしても、他のワーカーでの更新がすぐに次の表示の ETag・キャッシュキーに反映される。
+（キャッシュに残った他の版のデータは使われず、時間切れで消える）
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.session import SessionStorage
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from .models import DataVersion
+
+DATA_VERSION_NAME = 'materials'
+
+# テンプレートを変更したときに上げる（ブラウザ・画面キャッシュの古い HTML を使わせない）
+PAGE_CACHE_VERSION = getattr(settings, 'MATERIAL_PAGE_CACHE_VERSION', '1')
+
+# 一覧ページの取得結果（行・前後のカーソル・件数）を保持する秒数
+LIST_PAGE_CACHE_TIMEOUT = getattr(settings, 'MATERIAL_LIST_PAGE_CACHE_TIMEOUT', 60)
+
+
+def _new_version():
+    return f'{time.time_ns():x}'
+
+
+def get_data_version():
+    """現在の版（トークン文字列）を返す（まだ更新がなければ最初の版を発行する）"""
+    version = DataVersion.objects.filter(name=DATA_VERSION_NAME).values_list('version', flat=True).first()
+    if version is None:
+        # 同時に発行された場合は先に保存されたほうを使う
+        version = DataVersion.objects.get_or_create(
+            name=DATA_VERSION_NAME, defaults={'version': _new_version()}
+        )[0].version
+    return version
+
+
+def bump_data_version():
+    """原料データの更新後に新しい版を発行する"""
+    DataVersion.objects.update_or_create(name=DATA_VERSION_NAME, defaults={'version': _new_version()})
+
+
+def versioned_key(*parts):
+    """
+    版と parts（画面の条件）からキャッシュキーの部分を作る（版が変わると別のキーになる）
+
+        cache_get('list', *versioned_key(filters, cursor))
+    """
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+    return PAGE_CACHE_VERSION, get_data_version(), digest
+
+
+def _has_pending_messages(request):
+    # 表示待ちのメッセージがあるときは 304 を返さない（メッセージが表示されなくなるため）
+    if CookieStorage.cookie_name in request.COOKIES:
+        return True
+    session = getattr(request, 'session', None)
+    return session is not None and SessionStorage.session_key in session
+
+
+def page_etag(request, *args, **kwargs):
+    """
+    版・URL（クエリ文字列を含む）・ユーザーから ETag を作る（django.views.decorators.http.condition 用）
+
+    表示待ちのメッセージがあるときは None（条件付き GET をしない）。
+    """
+    if _has_pending_messages(request):
+        return None
+    user_id = getattr(getattr(request, 'user', None), 'pk', None)
+    key = f'{PAGE_CACHE_VERSION}|{get_data_version()}|{user_id}|{request.get_full_path()}'
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def revalidate(response):
+    """ブラウザにキャッシュさせつつ、表示のたびに ETag で確認させる（ユーザーごとのキャッシュ）"""
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
@@ -0,0 +1,125 @@
+# materials/encoding.py - CSVのエンコーディング判定（全ローダー共通）
+"""
+CSVファイルのエンコーディングを1つに決めてから1回だけ読み込む。
+
+- BOM があれば utf-8-sig
+- 先頭 SNIFF_BYTES を UTF-8 → cp932 の順に厳密デコードし、最初に通ったもの
+- 判定結果は (パス, 更新日時, サイズ) ごとにプロセス内でキャッシュする
+
+先頭が ASCII だけのファイルは UTF-8 と判定されるため、後半でデコードに
+失敗したときだけもう一方のエンコーディングで読み直す（通常は1回のパースで済む）。
+"""
+import codecs
+import logging
+import os
+import threading
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SNIFF_BYTES = 64 * 1024
+CANDIDATES = ('utf-8', 'cp932')
+FALLBACK_ENCODING = 'cp932'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def sniff_encoding(data, final=False):
+    """
+    バイト列からエンコーディングを判定する
+
+    Args:
+        data (bytes): ファイル全体または先頭部分
+        final (bool): data がファイル全体なら True（途中で切れた文字をエラーにする）
+
+    Returns:
+        str: 'utf-8-sig' / 'utf-8' / 'cp932'
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    for encoding in CANDIDATES:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(data, final=final)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return FALLBACK_ENCODING
+
+
+def _file_key(file_path):
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size
+
+
+def detect_file_encoding(file_path):
+    """ファイル先頭だけを読んでエンコーディングを判定する（更新されるまでキャッシュ）"""
+    key = _file_key(file_path)
+    with _cache_lock:
+        cached = _cache.get(key[0])
+        if cached and cached[0] == key:
+            return cached[1]
+
+    with open(file_path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    encoding = sniff_encoding(head, final=len(head) < SNIFF_BYTES)
+    _remember(key, encoding)
+    return encoding
+
+
+def _remember(key, encoding):
+    with _cache_lock:
+        _cache[key[0]] = (key, encoding)
+
+
+def _alternative(encoding):
+    return 'utf-8' if encoding == FALLBACK_ENCODING else FALLBACK_ENCODING
+
+
+def retry_encoding(file_path, encoding, error):
+    """
+    判定したエンコーディングで読めなかったファイルを読み直すときのエンコーディング
+
+    chunksize などで自前に読み進めるローダー用。読み直しに成功したら remember_encoding() を呼ぶ。
+    """
+    retry = _alternative(encoding)
+    logger.warning(f"{os.path.basename(file_path)}: {encoding} で読み込めないため {retry} で再読み込み ({error})")
+    return retry
+
+
+def remember_encoding(file_path, encoding):
+    """読み込めたエンコーディングを判定結果のキャッシュに記録する"""
+    _remember(_file_key(file_path), encoding)
+
+
+def read_csv(file_path, **kwargs):
+    """
+    判定したエンコーディングで pd.read_csv を1回だけ実行する
+
+    Returns:
+        (DataFrame, エンコーディング)
+    """
+    encoding = detect_file_encoding(file_path)
+    try:
+        return pd.read_csv(file_path, encoding=encoding, **kwargs), encoding
+    except UnicodeDecodeError as e:
+        retry = retry_encoding(file_path, encoding, e)
+        df = pd.read_csv(file_path, encoding=retry, **kwargs)
+        remember_encoding(file_path, retry)
+        return df, retry
+
+
+def decode_bytes(data):
+    """
+    アップロードされたバイト列を判定したエンコーディングで1回だけデコードする
+
+    Returns:
+        (str, エンコーディング)
+    """
+    encoding = sniff_encoding(data[:SNIFF_BYTES], final=len(data) <= SNIFF_BYTES)
+    try:
+        return data.decode(encoding), encoding
+    except UnicodeDecodeError:
+        retry = _alternative(encoding)
+        return data.decode(retry), retry
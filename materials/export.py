@@ -0,0 +1,155 @@
+# materials/export.py - CSV出力（ストリーミング）
+"""
+QuerySet を values_list().iterator() で少しずつ読み、CSV にしながらそのまま送信する。
+行数に関係なくメモリ使用量は一定（EXPORT_CHUNK_SIZE 行分）。
+
+    columns = [ExportColumn('原料ID', 'material_id'), ExportColumn('有効', 'is_active', format_active)]
+    return streaming_csv_response(queryset, columns, '原料一覧.csv', encoding='cp932')
+
+エンコーディングは Excel でそのまま開ける cp932（既定）と utf-8-sig（BOM 付き UTF-8）。
+cp932 で表せない文字は '?' に置き換える。
+"""
+import codecs
+import csv
+import io
+from collections import namedtuple
+from urllib.parse import quote
+
+from django.http import StreamingHttpResponse
+
+EXPORT_CHUNK_SIZE = 2000
+
+# 画面の選択肢 → Python のエンコーディング名
+EXPORT_ENCODINGS = {
+    'cp932': 'cp932',
+    'utf-8': 'utf-8-sig',
+}
+DEFAULT_EXPORT_ENCODING = 'cp932'
+
+# 見出し・フィールド名（__ で関連先も可）・値の変換関数（None なら '' にするだけ）
+ExportColumn = namedtuple('ExportColumn', ['header', 'field', 'formatter'], defaults=[None])
+
+
+def format_datetime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+
+def format_active(value):
+    return '有効' if value else '無効'
+
+
+def resolve_encoding(name):
+    """リクエストの encoding パラメータを出力用のエンコーディングにする（不明なら cp932）"""
+    return EXPORT_ENCODINGS.get(name or DEFAULT_EXPORT_ENCODING, EXPORT_ENCODINGS[DEFAULT_EXPORT_ENCODING])
+
+
+def iter_csv(queryset, columns, encoding='cp932', chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    見出し行と各行を CSV のバイト列として chunk_size 行ずつ返すジェネレータ
+
+    Args:
+        queryset (QuerySet): 並び順を付けた QuerySet
+        columns (list): ExportColumn のリスト
+        encoding (str): 'cp932' / 'utf-8-sig'
+    """
+    # 変換は値の種類ごとに1回だけ（一括取り込みした行は作成日時・更新日時が同じものが多い）
+    formatters = [(index, column.formatter, {}) for index, column in enumerate(columns) if column.formatter]
+    # BOM は先頭に1回だけ付け、以降は BOM なしの UTF-8 でエンコードする
+    prefix = codecs.BOM_UTF8 if encoding == 'utf-8-sig' else b''
+    if prefix:
+        encoding = 'utf-8'
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+
+    def flush():
+        data = buffer.getvalue().encode(encoding, errors='replace')
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow([column.header for column in columns])
+    yield prefix + flush()
+
+    rows = queryset.values_list(*[column.field for column in columns]).iterator(chunk_size=chunk_size)
+    count = 0
+    for row in rows:
+        if formatters:
+            row = list(row)
+            for index, formatter, formatted in formatters:
+                value = row[index]
+                if value not in formatted:
+                    formatted[value] = formatter(value)
+                row[index] = formatted[value]
+        writer.writerow(row)
+        count += 1
+        if count % chunk_size == 0:
+            yield flush()
+            for _, _, formatted in formatters:
+                formatted.clear()
+    if buffer.tell():
+        yield flush()
+
+
+def streaming_csv_response(queryset, columns, filename, encoding='cp932'):
+    """CSV をストリーミングで返すレスポンス（日本語のファイル名は filename* で渡す）"""
+    charset = 'shift_jis' if encoding == 'cp932' else 'utf-8'
+    response = StreamingHttpResponse(
+        iter_csv(queryset, columns, encoding), content_type=f'text/csv; charset={charset}'
+    )
+    # filename* に対応していないクライアント用（ASCII 部分が拡張子だけなら export.csv）
+    fallback = filename.encode('ascii', errors='ignore').decode()
+    if not fallback.rsplit('.', 1)[0]:
+        fallback = 'export.csv'
+    response['Content-Disposition'] = (
+        f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(filename)}'
+    )
+    return response
+
+
+# 原料（管理画面の選択・一覧画面の検索結果）
+MATERIAL_EXPORT_COLUMNS = [
+    ExportColumn('原料ID', 'material_id'),
+    ExportColumn('原料名', 'material_name'),
+    ExportColumn('メーカー', 'manufacturer'),
+    ExportColumn('発注先', 'supplier'),
+    ExportColumn('分類', 'category'),
+    ExportColumn('単価', 'unit_price'),
+    ExportColumn('正袋重量', 'main_bag_weight'),
+    ExportColumn('ラベル用備考', 'label_note'),
+    ExportColumn('原料区分', 'material_category'),
+    ExportColumn('有効', 'is_active', format_active),
+    ExportColumn('作成日時', 'created_at', format_datetime),
+    ExportColumn('更新日時', 'updated_at', format_datetime),
+]
+
+# 配合別原料費
+FORMULATION_COST_EXPORT_COLUMNS = [
+    ExportColumn('工場', 'formulation__factory'),
+    ExportColumn('製品ID', 'formulation__product_id'),
+    ExportColumn('パターン', 'formulation__pattern'),
+    ExportColumn('製品名', 'formulation__product_name'),
+    ExportColumn('配合量合計(kg)', 'total_quantity_kg'),
+    ExportColumn('原料費', 'material_cost'),
+    ExportColumn('明細数', 'line_count'),
+    ExportColumn('単価未設定の明細数', 'unpriced_line_count'),
+    ExportColumn('計算日時', 'computed_at', format_datetime),
+]
+
+# 配合明細
+FORMULATION_LINE_EXPORT_COLUMNS = [
+    ExportColumn('工場', 'formulation__factory'),
+    ExportColumn('製品ID', 'formulation__product_id'),
+    ExportColumn('パターン', 'formulation__pattern'),
+    ExportColumn('製品名', 'formulation__product_name'),
+    ExportColumn('原料CD', 'material_id'),
+    ExportColumn('原料名', 'material_name'),
+    ExportColumn('製造所', 'manufacturer'),
+    ExportColumn('補正区分', 'correction_type'),
+    ExportColumn('配合量(kg)', 'quantity_kg'),
+    ExportColumn('秤量区分', 'weighing_type'),
+    ExportColumn('秤量場所', 'weighing_place'),
+    ExportColumn('投入G番号', 'input_group_no'),
+    ExportColumn('投入G名称', 'input_group_name'),
+    ExportColumn('使用状況', 'usage_status'),
+    ExportColumn('備考', 'note'),
+]
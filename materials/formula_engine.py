@@ -0,0 +1,452 @@
+# materials/formula_engine.py - 計算式ルール.csv のセル計算式エンジン
+"""
+計算式ルール.csv の Excel 形式の計算式（例: "=+G34/G3", "=D36/(1000/100)"）を
+一度だけ解析・コンパイルし、製品ごとの計算プランとしてキャッシュする。
+
+- 計算式は Python の ast で解析し、数値・セル参照・四則演算・べき乗・括弧のみを許可する
+- 数値はすべて float で計算する（"=9^9^9" のような整数のべき乗で計算が終わらなくならないように）
+- セル間の依存関係をトポロジカルソートし、依存順に評価する
+- 原料ごとの値（G34 = 配合量）は numpy 配列で渡し、配合の全明細を一括で評価する
+"""
+import ast
+import logging
+import os
+import re
+import threading
+from graphlib import CycleError, TopologicalSorter
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .encoding import read_csv
+
+logger = logging.getLogger(__name__)
+
+CELL_RE = re.compile(r'^[A-Z]{1,3}[1-9][0-9]*$')
+
+# 製品マスタ（製品ID管理）のフィールド → 計算式で参照されるセル
+PRODUCT_INPUT_CELLS = {
+    'G3': 'fill_volume',
+    'F40': 'batch_volume_a',
+    'F41': 'yield_count_a',
+    'Z41': 'yield_count_a',
+    'B36': 'calc_b36',
+}
+# 配合明細ごとの入力セル
+LINE_INPUT_CELLS = {
+    'G34': 'quantity_kg',
+}
+
+_ALLOWED_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)
+_ALLOWED_UNARYOPS = (ast.UAdd, ast.USub)
+
+
+class FormulaError(ValueError):
+    """計算式の解析・評価エラー"""
+
+
+class CompiledFormula:
+    """コンパイル済みの計算式"""
+
+    def __init__(self, source, code, refs):
+        self.source = source
+        self.code = code
+        self.refs = refs
+
+    def evaluate(self, values):
+        return eval(self.code, {'__builtins__': {}}, values)
+
+    def __repr__(self):
+        return f'CompiledFormula({self.source!r})'
+
+
+def _validate(node, refs):
+    """許可されたノードだけで構成されているか確認し、参照セルを集める"""
+    if isinstance(node, ast.Expression):
+        _validate(node.body, refs)
+    elif isinstance(node, ast.BinOp) and isinstance(node.op, _ALLOWED_BINOPS):
+        _validate(node.left, refs)
+        _validate(node.right, refs)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, _ALLOWED_UNARYOPS):
+        _validate(node.operand, refs)
+    elif isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        pass
+    elif isinstance(node, ast.Name) and CELL_RE.match(node.id):
+        refs.add(node.id)
+    else:
+        raise FormulaError(f'使用できない式です: {ast.dump(node)[:60]}')
+
+
+class _FloatConstants(ast.NodeTransformer):
+    """整数の定数を float に置き換える（べき乗が巨大な整数にならず、桁あふれで止まる）"""
+
+    def visit_Constant(self, node):
+        return ast.copy_location(ast.Constant(float(node.value)), node)
+
+
+def compile_formula(text):
+    """
+    Excel 形式の計算式をコンパイルする
+
+    入力例: "=+G34/G3"
+    出力例: CompiledFormula (refs={'G34', 'G3'})
+    """
+    source = str(text).strip()
+    if not source.startswith('='):
+        raise FormulaError(f'計算式ではありません: {source}')
+
+    expression = source[1:].replace('^', '**')
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise FormulaError(f'計算式の構文エラー: {source}') from e
+
+    refs = set()
+    _validate(tree, refs)
+    tree = ast.fix_missing_locations(_FloatConstants().visit(tree))
+    code = compile(tree, f'<formula {source}>', 'eval')
+    return CompiledFormula(source, code, frozenset(refs))
+
+
+def _to_number(value):
+    """入力値を float に変換（変換できない文字列は NaN）"""
+    if isinstance(value, np.ndarray):
+        return value.astype(float)
+    if value is None or value == '':
+        return np.nan
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return np.nan
+
+
+class CellPlan:
+    """1製品・1振分の計算プラン（評価順に並べたセル計算式）"""
+
+    def __init__(self, factory, product_id, variant, formulas, constants):
+        self.factory = factory
+        self.product_id = product_id
+        self.variant = variant
+        self.formulas = formulas
+        self.constants = constants
+
+        graph = {cell: formula.refs & formulas.keys() for cell, formula in formulas.items()}
+        try:
+            self.order = list(TopologicalSorter(graph).static_order())
+        except CycleError as e:
+            raise FormulaError(f'循環参照があります: {factory} {product_id} {e.args[1]}') from e
+
+        refs = set().union(*(f.refs for f in formulas.values())) if formulas else set()
+        self.inputs = frozenset(refs - formulas.keys() - constants.keys())
+
+        # セル → そのセルを直接参照している計算式セル
+        self.dependents = {}
+        for cell, formula in formulas.items():
+            for ref in formula.refs:
+                self.dependents.setdefault(ref, set()).add(cell)
+
+    def downstream(self, cells):
+        """指定セルの変更で再計算が必要になる計算式セルを評価順で返す"""
+        dirty = set()
+        pending = list(cells)
+        while pending:
+            for dependent in self.dependents.get(pending.pop(), ()):
+                if dependent not in dirty:
+                    dirty.add(dependent)
+                    pending.append(dependent)
+        return [cell for cell in self.order if cell in dirty]
+
+    def prepare_values(self, inputs):
+        """入力セルと定数セルを数値化した評価用の辞書を作る"""
+        values = {cell: _to_number(value) for cell, value in inputs.items()}
+        values.update((cell, _to_number(value)) for cell, value in self.constants.items())
+        for cell in self.inputs - values.keys():
+            values[cell] = np.nan
+        return values
+
+    def evaluate_cells(self, values, cells):
+        """cells を順に評価して values を更新し、計算結果を返す"""
+        results = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for cell in cells:
+                try:
+                    value = np.asarray(self.formulas[cell].evaluate(values), dtype=float)
+                except (OverflowError, ZeroDivisionError):
+                    # 数値（スカラー）同士の計算は numpy の errstate が効かないため NaN にする
+                    value = np.asarray(np.nan)
+                value = np.where(np.isfinite(value), value, np.nan)
+                values[cell] = results[cell] = value if value.ndim else float(value)
+        return results
+
+    def evaluate(self, inputs):
+        """
+        入力セルの値から全セルを計算する
+
+        Args:
+            inputs (dict): セル → 値（スカラーまたは numpy 配列）
+
+        Returns:
+            dict: セル → 計算結果（計算できないセルは NaN）
+        """
+        return self.evaluate_cells(self.prepare_values(inputs), self.order)
+
+    def __repr__(self):
+        return f'CellPlan({self.factory} {self.product_id} 振分={self.variant or "-"} {self.order})'
+
+
+class FormulaRuleSet:
+    """計算式ルール.csv を読み込み、(工場, 製品ID) ごとの計算プランを保持する"""
+
+    def __init__(self, plans, errors=None):
+        # (工場, 製品ID) → {振分: CellPlan}
+        self.plans = plans
+        self.errors = errors or []
+
+    @classmethod
+    def from_csv(cls, file_path):
+        df, _ = read_csv(file_path, dtype=str, keep_default_na=False)
+        df = df[df['製品ID'].str.strip() != '']
+
+        # 振分は製品内で最初の行にだけ書かれていることがあるため、製品内で前方補完する
+        variant = df['振分'].str.strip().replace('', np.nan)
+        df = df.assign(振分=variant.groupby([df['工場'], df['製品ID']]).ffill().fillna(''))
+
+        plans = {}
+        errors = []
+        for (factory, product_id, variant), group in df.groupby(['工場', '製品ID', '振分'], sort=False):
+            formulas = {}
+            constants = {}
+            for cell, text in zip(group['セル位置'].str.strip(), group['計算式'].str.strip()):
+                try:
+                    if text.startswith('='):
+                        formulas[cell] = compile_formula(text)
+                        constants.pop(cell, None)
+                    else:
+                        constants[cell] = text
+                        formulas.pop(cell, None)
+                except FormulaError as e:
+                    errors.append(f'{factory} {product_id} {cell}: {e}')
+            try:
+                plan = CellPlan(factory, product_id, variant, formulas, constants)
+            except FormulaError as e:
+                errors.append(str(e))
+                continue
+            plans.setdefault((factory, product_id), {})[variant] = plan
+
+        if errors:
+            logger.warning(f"計算式ルールのエラー: {len(errors)}件")
+        return cls(plans, errors)
+
+    def get_plan(self, factory, product_id, variant=None):
+        """製品の計算プランを返す（振分の指定がなければ最初の振分）"""
+        variants = self.plans.get((str(factory), str(product_id)))
+        if not variants:
+            return None
+        if variant not in (None, '') and str(variant) in variants:
+            return variants[str(variant)]
+        return next(iter(variants.values()))
+
+
+_rule_cache = {}
+_rule_cache_lock = threading.Lock()
+
+
+def get_rule_set(file_path=None):
+    """
+    コンパイル済みの計算式ルールを返す
+
+    ファイルの更新日時が変わるまではプロセス内でキャッシュを使い回す。
+    """
+    file_path = file_path or os.path.join(settings.BASE_DIR, 'data', '計算式ルール.csv')
+    mtime = os.path.getmtime(file_path)
+    with _rule_cache_lock:
+        cached = _rule_cache.get(file_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        rule_set = FormulaRuleSet.from_csv(file_path)
+        _rule_cache[file_path] = (mtime, rule_set)
+        return rule_set
+
+
+def load_product_inputs(queryset=None):
+    """
+    製品マスタから製品ごとの入力セル値を1クエリで読み込む
+
+    Returns:
+        dict: (工場, 製品ID) → {'振分ID': ..., 'G3': ..., ...}
+    """
+    from .models import Product
+
+    queryset = queryset if queryset is not None else Product.objects.all()
+    fields = sorted(set(PRODUCT_INPUT_CELLS.values()))
+    products = {}
+    # 振分のある製品は振分IDの小さいものを代表にする
+    for row in queryset.order_by('allocation_id').values('factory', 'product_id', 'allocation_id', *fields):
+        inputs = {cell: row[field] for cell, field in PRODUCT_INPUT_CELLS.items()}
+        inputs['振分ID'] = row['allocation_id']
+        products.setdefault((row['factory'], row['product_id']), inputs)
+    return products
+
+
+def _line_frame(formulations=None):
+    """配合明細を1クエリで DataFrame に読み込む"""
+    from .models import FormulationLine
+
+    lines = FormulationLine.objects.all()
+    if formulations is not None:
+        lines = lines.filter(formulation__in=formulations)
+    df = pd.DataFrame.from_records(
+        list(lines.order_by('formulation_id', 'id').values_list(
+            'id', 'formulation_id', 'formulation__factory', 'formulation__product_id',
+            'formulation__pattern', 'material_id', 'quantity_kg',
+        )),
+        columns=['line_id', 'formulation_id', 'factory', 'product_id', 'pattern', 'material_cd', 'quantity_kg'],
+    )
+    df['quantity_kg'] = pd.to_numeric(df['quantity_kg'], errors='coerce')
+    return df
+
+
+def _line_inputs(product, group):
+    inputs = dict(product)
+    for cell, column in LINE_INPUT_CELLS.items():
+        inputs[cell] = group[column].to_numpy(dtype=float)
+    return inputs
+
+
+def evaluate_formulations(rule_set=None, product_inputs=None, formulations=None):
+    """
+    配合明細ごとにラベル用の数量を一括計算する
+
+    Args:
+        rule_set: FormulaRuleSet（省略時は get_rule_set()）
+        product_inputs: load_product_inputs() の結果（省略時は製品マスタから読み込む）
+        formulations: Formulation の QuerySet（省略時は全件）
+
+    Returns:
+        DataFrame: 配合明細1行ごとに工場・製品ID・パターン・原料CDと各セルの計算結果
+    """
+    rule_set = rule_set or get_rule_set()
+    product_inputs = product_inputs if product_inputs is not None else load_product_inputs()
+
+    df = _line_frame(formulations)
+    if df.empty:
+        return df
+
+    results = []
+    for (factory, product_id), group in df.groupby(['factory', 'product_id'], sort=False):
+        product = product_inputs.get((factory, product_id), {})
+        plan = rule_set.get_plan(factory, product_id, product.get('振分ID'))
+        if plan is None:
+            continue
+        values = plan.evaluate(_line_inputs(product, group))
+        results.append(group.assign(**{
+            cell: np.broadcast_to(value, len(group)) for cell, value in values.items()
+        }))
+
+    if not results:
+        return df.iloc[0:0]
+    return pd.concat(results, ignore_index=True)
+
+
+def _same_value(old, new):
+    if isinstance(old, np.ndarray) or isinstance(new, np.ndarray):
+        return np.array_equal(old, new, equal_nan=True)
+    return old == new or (old != old and new != new)
+
+
+class IncrementalEvaluator:
+    """
+    入力セルの変更に対して、影響を受けるセルだけを再計算する評価器
+
+    配合ごとに評価済みの値を保持し、入力が変わったときは依存グラフを下流へたどって
+    再計算が必要なセル（例: G34 → D36 → D37 → D38/D39）だけを評価し直す。
+    counts で再計算したセル数を確認できる。
+    """
+
+    def __init__(self, rule_set=None):
+        self.rule_set = rule_set or get_rule_set()
+        # key → (plan, values, results, line_ids)
+        self._states = {}
+        # (工場, 製品ID) → key の集合
+        self._product_keys = {}
+        self.counts = {'evaluations': 0, 'cells_evaluated': 0, 'updates': 0, 'cells_recomputed': 0}
+
+    def evaluate(self, key, factory, product_id, inputs, variant=None, line_ids=None):
+        """key の全セルを計算して状態を保持する（計算プランがない製品は None）"""
+        plan = self.rule_set.get_plan(factory, product_id, variant)
+        if plan is None:
+            return None
+        values = plan.prepare_values(inputs)
+        results = plan.evaluate_cells(values, plan.order)
+        self._states[key] = (plan, values, results, list(line_ids or []))
+        self._product_keys.setdefault((str(factory), str(product_id)), set()).add(key)
+        self.counts['evaluations'] += 1
+        self.counts['cells_evaluated'] += len(plan.order)
+        return results
+
+    def load_formulations(self, product_inputs=None, formulations=None):
+        """配合明細を読み込み、配合ごと（key=配合ID）に全セルを計算する"""
+        product_inputs = product_inputs if product_inputs is not None else load_product_inputs()
+        df = _line_frame(formulations)
+        for (formulation_id, factory, product_id), group in df.groupby(
+            ['formulation_id', 'factory', 'product_id'], sort=False
+        ):
+            product = product_inputs.get((factory, product_id), {})
+            self.evaluate(
+                formulation_id, factory, product_id, _line_inputs(product, group),
+                variant=product.get('振分ID'), line_ids=group['line_id'].tolist(),
+            )
+        return len(self._states)
+
+    def results(self, key):
+        return self._states[key][2]
+
+    def update(self, key, changes):
+        """
+        入力セルを変更し、下流のセルだけを再計算する
+
+        Args:
+            key: evaluate() に渡したキー
+            changes (dict): 入力セル → 新しい値
+
+        Returns:
+            dict: 再計算したセル → 計算結果
+        """
+        plan, values, results, _ = self._states[key]
+        changed = []
+        for cell, value in changes.items():
+            if cell in plan.formulas:
+                raise FormulaError(f'計算式のセルは直接変更できません: {cell}')
+            value = _to_number(value)
+            if cell in values and _same_value(values[cell], value):
+                continue
+            values[cell] = value
+            changed.append(cell)
+
+        dirty = plan.downstream(changed)
+        recomputed = plan.evaluate_cells(values, dirty)
+        results.update(recomputed)
+        self.counts['updates'] += 1
+        self.counts['cells_recomputed'] += len(dirty)
+        return recomputed
+
+    def update_product(self, factory, product_id, changes):
+        """製品単位の入力（充填価格など）を変更し、その製品の配合だけを再計算する"""
+        keys = self._product_keys.get((str(factory), str(product_id)), ())
+        return {key: self.update(key, changes) for key in keys}
+
+    def update_line(self, key, line_id, changes):
+        """配合明細1行分の入力（G34 = 配合量など）を変更する"""
+        _, values, _, line_ids = self._states[key]
+        position = line_ids.index(line_id)
+        array_changes = {}
+        for cell, value in changes.items():
+            column = values[cell].copy()
+            column[position] = _to_number(value)
+            array_changes[cell] = column
+        return self.update(key, array_changes)
+
+    def reset_counts(self):
+        for name in self.counts:
+            self.counts[name] = 0
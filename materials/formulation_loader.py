@@ -0,0 +1,206 @@
+# materials/formulation_loader.py - 配合詳細一覧.csv のストリーミング読み込み
+import logging
+import os
+from decimal import Decimal, InvalidOperation
+
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+from .costing import refresh_costs
+from .encoding import detect_file_encoding, remember_encoding, retry_encoding
+from .models import Formulation, FormulationLine
+
+logger = logging.getLogger(__name__)
+
+
+def _to_decimal(value):
+    """'1,260' → Decimal('1260')、空・変換不可は None"""
+    if not value:
+        return None
+    try:
+        return Decimal(value.replace(',', ''))
+    except InvalidOperation:
+        return None
+
+
+def _to_int(value):
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+class FormulationCSVLoader:
+    """
+    配合詳細一覧.csv を一定件数ずつ読み込んで Formulation / FormulationLine に書き込む
+
+    pd.read_csv の chunksize で読み進めるため、ファイルサイズに関係なく
+    メモリ使用量は batch_size 行分に収まる。
+    """
+    DEFAULT_BATCH_SIZE = 2000
+
+    # CSV列名 → (フィールド, 変換関数)
+    # 工場〜販売先は Formulation、それ以外は FormulationLine のフィールド
+    COLUMN_MAPPING = {
+        '工場': ('factory', None),
+        '製品ID': ('product_id', None),
+        'パターン': ('pattern', None),
+        '製品名': ('product_name', None),
+        '販売先': ('customer', None),
+        '原料CD': ('material_id', None),
+        '原料名': ('material_name', None),
+        '製造所': ('manufacturer', None),
+        '補正区分': ('correction_type', None),
+        '配合量(kg)': ('quantity_kg', _to_decimal),
+        '秤量区分': ('weighing_type', None),
+        '秤量場所': ('weighing_place', None),
+        '投入G番号': ('input_group_no', _to_int),
+        '投入G名称': ('input_group_name', None),
+        '使用状況': ('usage_status', None),
+        '備考': ('note', None),
+    }
+    REQUIRED_COLUMNS = ('工場', '製品ID', 'パターン', '原料CD')
+    HEADER_FIELDS = ('factory', 'product_id', 'pattern', 'product_name', 'customer')
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.data_dir = os.path.join(settings.BASE_DIR, 'data')
+        self.csv_file = '配合詳細一覧.csv'
+        self.batch_size = batch_size
+
+    def get_file_path(self):
+        return os.path.join(self.data_dir, self.csv_file)
+
+    def detect_encoding(self, file_path):
+        """先頭部分だけをデコードしてエンコーディングを1つに決める"""
+        return detect_file_encoding(file_path)
+
+    def iter_batches(self, file_path, encoding, batch_size=None):
+        """
+        CSVを batch_size 行ずつ読み、モデルフィールド名の辞書リストを返すジェネレータ
+
+        Yields:
+            (開始行番号, [{'factory': ..., 'material_id': ..., 'quantity_kg': Decimal, ...}, ...])
+        """
+        batch_size = batch_size or self.batch_size
+        reader = pd.read_csv(
+            file_path,
+            encoding=encoding,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=batch_size,
+        )
+
+        start = 0
+        for chunk in reader:
+            missing = [col for col in self.REQUIRED_COLUMNS if col not in chunk.columns]
+            if missing:
+                raise ValueError(f"必須列が見つかりません: {', '.join(missing)}")
+
+            columns = {}
+            for col, (field, converter) in self.COLUMN_MAPPING.items():
+                if col not in chunk.columns:
+                    continue
+                values = chunk[col].str.strip()
+                columns[field] = values.map(converter).tolist() if converter else values.tolist()
+
+            fields = list(columns)
+            rows = [dict(zip(fields, values)) for values in zip(*columns.values())]
+            yield start, rows
+            start += len(chunk)
+
+    def _replace_all(self, file_path, encoding, batch_size):
+        """
+        配合・配合明細を1トランザクションで全件入れ替える
+
+        Returns:
+            (配合数, 明細数, スキップ行数, バッチ数)
+        """
+        created = 0
+        skipped = 0
+        batches = 0
+
+        # (工場, 製品ID, パターン) → Formulation.id
+        formulation_ids = {}
+
+        with transaction.atomic():
+            FormulationLine.objects.all().delete()
+            Formulation.objects.all().delete()
+
+            for start, rows in self.iter_batches(file_path, encoding, batch_size):
+                valid_rows = []
+                new_headers = {}
+                for row in rows:
+                    if not (row['factory'] and row['product_id'] and row['material_id']):
+                        skipped += 1
+                        continue
+                    header = {field: row.pop(field, '') for field in self.HEADER_FIELDS}
+                    key = (header['factory'], header['product_id'], header['pattern'])
+                    if key not in formulation_ids:
+                        new_headers.setdefault(key, header)
+                    valid_rows.append((key, row))
+
+                if new_headers:
+                    created_headers = Formulation.objects.bulk_create(
+                        [Formulation(**header) for header in new_headers.values()],
+                        batch_size=batch_size,
+                    )
+                    formulation_ids.update(zip(new_headers, (f.pk for f in created_headers)))
+
+                objs = [
+                    FormulationLine(formulation_id=formulation_ids[key], **row)
+                    for key, row in valid_rows
+                ]
+
+                FormulationLine.objects.bulk_create(objs, batch_size=batch_size)
+                created += len(objs)
+                batches += 1
+
+        return len(formulation_ids), created, skipped, batches
+
+    def load_formulations(self, file_path=None, batch_size=None):
+        """
+        配合・配合明細を全件入れ替えで読み込む
+
+        Returns:
+            dict: MaterialCSVLoader と同じ形式の結果
+        """
+        file_path = file_path or self.get_file_path()
+        batch_size = batch_size or self.batch_size
+
+        if not os.path.exists(file_path):
+            return {'success': False, 'error': f'CSVファイルが見つかりません: {os.path.basename(file_path)}'}
+
+        try:
+            encoding = self.detect_encoding(file_path)
+            try:
+                formulation_count, created, skipped, batches = self._replace_all(file_path, encoding, batch_size)
+            except UnicodeDecodeError as e:
+                # 先頭だけでは判定しきれなかったファイル。書き込みはロールバック済みなので最初から読み直す
+                encoding = retry_encoding(file_path, encoding, e)
+                formulation_count, created, skipped, batches = self._replace_all(file_path, encoding, batch_size)
+                remember_encoding(file_path, encoding)
+
+            # 配合を入れ替えたので原料費も全件再計算
+            costs_refreshed = refresh_costs()
+
+            logger.info(
+                f"配合明細読み込み完了: 配合{formulation_count}, 明細{created}, スキップ{skipped}, バッチ{batches}"
+            )
+            return {
+                'success': True,
+                'formulations': formulation_count,
+                'created': created,
+                'skipped': skipped,
+                'total_rows': created + skipped,
+                'batches': batches,
+                'costs_refreshed': costs_refreshed,
+                'encoding_used': encoding,
+            }
+
+        except Exception as e:
+            error_msg = f"配合CSV読み込みエラー: {str(e)}"
+            logger.error(error_msg)
+            return {'success': False, 'error': error_msg}
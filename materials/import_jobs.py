@@ -0,0 +1,169 @@
+# materials/import_jobs.py - CSV取り込みのバックグラウンド実行
+"""
+CSV取り込みをリクエストの外（プロセス内のスレッドプール）で実行する。
+
+- start_import_job() はジョブを登録してすぐに返り、処理はワーカースレッドで行う
+- 取り込み処理には progress（ImportProgress）が渡され、バッチごとに進捗・行エラーを記録する
+- SQLite の書き込みが競合しないよう、既定ではワーカーは1つ（settings.IMPORT_JOB_WORKERS）
+- プロセスの再起動・異常終了で終わらなかったジョブは、一定時間（settings.IMPORT_JOB_TIMEOUT 秒）後に
+  fail_stale_jobs() で失敗にする
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+# 待機中・実行中のまま、この秒数を過ぎたジョブは終わらなかったものとみなす
+IMPORT_JOB_TIMEOUT = getattr(settings, 'IMPORT_JOB_TIMEOUT', 3600)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ImportProgress:
+    """進捗の通知先（何もしない既定の実装）"""
+
+    def start(self, total_rows):
+        pass
+
+    def update(self, processed_rows, created=0, updated=0, skipped=0):
+        pass
+
+    def error(self, row, material_id, message):
+        pass
+
+
+class JobProgress(ImportProgress):
+    """進捗を ImportJob に書き込む"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def start(self, total_rows):
+        self.job.total_rows = total_rows
+        self.job.save(update_fields=['total_rows'])
+
+    def update(self, processed_rows, created=0, updated=0, skipped=0):
+        job = self.job
+        job.processed_rows = processed_rows
+        job.created_count = created
+        job.updated_count = updated
+        job.skipped_count = skipped
+        job.save(update_fields=[
+            'processed_rows', 'created_count', 'updated_count', 'skipped_count', 'error_count', 'errors',
+        ])
+
+    def error(self, row, material_id, message):
+        job = self.job
+        job.error_count += 1
+        if len(job.errors) < ImportJob.MAX_ERRORS:
+            job.errors.append({'row': row, 'material_id': material_id, 'error': message})
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMPORT_JOB_WORKERS', 1),
+                thread_name_prefix='import-job',
+            )
+        return _executor
+
+
+def start_import_job(kind, func, filename='', overwrite_mode=''):
+    """
+    取り込みジョブを登録してワーカーに渡す
+
+    Args:
+        kind (str): ImportJob.KIND_CHOICES のキー
+        func (callable): func(progress) → MaterialCSVLoader と同じ形式の結果 dict
+
+    Returns:
+        ImportJob: 登録したジョブ（status='pending'）
+    """
+    job = ImportJob.objects.create(kind=kind, filename=filename, overwrite_mode=overwrite_mode)
+    get_executor().submit(_run_job, job.pk, func)
+    logger.info(f"取り込みジョブ登録: #{job.pk} {kind} {filename}")
+    return job
+
+
+def _run_job(job_id, func):
+    close_old_connections()
+    # 途中（ジョブの取得・状態の保存を含む）で失敗しても、必ず終了状態（failed）を記録する
+    error = '取り込みジョブが終了状態を記録できませんでした'
+    try:
+        job = ImportJob.objects.get(pk=job_id)
+        if job.status != 'pending':
+            # 待機中に fail_stale_jobs() で失敗にされたジョブは実行しない
+            logger.warning(f"取り込みジョブ #{job_id} は {job.status} のため実行しません")
+            error = None
+            return
+        job.status = 'running'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+
+        try:
+            result = func(JobProgress(job))
+        except Exception as e:
+            logger.exception(f"取り込みジョブ #{job_id} でエラー")
+            result = {'success': False, 'error': str(e)}
+
+        job.status = 'succeeded' if result.get('success') else 'failed'
+        job.message = result.get('error', '') if not result.get('success') else ''
+        if result.get('success'):
+            job.processed_rows = result.get('total_rows', job.processed_rows)
+            job.created_count = result.get('created', job.created_count)
+            job.updated_count = result.get('updated', job.updated_count)
+            job.skipped_count = result.get('skipped', job.skipped_count)
+        job.finished_at = timezone.now()
+        job.save()
+        error = None
+        logger.info(
+            f"取り込みジョブ終了: #{job_id} {job.status} {job.processed_rows}行 {job.rows_per_second}行/秒"
+        )
+    except Exception as e:
+        logger.exception(f"取り込みジョブ #{job_id} の状態を保存できませんでした")
+        error = str(e) or e.__class__.__name__
+    finally:
+        if error is not None:
+            try:
+                ImportJob.objects.filter(pk=job_id).exclude(status__in=['succeeded', 'failed']).update(
+                    status='failed', message=error, finished_at=timezone.now()
+                )
+            except Exception:
+                logger.exception(f"取り込みジョブ #{job_id} の失敗を記録できませんでした")
+        connection.close()
+
+
+def fail_stale_jobs():
+    """
+    IMPORT_JOB_TIMEOUT 秒を過ぎても終わっていないジョブを失敗にする
+
+    ワーカーのプロセスが再起動・異常終了すると、スレッドで実行中・待機中だったジョブは
+    終了状態を記録できずに残る。進捗画面はこのジョブを待ち続けるため、時間切れで失敗にする。
+
+    Returns:
+        int: 失敗にしたジョブ数
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=IMPORT_JOB_TIMEOUT)
+    count = ImportJob.objects.filter(status__in=['pending', 'running']).filter(
+        Q(started_at__lt=cutoff) | Q(started_at__isnull=True, created_at__lt=cutoff)
+    ).update(
+        status='failed',
+        message=f'{IMPORT_JOB_TIMEOUT}秒以内に終了しませんでした（処理中にサーバーが再起動した可能性があります）',
+        finished_at=now,
+    )
+    if count:
+        logger.warning(f"終了しなかった取り込みジョブを失敗にしました: {count}件")
+    return count
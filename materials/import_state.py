@@ -0,0 +1,95 @@
+# materials/import_state.py - 取り込み済みCSVの内容ハッシュ
+"""
+原料マスタCSVを取り込んだときのファイル全体のハッシュと行ごとのハッシュを保持する。
+
+- ファイルのハッシュが前回と同じなら、読み込み自体を省略できる
+- ファイルが変わっていても、行ハッシュが前回と同じ行は書き込みを省略できる
+
+取り込み直後の原料の件数と最終更新日時も記録しておき、取り込み以外（編集画面・
+管理画面・アップロード）でDBが変わっていたら記録を使わずに全行を照合し直す。
+"""
+import hashlib
+import logging
+
+import pandas as pd
+from django.db.models import Count, Max
+
+from .column_mapping import REGISTRY_SIGNATURE
+from .models import CSVImportState, Material
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_content_hash(file_path):
+    """ファイル内容の SHA-256（16進数）"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compute_row_hashes(df, id_column):
+    """
+    原料ID → 行ハッシュの辞書を返す（ファイル内で重複したIDは最後の行）
+
+    pd.util.hash_pandas_object で全行をまとめてハッシュする（値はプロセスに依存しない）。
+    """
+    ids = df[id_column].astype(str).str.strip()
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    return {
+        material_id: format(value, '016x')
+        for material_id, value in zip(ids.tolist(), hashes.tolist())
+        if material_id
+    }
+
+
+def material_fingerprint():
+    """原料テーブルの (件数, 最終更新日時) を1クエリで取得する"""
+    result = Material.objects.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+    return result['count'], result['updated_at']
+
+
+def get_import_state(source):
+    """
+    前回の取り込み状態を返す
+
+    取り込み後に原料テーブルや列の対応表が変わっていれば None（記録は信用できない）。
+    """
+    state = CSVImportState.objects.filter(source=source).first()
+    if state is None:
+        return None
+    if state.mapping_signature != REGISTRY_SIGNATURE:
+        return None
+    if (state.material_count, state.material_updated_at) != material_fingerprint():
+        logger.info(f"{source}: 前回の取り込み後に原料が変更されたため、全行を照合します")
+        return None
+    return state
+
+
+def save_import_state(source, content_hash, encoding, columns, row_hashes, row_count):
+    material_count, material_updated_at = material_fingerprint()
+    CSVImportState.objects.update_or_create(
+        source=source,
+        defaults={
+            'content_hash': content_hash,
+            'encoding': encoding,
+            'columns': list(columns),
+            'mapping_signature': REGISTRY_SIGNATURE,
+            'row_count': row_count,
+            'row_hashes': row_hashes,
+            'material_count': material_count,
+            'material_updated_at': material_updated_at,
+        },
+    )
+
+
+def invalidate_import_state(source=None):
+    """取り込み状態を破棄する（source 省略時はすべて）"""
+    queryset = CSVImportState.objects.all()
+    if source is not None:
+        queryset = queryset.filter(source=source)
+    queryset.delete()
+
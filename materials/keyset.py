@@ -0,0 +1,184 @@
+# materials/keyset.py - キーセット（カーソル）方式のページ送り
+"""
+OFFSET を使わず「前ページ最後の行の (ソート値, id) より後」を条件にして次ページを取得する。
+何ページ目でもインデックスの範囲検索1回で済み、件数の COUNT も不要。
+
+    page = keyset_page(queryset, 'unit_price', descending=True, per_page=50, after=request.GET.get('cursor'))
+    page.object_list / page.next_cursor / page.prev_cursor
+
+カーソルは (ソート値, id) を JSON にして URL 安全な base64 にした文字列。
+不正なカーソル（形式・ソート列の型が合わない値を含む）は無視して先頭ページを返す。
+"""
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+
+from .models import Material
+
+# 画面のソートキー → (DBのフィールド, NULL を含むか)
+SORT_FIELDS = {
+    'material_id': ('material_id', False),
+    'material_name': ('material_name', False),
+    'unit_price': ('unit_price_value', True),
+    'manufacturer': ('manufacturer', False),
+    'supplier': ('supplier', False),
+}
+DEFAULT_SORT_KEY = 'material_id'
+
+
+def encode_cursor(value, pk):
+    if isinstance(value, Decimal):
+        value = str(value)
+    payload = json.dumps([value, pk], ensure_ascii=False, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """カーソル文字列を (ソート値, id) に戻す（不正なら None）"""
+    if not cursor:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(payload)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if not isinstance(pk, int):
+        return None
+    return value, pk
+
+
+class KeysetPage:
+    """1ページ分の行と前後ページのカーソル"""
+
+    def __init__(self, object_list, has_previous, has_next, prev_cursor, next_cursor):
+        self.object_list = object_list
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    def has_other_pages(self):
+        return self.has_previous or self.has_next
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+
+def _ordering(field, nullable, descending):
+    # 単価なし（NULL）は0円扱い: 昇順では先頭、降順では末尾
+    if descending:
+        key = F(field).desc(nulls_last=True) if nullable else F(field).desc()
+        return key, '-id'
+    key = F(field).asc(nulls_first=True) if nullable else F(field).asc()
+    return key, 'id'
+
+
+def sort_queryset(queryset, sort_key, descending=False):
+    """一覧と同じ並び順を付ける（CSV出力など、ページ送りしない場合に使う）"""
+    field, nullable = SORT_FIELDS.get(sort_key, SORT_FIELDS[DEFAULT_SORT_KEY])
+    return queryset.order_by(*_ordering(field, nullable, descending))
+
+
+def _after(field, nullable, descending, value, pk):
+    """
+    並び順で (value, pk) より後ろにある行の条件を、並び順どおりの区間のリストで返す
+
+    NULL の区間を OR でつなぐとインデックスの範囲検索が使われないため、
+    区間ごとに別のクエリにして、ページが埋まるまで順に取得する。
+    """
+    id_after = Q(id__lt=pk) if descending else Q(id__gt=pk)
+    is_null = Q(**{f'{field}__isnull': True})
+    if value is None:
+        # NULL の並びの中では id で比較する（昇順では NULL の後に値のある行が続く）
+        if descending:
+            return [is_null & id_after]
+        return [is_null & id_after, Q(**{f'{field}__isnull': False})]
+
+    beyond = Q(**{f'{field}__lt' if descending else f'{field}__gt': value})
+    # 外側の >= / <= はインデックスの範囲検索に使わせるための条件（結果は変わらない）
+    bound = Q(**{f'{field}__lte' if descending else f'{field}__gte': value})
+    segments = [bound & (beyond | (Q(**{field: value}) & id_after))]
+    if nullable and descending:
+        segments.append(is_null)
+    return segments
+
+
+def _cursor_key(cursor, field, nullable):
+    """カーソルを (ソート列の型に変換した値, id) にする（不正・改ざんされたカーソルは None）"""
+    key = decode_cursor(cursor)
+    if key is None:
+        return None
+    value, pk = key
+    if value is None:
+        return key if nullable else None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+    try:
+        value = Material._meta.get_field(field).to_python(value)
+    except (ValidationError, TypeError, ValueError):
+        return None
+    if isinstance(value, Decimal) and not value.is_finite():
+        return None
+    return value, pk
+
+
+def _row_key(row, field):
+    if isinstance(row, dict):
+        return row[field], row['id']
+    return getattr(row, field), row.id
+
+
+def keyset_page(queryset, sort_key, descending=False, per_page=50, after=None, before=None, last=False):
+    """
+    キーセット方式で1ページ分を取得する
+
+    Args:
+        queryset (QuerySet): 絞り込み済みの Material の QuerySet
+            （values() / values_list(named=True) でもよい、その場合は id とソート列を含める）
+        sort_key (str): SORT_FIELDS のキー
+        descending (bool): 降順なら True
+        after (str): このカーソルの次の行から（次ページ）
+        before (str): このカーソルの前の行まで（前ページ）
+        last (bool): 最終ページ
+
+    Returns:
+        KeysetPage
+    """
+    field, nullable = SORT_FIELDS.get(sort_key, SORT_FIELDS[DEFAULT_SORT_KEY])
+    after_key = _cursor_key(after, field, nullable)
+    before_key = None if after_key else _cursor_key(before, field, nullable)
+    backward = bool(before_key) or last
+
+    # 前ページ・最終ページは逆順で取得してから並べ直す
+    queryset = queryset.order_by(*_ordering(field, nullable, descending != backward))
+    if after_key:
+        segments = _after(field, nullable, descending, *after_key)
+    elif before_key:
+        segments = _after(field, nullable, not descending, *before_key)
+    else:
+        segments = [Q()]
+
+    rows = []
+    for condition in segments:
+        rows += queryset.filter(condition)[:per_page + 1 - len(rows)]
+        if len(rows) > per_page:
+            break
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backward:
+        rows.reverse()
+        has_previous, has_next = more, bool(before_key)
+    else:
+        has_previous, has_next = bool(after_key), more
+
+    prev_cursor = encode_cursor(*_row_key(rows[0], field)) if rows and has_previous else None
+    next_cursor = encode_cursor(*_row_key(rows[-1], field)) if rows and has_next else None
+    return KeysetPage(rows, has_previous, has_next, prev_cursor, next_cursor)
@@ -0,0 +1,72 @@
+# Generated by Django 5.2 on 2026-10-18 12:11
+
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+# 作成時点の materials.models.parse_price / parse_weight_kg の写し
+# （モデル側の関数が後で変わっても、このマイグレーションの結果は変わらない）
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def parse_price(value):
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        return value
+    match = _NUMBER_RE.search(str(value).replace(',', ''))
+    if not match:
+        return None
+    try:
+        return Decimal(match.group())
+    except InvalidOperation:
+        return None
+
+
+def parse_weight_kg(value):
+    number = parse_price(value)
+    if number is None:
+        return None
+    unit = str(value).strip().lower()
+    if unit.endswith('g') and not unit.endswith('kg'):
+        number = number / 1000
+    return number
+
+
+def populate_numeric_fields(apps, schema_editor):
+    Material = apps.get_model('materials', 'Material')
+    materials = list(Material.objects.only('id', 'unit_price', 'main_bag_weight', 'tare_weight'))
+    for material in materials:
+        material.unit_price_value = parse_price(material.unit_price)
+        material.main_bag_weight_kg = parse_weight_kg(material.main_bag_weight)
+        material.tare_weight_kg = parse_weight_kg(material.tare_weight)
+    Material.objects.bulk_update(
+        materials, ['unit_price_value', 'main_bag_weight_kg', 'tare_weight_kg'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='main_bag_weight_kg',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=6, editable=False, max_digits=18, null=True, verbose_name='正袋重量（kg）'),
+        ),
+        migrations.AddField(
+            model_name='material',
+            name='tare_weight_kg',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=6, editable=False, max_digits=18, null=True, verbose_name='風袋重量（kg）'),
+        ),
+        migrations.AddField(
+            model_name='material',
+            name='unit_price_value',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=6, editable=False, max_digits=18, null=True, verbose_name='単価（数値）'),
+        ),
+        migrations.RunPython(populate_numeric_fields, migrations.RunPython.noop),
+    ]
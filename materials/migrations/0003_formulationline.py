@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0002_material_numeric_shadow_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FormulationLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('factory', models.CharField(max_length=100, verbose_name='工場')),
+                ('product_id', models.CharField(max_length=100, verbose_name='製品ID')),
+                ('pattern', models.CharField(max_length=50, verbose_name='パターン')),
+                ('product_name', models.CharField(blank=True, max_length=255, verbose_name='製品名')),
+                ('customer', models.CharField(blank=True, max_length=100, verbose_name='販売先')),
+                ('material_cd', models.CharField(max_length=100, verbose_name='原料CD')),
+                ('material_name', models.CharField(blank=True, max_length=255, verbose_name='原料名')),
+                ('manufacturer', models.CharField(blank=True, max_length=100, verbose_name='製造所')),
+                ('correction_type', models.CharField(blank=True, max_length=50, verbose_name='補正区分')),
+                ('quantity_kg', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='配合量(kg)')),
+                ('weighing_type', models.CharField(blank=True, max_length=50, verbose_name='秤量区分')),
+                ('weighing_place', models.CharField(blank=True, max_length=100, verbose_name='秤量場所')),
+                ('input_group_no', models.IntegerField(blank=True, null=True, verbose_name='投入G番号')),
+                ('input_group_name', models.CharField(blank=True, max_length=100, verbose_name='投入G名称')),
+                ('usage_status', models.CharField(blank=True, max_length=50, verbose_name='使用状況')),
+                ('note', models.CharField(blank=True, max_length=255, verbose_name='備考')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': '配合明細',
+                'verbose_name_plural': '配合明細',
+            },
+        ),
+    ]
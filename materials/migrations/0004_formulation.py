@@ -0,0 +1,105 @@
+# Generated by Django 5.2 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_formulations(apps, schema_editor):
+    """既存の配合明細から配合ヘッダーを作成して紐付ける"""
+    Formulation = apps.get_model('materials', 'Formulation')
+    FormulationLine = apps.get_model('materials', 'FormulationLine')
+
+    keys = (
+        FormulationLine.objects
+        .order_by('factory', 'product_id', 'pattern')
+        .values_list('factory', 'product_id', 'pattern', 'product_name', 'customer')
+    )
+    headers = {}
+    for factory, product_id, pattern, product_name, customer in keys:
+        headers.setdefault((factory, product_id, pattern), (product_name, customer))
+
+    Formulation.objects.bulk_create([
+        Formulation(factory=f, product_id=p, pattern=pt, product_name=name, customer=customer)
+        for (f, p, pt), (name, customer) in headers.items()
+    ], batch_size=500)
+
+    for formulation in Formulation.objects.all():
+        FormulationLine.objects.filter(
+            factory=formulation.factory,
+            product_id=formulation.product_id,
+            pattern=formulation.pattern,
+        ).update(formulation=formulation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0003_formulationline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Formulation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('factory', models.CharField(max_length=100, verbose_name='工場')),
+                ('product_id', models.CharField(max_length=100, verbose_name='製品ID')),
+                ('pattern', models.CharField(max_length=50, verbose_name='パターン')),
+                ('product_name', models.CharField(blank=True, max_length=255, verbose_name='製品名')),
+                ('customer', models.CharField(blank=True, max_length=100, verbose_name='販売先')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': '配合',
+                'verbose_name_plural': '配合',
+                'indexes': [models.Index(fields=['product_id', 'factory'], name='formulation_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('factory', 'product_id', 'pattern'), name='uniq_formulation_key')],
+            },
+        ),
+        migrations.AddField(
+            model_name='formulationline',
+            name='formulation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='materials.formulation', verbose_name='配合'),
+        ),
+        migrations.RunPython(populate_formulations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='formulationline',
+            name='formulation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='materials.formulation', verbose_name='配合'),
+        ),
+        migrations.RemoveField(
+            model_name='formulationline',
+            name='factory',
+        ),
+        migrations.RemoveField(
+            model_name='formulationline',
+            name='product_id',
+        ),
+        migrations.RemoveField(
+            model_name='formulationline',
+            name='pattern',
+        ),
+        migrations.RemoveField(
+            model_name='formulationline',
+            name='product_name',
+        ),
+        migrations.RemoveField(
+            model_name='formulationline',
+            name='customer',
+        ),
+        migrations.RenameField(
+            model_name='formulationline',
+            old_name='material_cd',
+            new_name='material',
+        ),
+        migrations.AlterField(
+            model_name='formulationline',
+            name='material',
+            field=models.ForeignKey(db_column='material_cd', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='formulation_lines', to='materials.material', to_field='material_id', verbose_name='原料CD'),
+        ),
+        migrations.AddIndex(
+            model_name='formulationline',
+            index=models.Index(fields=['material', 'formulation'], name='formulationline_material_idx'),
+        ),
+    ]
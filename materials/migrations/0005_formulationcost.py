@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0004_formulation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FormulationCost',
+            fields=[
+                ('formulation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cost', serialize=False, to='materials.formulation', verbose_name='配合')),
+                ('material_cost', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='原料費')),
+                ('total_quantity_kg', models.DecimalField(decimal_places=6, default=0, max_digits=18, verbose_name='配合量合計(kg)')),
+                ('line_count', models.IntegerField(default=0, verbose_name='明細数')),
+                ('unpriced_line_count', models.IntegerField(default=0, verbose_name='単価未設定の明細数')),
+                ('is_stale', models.BooleanField(db_index=True, default=False, verbose_name='再計算待ち')),
+                ('computed_at', models.DateTimeField(auto_now=True, verbose_name='計算日時')),
+            ],
+            options={
+                'verbose_name': '配合原料費',
+                'verbose_name_plural': '配合原料費',
+            },
+        ),
+    ]
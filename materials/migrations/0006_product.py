@@ -0,0 +1,58 @@
+# Generated by Django 5.2 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0005_formulationcost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('factory', models.CharField(max_length=100, verbose_name='工場')),
+                ('product_id', models.CharField(max_length=100, verbose_name='製品ID')),
+                ('allocation_id', models.CharField(blank=True, max_length=20, verbose_name='振分ID')),
+                ('separation_id', models.CharField(blank=True, max_length=20, verbose_name='分離ID')),
+                ('product_name', models.CharField(blank=True, max_length=255, verbose_name='製品名')),
+                ('customer', models.CharField(blank=True, max_length=100, verbose_name='販売先')),
+                ('batch_volume_a', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='仕込量A(F40)')),
+                ('batch_unit_a', models.CharField(blank=True, max_length=50, verbose_name='単位A(F40)')),
+                ('yield_count_a', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='出来数A(F41)')),
+                ('yield_unit_a', models.CharField(blank=True, max_length=50, verbose_name='単位A(F41)')),
+                ('batch_volume_b', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='仕込量B')),
+                ('batch_unit_b', models.CharField(blank=True, max_length=50, verbose_name='単位C')),
+                ('yield_count_b', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='出来数B')),
+                ('yield_unit_b', models.CharField(blank=True, max_length=50, verbose_name='単位D')),
+                ('fill_volume', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='充填価格')),
+                ('fill_volume_2', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='充填価格2')),
+                ('calc_b36', models.CharField(blank=True, max_length=100, verbose_name='計算(B36)')),
+                ('title_d35', models.CharField(blank=True, max_length=100, verbose_name='Title1(D35)')),
+                ('title_f35', models.CharField(blank=True, max_length=100, verbose_name='Title2(F35)')),
+                ('unit_title_c36', models.CharField(blank=True, max_length=100, verbose_name='単位Title(C36)')),
+                ('unit_title_c37', models.CharField(blank=True, max_length=100, verbose_name='単位Title(C37)')),
+                ('unit_title_c38', models.CharField(blank=True, max_length=100, verbose_name='単位Title(C38)')),
+                ('unit_title_c39', models.CharField(blank=True, max_length=100, verbose_name='単位Title(C39)')),
+                ('title2_d35', models.CharField(blank=True, max_length=100, verbose_name='2Title1(D35)')),
+                ('title2_f35', models.CharField(blank=True, max_length=100, verbose_name='2Title2(F35)')),
+                ('unit_title2_c36', models.CharField(blank=True, max_length=100, verbose_name='2単位Title(C36)')),
+                ('unit_title2_c37', models.CharField(blank=True, max_length=100, verbose_name='2単位Title(C37)')),
+                ('unit_title2_c38', models.CharField(blank=True, max_length=100, verbose_name='2単位Title(C38)')),
+                ('unit_title2_c39', models.CharField(blank=True, max_length=100, verbose_name='2単位Title(C39)')),
+                ('note1', models.CharField(blank=True, max_length=255, verbose_name='備考1')),
+                ('note2', models.CharField(blank=True, max_length=255, verbose_name='備考2')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': '製品',
+                'verbose_name_plural': '製品',
+                'indexes': [models.Index(fields=['product_id', 'factory'], name='product_lookup_idx')],
+                'constraints': [models.UniqueConstraint(fields=('factory', 'product_id', 'allocation_id'), name='uniq_product_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0006_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurifiedWaterException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.CharField(max_length=100, verbose_name='製品ID')),
+                ('factory', models.CharField(max_length=100, verbose_name='工場名')),
+                ('material_cd', models.CharField(max_length=100, verbose_name='原料CD')),
+                ('unit', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='単位')),
+                ('price', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='価格')),
+                ('item_name', models.CharField(blank=True, max_length=255, verbose_name='商品名')),
+                ('fill_price', models.DecimalField(blank=True, decimal_places=6, max_digits=18, null=True, verbose_name='充填価格')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': '精製水例外',
+                'verbose_name_plural': '精製水例外',
+                'constraints': [models.UniqueConstraint(fields=('product_id', 'factory', 'material_cd'), name='uniq_purified_water_exception')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0007_purifiedwaterexception'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('master', '原料マスタCSV読み込み'), ('upload', '原料CSVアップロード')], max_length=20, verbose_name='種類')),
+                ('status', models.CharField(choices=[('pending', '待機中'), ('running', '実行中'), ('succeeded', '完了'), ('failed', '失敗')], db_index=True, default='pending', max_length=20, verbose_name='状態')),
+                ('filename', models.CharField(blank=True, max_length=255, verbose_name='ファイル名')),
+                ('overwrite_mode', models.CharField(blank=True, max_length=20, verbose_name='上書きモード')),
+                ('total_rows', models.IntegerField(default=0, verbose_name='総行数')),
+                ('processed_rows', models.IntegerField(default=0, verbose_name='処理済み行数')),
+                ('created_count', models.IntegerField(default=0, verbose_name='新規作成')),
+                ('updated_count', models.IntegerField(default=0, verbose_name='更新')),
+                ('skipped_count', models.IntegerField(default=0, verbose_name='スキップ')),
+                ('error_count', models.IntegerField(default=0, verbose_name='エラー')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='行エラー')),
+                ('message', models.TextField(blank=True, verbose_name='メッセージ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='終了日時')),
+            ],
+            options={
+                'verbose_name': '取り込みジョブ',
+                'verbose_name_plural': '取り込みジョブ',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
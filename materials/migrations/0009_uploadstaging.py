@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 12:38
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0008_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadStaging',
+            fields=[
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='トークン')),
+                ('filename', models.CharField(max_length=255, verbose_name='ファイル名')),
+                ('encoding', models.CharField(max_length=20, verbose_name='エンコーディング')),
+                ('id_column', models.CharField(max_length=100, verbose_name='原料ID列')),
+                ('row_count', models.IntegerField(default=0, verbose_name='行数')),
+                ('data', models.BinaryField(verbose_name='データ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='作成日時')),
+            ],
+            options={
+                'verbose_name': 'アップロード一時データ',
+                'verbose_name_plural': 'アップロード一時データ',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0009_uploadstaging'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CSVImportState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=100, unique=True, verbose_name='取り込み元')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='内容ハッシュ')),
+                ('encoding', models.CharField(blank=True, max_length=20, verbose_name='エンコーディング')),
+                ('columns', models.JSONField(default=list, verbose_name='列名')),
+                ('row_count', models.IntegerField(default=0, verbose_name='行数')),
+                ('row_hashes', models.JSONField(default=dict, verbose_name='行ハッシュ')),
+                ('material_count', models.IntegerField(default=0, verbose_name='原料件数')),
+                ('material_updated_at', models.DateTimeField(blank=True, null=True, verbose_name='原料の最終更新日時')),
+                ('imported_at', models.DateTimeField(auto_now=True, verbose_name='取り込み日時')),
+            ],
+            options={
+                'verbose_name': 'CSV取り込み状態',
+                'verbose_name_plural': 'CSV取り込み状態',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0010_csvimportstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvimportstate',
+            name='mapping_signature',
+            field=models.CharField(blank=True, max_length=16, verbose_name='列対応の版'),
+        ),
+    ]
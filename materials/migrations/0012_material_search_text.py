@@ -0,0 +1,107 @@
+# Generated by Django 5.2 on 2026-10-18 12:52
+
+import logging
+import re
+import unicodedata
+
+from django.db import OperationalError, migrations, models, transaction
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SOURCE_FIELDS = ('material_id', 'material_name', 'product_name', 'product_kana', 'manufacturer', 'supplier')
+
+# 作成時点の materials.models.normalize_search_text / build_search_text の写し
+# （モデル側の関数が後で変わっても、このマイグレーションの結果は変わらない）
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(ord('ぁ'), ord('ゖ') + 1)}
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_search_text(value):
+    if not value:
+        return ''
+    text = unicodedata.normalize('NFKC', str(value)).lower().translate(_HIRAGANA_TO_KATAKANA)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def build_search_text(values):
+    return '\n'.join(normalize_search_text(value) for value in values)
+
+FTS_TABLE = 'materials_material_fts'
+
+CREATE_FTS_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        search_text, content='materials_material', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON materials_material BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON materials_material BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF search_text ON materials_material BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+        INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+DROP_FTS_SQL = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def populate_search_text(apps, schema_editor):
+    Material = apps.get_model('materials', 'Material')
+    materials = list(Material.objects.only('id', *SEARCH_SOURCE_FIELDS))
+    for material in materials:
+        material.search_text = build_search_text(getattr(material, field) for field in SEARCH_SOURCE_FIELDS)
+    Material.objects.bulk_update(materials, ['search_text'], batch_size=500)
+
+
+def create_fts_index(apps, schema_editor):
+    """SQLite のときだけ FTS5 の trigram 索引を作る（使えない環境では LIKE 検索のまま）"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            with schema_editor.connection.cursor() as cursor:
+                for sql in CREATE_FTS_SQL:
+                    cursor.execute(sql)
+    except OperationalError as e:
+        logger.warning(f"全文検索索引を作成できないため、LIKE 検索を使います ({e})")
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in DROP_FTS_SQL:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0011_csvimportstate_mapping_signature'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='検索用テキスト'),
+        ),
+        migrations.RunPython(populate_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
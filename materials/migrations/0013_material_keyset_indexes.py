@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0012_material_search_text'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['material_name', 'id'], name='material_name_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['manufacturer', 'id'], name='material_maker_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['supplier', 'id'], name='material_supplier_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['unit_price_value', 'id'], name='material_price_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0013_material_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='名前')),
+                ('version', models.CharField(max_length=32, verbose_name='版')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': 'データの版',
+                'verbose_name_plural': 'データの版',
+            },
+        ),
+    ]
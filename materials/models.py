@@ -1,4 +1,75 @@
+import re
+import unicodedata
+import uuid
+from decimal import Decimal, InvalidOperation
+
 from django.db import models
+from django.utils import timezone
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def parse_price(value):
+    """
+    単価文字列を数値に変換する
+
+    入力例: "27,500" / "¥1,200" / "384"
+    出力例: Decimal('27500') / Decimal('1200') / Decimal('384')
+    変換できない場合は None
+    """
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        return value
+    match = _NUMBER_RE.search(str(value).replace(',', ''))
+    if not match:
+        return None
+    try:
+        return Decimal(match.group())
+    except InvalidOperation:
+        return None
+
+
+def parse_weight_kg(value):
+    """
+    重量文字列をkg単位の数値に変換する
+
+    入力例: "10kg" / "0.105kg" / "500g"
+    出力例: Decimal('10') / Decimal('0.105') / Decimal('0.5')
+    変換できない場合（"支給" など）は None
+    """
+    number = parse_price(value)
+    if number is None:
+        return None
+    unit = str(value).strip().lower()
+    if unit.endswith('g') and not unit.endswith('kg'):
+        number = number / 1000
+    return number
+
+
+# ひらがな → カタカナ（NFKC で半角カナは全角になるため、かなの表記ゆれはこれで揃う）
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(ord('ぁ'), ord('ゖ') + 1)}
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_search_text(value):
+    """
+    検索用に文字列を正規化する
+
+    NFKC（全角英数・半角カナを統一）→ 小文字化 → ひらがなをカタカナに → 空白を1つにまとめる
+    入力例: "ﾎﾟﾘﾋﾞﾆﾙ ＡＢＣ" / "ぽりびにる abc"
+    出力例: "ポリビニル abc"（どちらも同じ）
+    """
+    if not value:
+        return ''
+    text = unicodedata.normalize('NFKC', str(value)).lower().translate(_HIRAGANA_TO_KATAKANA)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def build_search_text(values):
+    """検索対象フィールドの値を正規化して1つの検索用テキストにまとめる（フィールドの境目は改行）"""
+    return '\n'.join(normalize_search_text(value) for value in values)
+
 
 class Material(models.Model):
     label_note = models.CharField('ラベル用備考', max_length=255)
@@ -40,9 +111,408 @@ class Material(models.Model):
     unnamed_36 = models.CharField('Unnamed: 36', max_length=100)
     unnamed_37 = models.CharField('Unnamed: 37', max_length=100)
 
+    # 文字列フィールドの数値版（ソート・集計用、保存時に自動同期）
+    unit_price_value = models.DecimalField(
+        '単価（数値）', max_digits=18, decimal_places=6, null=True, blank=True, editable=False, db_index=True
+    )
+    main_bag_weight_kg = models.DecimalField(
+        '正袋重量（kg）', max_digits=18, decimal_places=6, null=True, blank=True, editable=False, db_index=True
+    )
+    tare_weight_kg = models.DecimalField(
+        '風袋重量（kg）', max_digits=18, decimal_places=6, null=True, blank=True, editable=False, db_index=True
+    )
+
+    # 検索対象フィールドを正規化して連結したもの（保存時に自動同期、全文検索インデックスの元データ）
+    search_text = models.TextField('検索用テキスト', blank=True, default='', editable=False)
+
     is_active = models.BooleanField('有効', default=True)
     created_at = models.DateTimeField('作成日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
 
+    class Meta:
+        # 一覧のキーセット方式のページ送り用（ソートキー, id の順で範囲検索する）
+        indexes = [
+            models.Index(fields=['material_name', 'id'], name='material_name_keyset_idx'),
+            models.Index(fields=['manufacturer', 'id'], name='material_maker_keyset_idx'),
+            models.Index(fields=['supplier', 'id'], name='material_supplier_keyset_idx'),
+            models.Index(fields=['unit_price_value', 'id'], name='material_price_keyset_idx'),
+        ]
+
+    # 文字列フィールド → (数値フィールド, 変換関数)
+    NUMERIC_SHADOW_FIELDS = {
+        'unit_price': ('unit_price_value', parse_price),
+        'main_bag_weight': ('main_bag_weight_kg', parse_weight_kg),
+        'tare_weight': ('tare_weight_kg', parse_weight_kg),
+    }
+
+    # search_text の元になるフィールド（一覧画面のキーワード検索の対象）
+    SEARCH_SOURCE_FIELDS = (
+        'material_id', 'material_name', 'product_name', 'product_kana', 'manufacturer', 'supplier',
+    )
+
     def __str__(self):
         return self.material_name or self.material_id
+
+    def sync_numeric_fields(self, skip=()):
+        """文字列フィールドから数値フィールドを再計算する（skip の元フィールドは対象外）"""
+        for source, (target, parser) in self.NUMERIC_SHADOW_FIELDS.items():
+            if source not in skip:
+                setattr(self, target, parser(getattr(self, source)))
+
+    def sync_search_text(self):
+        """検索対象フィールドから search_text を再計算する"""
+        self.search_text = build_search_text(getattr(self, field) for field in self.SEARCH_SOURCE_FIELDS)
+
+    def save(self, *args, **kwargs):
+        # only() で読み込んでいない列は、派生フィールドの計算のために1列ずつ読み込まない
+        deferred = self.get_deferred_fields()
+        self.sync_numeric_fields(skip=deferred)
+        update_fields = kwargs.get('update_fields')
+        missing = [field for field in self.SEARCH_SOURCE_FIELDS if field in deferred]
+        # 検索対象の列を1つも読み込んでいない・保存しない場合は search_text は変わらない
+        search_synced = len(missing) < len(self.SEARCH_SOURCE_FIELDS) and (
+            update_fields is None or any(field in update_fields for field in self.SEARCH_SOURCE_FIELDS)
+        )
+        if search_synced:
+            if missing:
+                self.refresh_from_db(fields=missing)
+            self.sync_search_text()
+        if update_fields is not None:
+            synced = [
+                target for source, (target, _) in self.NUMERIC_SHADOW_FIELDS.items()
+                if source in update_fields and source not in deferred
+            ]
+            if search_synced and any(field in update_fields for field in self.SEARCH_SOURCE_FIELDS):
+                synced.append('search_text')
+            kwargs['update_fields'] = list(update_fields) + synced
+        super().save(*args, **kwargs)
+
+
+class Product(models.Model):
+    """製品ID管理.csv の1行（製品マスタ）"""
+    factory = models.CharField('工場', max_length=100)
+    product_id = models.CharField('製品ID', max_length=100)
+    # 同じ製品IDで販売先ごとにラベルを分ける場合の振分ID（通常は空）
+    allocation_id = models.CharField('振分ID', max_length=20, blank=True)
+    separation_id = models.CharField('分離ID', max_length=20, blank=True)
+    product_name = models.CharField('製品名', max_length=255, blank=True)
+    customer = models.CharField('販売先', max_length=100, blank=True)
+
+    batch_volume_a = models.DecimalField('仕込量A(F40)', max_digits=18, decimal_places=6, null=True, blank=True)
+    batch_unit_a = models.CharField('単位A(F40)', max_length=50, blank=True)
+    yield_count_a = models.DecimalField('出来数A(F41)', max_digits=18, decimal_places=6, null=True, blank=True)
+    yield_unit_a = models.CharField('単位A(F41)', max_length=50, blank=True)
+    batch_volume_b = models.DecimalField('仕込量B', max_digits=18, decimal_places=6, null=True, blank=True)
+    batch_unit_b = models.CharField('単位C', max_length=50, blank=True)
+    yield_count_b = models.DecimalField('出来数B', max_digits=18, decimal_places=6, null=True, blank=True)
+    yield_unit_b = models.CharField('単位D', max_length=50, blank=True)
+    fill_volume = models.DecimalField('充填価格', max_digits=18, decimal_places=6, null=True, blank=True)
+    fill_volume_2 = models.DecimalField('充填価格2', max_digits=18, decimal_places=6, null=True, blank=True)
+    calc_b36 = models.CharField('計算(B36)', max_length=100, blank=True)
+
+    title_d35 = models.CharField('Title1(D35)', max_length=100, blank=True)
+    title_f35 = models.CharField('Title2(F35)', max_length=100, blank=True)
+    unit_title_c36 = models.CharField('単位Title(C36)', max_length=100, blank=True)
+    unit_title_c37 = models.CharField('単位Title(C37)', max_length=100, blank=True)
+    unit_title_c38 = models.CharField('単位Title(C38)', max_length=100, blank=True)
+    unit_title_c39 = models.CharField('単位Title(C39)', max_length=100, blank=True)
+    title2_d35 = models.CharField('2Title1(D35)', max_length=100, blank=True)
+    title2_f35 = models.CharField('2Title2(F35)', max_length=100, blank=True)
+    unit_title2_c36 = models.CharField('2単位Title(C36)', max_length=100, blank=True)
+    unit_title2_c37 = models.CharField('2単位Title(C37)', max_length=100, blank=True)
+    unit_title2_c38 = models.CharField('2単位Title(C38)', max_length=100, blank=True)
+    unit_title2_c39 = models.CharField('2単位Title(C39)', max_length=100, blank=True)
+    note1 = models.CharField('備考1', max_length=255, blank=True)
+    note2 = models.CharField('備考2', max_length=255, blank=True)
+
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = '製品'
+        verbose_name_plural = '製品'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['factory', 'product_id', 'allocation_id'], name='uniq_product_key'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['product_id', 'factory'], name='product_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.factory} {self.product_id} {self.product_name}'
+
+
+class PurifiedWaterException(models.Model):
+    """精製水例外リスト.csv の1行（製品・工場ごとの精製水の単価・充填価格の例外）"""
+    product_id = models.CharField('製品ID', max_length=100)
+    factory = models.CharField('工場名', max_length=100)
+    material_cd = models.CharField('原料CD', max_length=100)
+    unit = models.DecimalField('単位', max_digits=18, decimal_places=6, null=True, blank=True)
+    price = models.DecimalField('価格', max_digits=18, decimal_places=6, null=True, blank=True)
+    item_name = models.CharField('商品名', max_length=255, blank=True)
+    fill_price = models.DecimalField('充填価格', max_digits=18, decimal_places=6, null=True, blank=True)
+
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = '精製水例外'
+        verbose_name_plural = '精製水例外'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product_id', 'factory', 'material_cd'], name='uniq_purified_water_exception'
+            ),
+        ]
+
+    @property
+    def price_per_unit(self):
+        """単位あたりの価格（単位が未設定・0 の場合は価格そのもの）"""
+        if self.price is None:
+            return None
+        return self.price / self.unit if self.unit else self.price
+
+    def __str__(self):
+        return f'{self.factory} {self.product_id} {self.material_cd} {self.item_name}'
+
+
+class Formulation(models.Model):
+    """配合（工場・製品ID・パターン単位のレシピ）"""
+    factory = models.CharField('工場', max_length=100)
+    product_id = models.CharField('製品ID', max_length=100)
+    pattern = models.CharField('パターン', max_length=50)
+    product_name = models.CharField('製品名', max_length=255, blank=True)
+    customer = models.CharField('販売先', max_length=100, blank=True)
+
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = '配合'
+        verbose_name_plural = '配合'
+        constraints = [
+            models.UniqueConstraint(fields=['factory', 'product_id', 'pattern'], name='uniq_formulation_key'),
+        ]
+        indexes = [
+            models.Index(fields=['product_id', 'factory'], name='formulation_product_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.factory} {self.product_id}-{self.pattern} {self.product_name}'
+
+
+class FormulationLine(models.Model):
+    """配合詳細一覧.csv の1行（配合に含まれる原料）"""
+    formulation = models.ForeignKey(
+        Formulation, on_delete=models.CASCADE, related_name='lines', verbose_name='配合'
+    )
+    # 原料CD は原料マスタの原料IDを指す。マスタ未登録の原料CDもあるためDB制約は付けない
+    material = models.ForeignKey(
+        Material,
+        to_field='material_id',
+        db_column='material_cd',
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name='formulation_lines',
+        verbose_name='原料CD',
+    )
+    material_name = models.CharField('原料名', max_length=255, blank=True)
+    manufacturer = models.CharField('製造所', max_length=100, blank=True)
+    correction_type = models.CharField('補正区分', max_length=50, blank=True)
+    quantity_kg = models.DecimalField('配合量(kg)', max_digits=18, decimal_places=6, null=True, blank=True)
+    weighing_type = models.CharField('秤量区分', max_length=50, blank=True)
+    weighing_place = models.CharField('秤量場所', max_length=100, blank=True)
+    input_group_no = models.IntegerField('投入G番号', null=True, blank=True)
+    input_group_name = models.CharField('投入G名称', max_length=100, blank=True)
+    usage_status = models.CharField('使用状況', max_length=50, blank=True)
+    note = models.CharField('備考', max_length=255, blank=True)
+
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = '配合明細'
+        verbose_name_plural = '配合明細'
+        indexes = [
+            # 「原料Xを使う製品」の検索用
+            models.Index(fields=['material', 'formulation'], name='formulationline_material_idx'),
+        ]
+
+    @property
+    def material_cd(self):
+        return self.material_id
+
+    def __str__(self):
+        return f'{self.formulation_id} {self.material_name or self.material_id}'
+
+
+class FormulationCost(models.Model):
+    """配合ごとの原料費（costing.refresh_costs で再計算される集計テーブル）"""
+    formulation = models.OneToOneField(
+        Formulation, on_delete=models.CASCADE, primary_key=True, related_name='cost', verbose_name='配合'
+    )
+    material_cost = models.DecimalField('原料費', max_digits=18, decimal_places=2, default=0)
+    total_quantity_kg = models.DecimalField('配合量合計(kg)', max_digits=18, decimal_places=6, default=0)
+    line_count = models.IntegerField('明細数', default=0)
+    unpriced_line_count = models.IntegerField('単価未設定の明細数', default=0)
+    is_stale = models.BooleanField('再計算待ち', default=False, db_index=True)
+    computed_at = models.DateTimeField('計算日時', auto_now=True)
+
+    class Meta:
+        verbose_name = '配合原料費'
+        verbose_name_plural = '配合原料費'
+
+    def __str__(self):
+        return f'{self.formulation} {self.material_cost}'
+
+
+class UploadStaging(models.Model):
+    """プレビュー済みのアップロードCSV（インポート実行時に再アップロードせずに使う）"""
+    token = models.UUIDField('トークン', primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField('ファイル名', max_length=255)
+    encoding = models.CharField('エンコーディング', max_length=20)
+    id_column = models.CharField('原料ID列', max_length=100)
+    row_count = models.IntegerField('行数', default=0)
+    # zlib 圧縮した JSON（{"columns": [...], "data": [[...], ...]}）
+    data = models.BinaryField('データ')
+    created_at = models.DateTimeField('作成日時', auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'アップロード一時データ'
+        verbose_name_plural = 'アップロード一時データ'
+
+    def __str__(self):
+        return f'{self.filename} ({self.row_count}行)'
+
+
+class CSVImportState(models.Model):
+    """取り込み済みCSVの内容ハッシュ（変更のない再読み込みを省略するため）"""
+    source = models.CharField('取り込み元', max_length=100, unique=True)
+    content_hash = models.CharField('内容ハッシュ', max_length=64)
+    encoding = models.CharField('エンコーディング', max_length=20, blank=True)
+    columns = models.JSONField('列名', default=list)
+    # 列の対応表（column_mapping.REGISTRY_SIGNATURE）が変わったら記録を使わない
+    mapping_signature = models.CharField('列対応の版', max_length=16, blank=True)
+    row_count = models.IntegerField('行数', default=0)
+    # 原料ID → 行ハッシュ（16桁の16進数）
+    row_hashes = models.JSONField('行ハッシュ', default=dict)
+    # 取り込み直後の原料テーブルの状態（取り込み以外でDBが変わったことの検出用）
+    material_count = models.IntegerField('原料件数', default=0)
+    material_updated_at = models.DateTimeField('原料の最終更新日時', null=True, blank=True)
+    imported_at = models.DateTimeField('取り込み日時', auto_now=True)
+
+    class Meta:
+        verbose_name = 'CSV取り込み状態'
+        verbose_name_plural = 'CSV取り込み状態'
+
+    def __str__(self):
+        return f'{self.source} ({self.row_count}行)'
+
+
+class ImportJob(models.Model):
+    """CSV取り込みのバックグラウンドジョブ（進捗は import_jobs.JobProgress が更新する）"""
+    KIND_CHOICES = [
+        ('master', '原料マスタCSV読み込み'),
+        ('upload', '原料CSVアップロード'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', '待機中'),
+        ('running', '実行中'),
+        ('succeeded', '完了'),
+        ('failed', '失敗'),
+    ]
+    # errors に保持する行エラーの上限
+    MAX_ERRORS = 100
+
+    kind = models.CharField('種類', max_length=20, choices=KIND_CHOICES)
+    status = models.CharField('状態', max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    filename = models.CharField('ファイル名', max_length=255, blank=True)
+    overwrite_mode = models.CharField('上書きモード', max_length=20, blank=True)
+    total_rows = models.IntegerField('総行数', default=0)
+    processed_rows = models.IntegerField('処理済み行数', default=0)
+    created_count = models.IntegerField('新規作成', default=0)
+    updated_count = models.IntegerField('更新', default=0)
+    skipped_count = models.IntegerField('スキップ', default=0)
+    error_count = models.IntegerField('エラー', default=0)
+    errors = models.JSONField('行エラー', default=list, blank=True)
+    message = models.TextField('メッセージ', blank=True)
+
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    started_at = models.DateTimeField('開始日時', null=True, blank=True)
+    finished_at = models.DateTimeField('終了日時', null=True, blank=True)
+
+    class Meta:
+        verbose_name = '取り込みジョブ'
+        verbose_name_plural = '取り込みジョブ'
+        ordering = ['-created_at']
+
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    @property
+    def progress_percent(self):
+        if not self.total_rows:
+            return 100 if self.is_finished else 0
+        return min(100, round(self.processed_rows * 100 / self.total_rows))
+
+    @property
+    def elapsed_seconds(self):
+        if not self.started_at:
+            return 0
+        end = self.finished_at or timezone.now()
+        return (end - self.started_at).total_seconds()
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed_seconds
+        return round(self.processed_rows / elapsed, 1) if elapsed else 0
+
+    def to_dict(self):
+        return {
+            'id': self.pk,
+            'kind': self.kind,
+            'kind_display': self.get_kind_display(),
+            'status': self.status,
+            'status_display': self.get_status_display(),
+            'is_finished': self.is_finished,
+            'filename': self.filename,
+            'overwrite_mode': self.overwrite_mode,
+            'total_rows': self.total_rows,
+            'processed_rows': self.processed_rows,
+            'progress_percent': self.progress_percent,
+            'created': self.created_count,
+            'updated': self.updated_count,
+            'skipped': self.skipped_count,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'message': self.message,
+            'elapsed_seconds': round(self.elapsed_seconds, 1),
+            'rows_per_second': self.rows_per_second,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __str__(self):
+        return f'#{self.pk} {self.get_kind_display()} {self.get_status_display()}'
+
+
+
+class DataVersion(models.Model):
+    """
+    データの版（data_version.bump_data_version が更新する）
+
+    画面の ETag・一覧キャッシュのキーに使う。DBに置くため、複数のワーカー間でも同じ版になる。
+    """
+    name = models.CharField('名前', max_length=50, primary_key=True)
+    version = models.CharField('版', max_length=32)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = 'データの版'
+        verbose_name_plural = 'データの版'
+
+    def __str__(self):
+        return f'{self.name} {self.version}'
@@ -0,0 +1,139 @@
+# materials/product_loader.py - 製品ID管理.csv の一括読み込み
+import logging
+import os
+
+from django.conf import settings
+from django.db import transaction
+
+from .costing import ID_CHUNK_SIZE
+from .encoding import read_csv
+from .models import Product, parse_price
+
+logger = logging.getLogger(__name__)
+
+
+def _to_decimal(value):
+    """'10000.0' → Decimal、'-' や空は None"""
+    return parse_price(value) if value and value != '-' else None
+
+
+class ProductCSVLoader:
+    """製品ID管理.csv を Product に一括で書き込む（工場・製品ID・振分ID で upsert）"""
+
+    # CSV列名 → (フィールド, 変換関数)
+    COLUMN_MAPPING = {
+        '工場': ('factory', None),
+        '製品ID': ('product_id', None),
+        '振分ID': ('allocation_id', None),
+        '分離ID': ('separation_id', None),
+        '製品名': ('product_name', None),
+        '販売先': ('customer', None),
+        '仕込量A(F40)': ('batch_volume_a', _to_decimal),
+        '単位A(F40)': ('batch_unit_a', None),
+        '出来数A(F41)': ('yield_count_a', _to_decimal),
+        '単位A(F41)': ('yield_unit_a', None),
+        '仕込量B': ('batch_volume_b', _to_decimal),
+        '単位C': ('batch_unit_b', None),
+        '出来数B': ('yield_count_b', _to_decimal),
+        '単位D': ('yield_unit_b', None),
+        '充填価格': ('fill_volume', _to_decimal),
+        '充填価格2': ('fill_volume_2', _to_decimal),
+        '計算(B36)': ('calc_b36', None),
+        'Title1(D35)': ('title_d35', None),
+        'Title2(F35)': ('title_f35', None),
+        '単位Title(C36)': ('unit_title_c36', None),
+        '単位Title(C37)': ('unit_title_c37', None),
+        '単位Title(C38)': ('unit_title_c38', None),
+        '単位Title(C39)': ('unit_title_c39', None),
+        '2Title1(D35)': ('title2_d35', None),
+        '2Title2(F35)': ('title2_f35', None),
+        '2単位Title(C36)': ('unit_title2_c36', None),
+        '2単位Title(C37)': ('unit_title2_c37', None),
+        '2単位Title(C38)': ('unit_title2_c38', None),
+        '2単位Title(C39)': ('unit_title2_c39', None),
+        '備考1': ('note1', None),
+        '備考2': ('note2', None),
+    }
+    REQUIRED_COLUMNS = ('工場', '製品ID')
+    KEY_FIELDS = ('factory', 'product_id', 'allocation_id')
+
+    def __init__(self):
+        self.data_dir = os.path.join(settings.BASE_DIR, 'data')
+        self.csv_file = '製品ID管理.csv'
+
+    def get_file_path(self):
+        return os.path.join(self.data_dir, self.csv_file)
+
+    def read_csv(self, file_path):
+        return read_csv(file_path, dtype=str, keep_default_na=False)
+
+    def load_products(self, file_path=None):
+        """
+        製品マスタを読み込む（CSVにない製品は削除）
+
+        Returns:
+            dict: MaterialCSVLoader と同じ形式の結果
+        """
+        file_path = file_path or self.get_file_path()
+        if not os.path.exists(file_path):
+            return {'success': False, 'error': f'CSVファイルが見つかりません: {os.path.basename(file_path)}'}
+
+        try:
+            df, encoding = self.read_csv(file_path)
+            missing = [col for col in self.REQUIRED_COLUMNS if col not in df.columns]
+            if missing:
+                raise ValueError(f"必須列が見つかりません: {', '.join(missing)}")
+
+            columns = {}
+            for col, (field, converter) in self.COLUMN_MAPPING.items():
+                if col not in df.columns:
+                    continue
+                values = df[col].str.strip()
+                columns[field] = values.map(converter).tolist() if converter else values.tolist()
+            fields = list(columns)
+
+            products = {}
+            skipped = 0
+            for values in zip(*columns.values()):
+                row = dict(zip(fields, values))
+                key = tuple(row.get(field, '') for field in self.KEY_FIELDS)
+                # 工場・製品IDが空の行と、同じキーの2行目以降は読み込まない
+                if not (key[0] and key[1]) or key in products:
+                    skipped += 1
+                    continue
+                products[key] = row
+
+            with transaction.atomic():
+                # キー → id（CSVにないキーは id でまとめて削除する）
+                existing = {
+                    tuple(key): pk for pk, *key in Product.objects.values_list('id', *self.KEY_FIELDS).iterator()
+                }
+                Product.objects.bulk_create(
+                    [Product(**row) for row in products.values()],
+                    batch_size=500,
+                    update_conflicts=True,
+                    unique_fields=list(self.KEY_FIELDS),
+                    update_fields=[f for f in fields if f not in self.KEY_FIELDS] + ['updated_at'],
+                )
+                removed = [pk for key, pk in existing.items() if key not in products]
+                for start in range(0, len(removed), ID_CHUNK_SIZE):
+                    Product.objects.filter(pk__in=removed[start:start + ID_CHUNK_SIZE]).delete()
+
+            created = len(products.keys() - existing)
+            logger.info(
+                f"製品マスタ読み込み完了: 新規{created}, 更新{len(products) - created}, 削除{len(removed)}, スキップ{skipped}"
+            )
+            return {
+                'success': True,
+                'created': created,
+                'updated': len(products) - created,
+                'deleted': len(removed),
+                'skipped': skipped,
+                'total_rows': len(df),
+                'encoding_used': encoding,
+            }
+
+        except Exception as e:
+            error_msg = f"製品CSV読み込みエラー: {str(e)}"
+            logger.error(error_msg)
+            return {'success': False, 'error': error_msg}
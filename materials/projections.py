@@ -0,0 +1,30 @@
+# materials/projections.py - 画面ごとに読み込む原料の列
+"""
+Material は40近い文字列列を持つため、画面ごとに表示に使う列だけを読み込む。
+
+- 一覧画面: list_rows() で values_list(named=True) の行（Material インスタンスを作らない）
+- 一覧API: values(*LIST_API_FIELDS)
+- 管理画面の一覧: only(*ADMIN_CHANGELIST_FIELDS)
+- CSV出力: export.py の列定義（values_list() を iterator() で）
+
+列を増やすときはここに追加する（テンプレートで使う列が足りないと AttributeError になる）。
+"""
+
+# 一覧画面の列（キーセット方式のページ送りに使うソート列を含む）
+LIST_FIELDS = (
+    'id', 'material_id', 'material_name', 'product_name', 'material_category', 'category',
+    'manufacturer', 'supplier', 'unit_price', 'unit_price_value', 'label_note',
+)
+
+# 一覧APIで返す列
+LIST_API_FIELDS = LIST_FIELDS + ('is_active',)
+
+# 管理画面の一覧（list_display と同じ）
+ADMIN_CHANGELIST_FIELDS = (
+    'material_id', 'material_name', 'manufacturer', 'supplier', 'unit_price', 'is_active', 'created_at', 'updated_at',
+)
+
+
+def list_rows(queryset):
+    """一覧画面用の軽量な行（属性で列にアクセスできる名前付きタプル）"""
+    return queryset.values_list(*LIST_FIELDS, named=True)
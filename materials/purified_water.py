@@ -0,0 +1,165 @@
+# materials/purified_water.py - 精製水例外リストの読み込みとメモリ上の索引
+"""
+精製水例外リスト.csv の内容を PurifiedWaterException に読み込み、
+(製品ID, 工場, 原料CD) → WaterOverride の読み取り専用の辞書としてプロセス内に保持する。
+
+原料費の集計では明細ごとにDBを引かず、この索引を参照して単価を差し替える。
+索引は読み込み・管理画面での変更のたびに作り直す。
+"""
+import logging
+import os
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .encoding import read_csv
+from .models import PurifiedWaterException, parse_price
+
+logger = logging.getLogger(__name__)
+
+WaterOverride = namedtuple('WaterOverride', ['unit', 'price', 'price_per_unit', 'fill_price'])
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _build_index():
+    index = {}
+    for exception in PurifiedWaterException.objects.all():
+        key = (exception.product_id, exception.factory, exception.material_cd)
+        index[key] = WaterOverride(
+            unit=exception.unit,
+            price=exception.price,
+            price_per_unit=exception.price_per_unit,
+            fill_price=exception.fill_price,
+        )
+    return MappingProxyType(index)
+
+
+def rebuild_water_index():
+    """索引をDBから作り直す"""
+    global _index
+    with _index_lock:
+        _index = _build_index()
+    logger.info(f"精製水例外の索引を再構築: {len(_index)}件")
+    return _index
+
+
+def get_water_index():
+    """
+    (製品ID, 工場, 原料CD) → WaterOverride の読み取り専用辞書を返す
+
+    初回だけDBから読み込み、以降はプロセス内の索引を使い回す。
+    """
+    index = _index
+    if index is None:
+        index = rebuild_water_index()
+    return index
+
+
+def invalidate_water_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def get_water_override(product_id, factory, material_cd):
+    return get_water_index().get((str(product_id), str(factory), str(material_cd)))
+
+
+class PurifiedWaterCSVLoader:
+    """精製水例外リスト.csv を全件入れ替えで読み込む"""
+
+    # CSV列名 → (フィールド, 変換関数)
+    COLUMN_MAPPING = {
+        '製品ID': ('product_id', None),
+        '工場名': ('factory', None),
+        '原料CD': ('material_cd', None),
+        '単位': ('unit', parse_price),
+        '価格': ('price', parse_price),
+        '商品名': ('item_name', None),
+        '充填価格': ('fill_price', parse_price),
+    }
+    REQUIRED_COLUMNS = ('製品ID', '工場名', '原料CD')
+
+    def __init__(self):
+        self.data_dir = os.path.join(settings.BASE_DIR, 'data')
+        self.csv_file = '精製水例外リスト.csv'
+
+    def get_file_path(self):
+        return os.path.join(self.data_dir, self.csv_file)
+
+    def read_csv(self, file_path):
+        return read_csv(file_path, dtype=str, keep_default_na=False)
+
+    def load_exceptions(self, file_path=None):
+        """
+        精製水例外を読み込み、索引を作り直す
+
+        Returns:
+            dict: MaterialCSVLoader と同じ形式の結果
+        """
+        from .costing import mark_costs_stale
+
+        file_path = file_path or self.get_file_path()
+        if not os.path.exists(file_path):
+            return {'success': False, 'error': f'CSVファイルが見つかりません: {os.path.basename(file_path)}'}
+
+        try:
+            df, encoding = self.read_csv(file_path)
+            missing = [col for col in self.REQUIRED_COLUMNS if col not in df.columns]
+            if missing:
+                raise ValueError(f"必須列が見つかりません: {', '.join(missing)}")
+
+            rows = {}
+            skipped = 0
+            for record in df.to_dict('records'):
+                row = {
+                    field: converter(record[col].strip()) if converter else record[col].strip()
+                    for col, (field, converter) in self.COLUMN_MAPPING.items()
+                    if col in record
+                }
+                key = (row['product_id'], row['factory'], row['material_cd'])
+                if not all(key) or key in rows:
+                    skipped += 1
+                    continue
+                rows[key] = row
+
+            with transaction.atomic():
+                PurifiedWaterException.objects.all().delete()
+                PurifiedWaterException.objects.bulk_create(
+                    [PurifiedWaterException(**row) for row in rows.values()]
+                )
+
+            rebuild_water_index()
+            # 例外の対象原料を使う配合の原料費を再計算待ちにする
+            mark_costs_stale(material_ids={key[2] for key in rows})
+
+            logger.info(f"精製水例外読み込み完了: {len(rows)}件, スキップ{skipped}")
+            return {
+                'success': True,
+                'created': len(rows),
+                'skipped': skipped,
+                'total_rows': len(df),
+                'encoding_used': encoding,
+            }
+
+        except Exception as e:
+            error_msg = f"精製水例外CSV読み込みエラー: {str(e)}"
+            logger.error(error_msg)
+            return {'success': False, 'error': error_msg}
+
+
+@receiver(post_save, sender=PurifiedWaterException)
+@receiver(post_delete, sender=PurifiedWaterException)
+def _invalidate_on_change(sender, instance, **kwargs):
+    # 次の参照時に作り直す（一括読み込みは rebuild_water_index を直接呼ぶ）
+    from .costing import mark_costs_stale
+
+    invalidate_water_index()
+    mark_costs_stale(material_ids=[instance.material_cd])
@@ -0,0 +1,168 @@
+# materials/search.py - 原料のキーワード検索（正規化テキスト + 全文検索インデックス）
+"""
+原料一覧・管理画面のキーワード検索。
+
+検索対象（Material.SEARCH_SOURCE_FIELDS）は保存時に正規化して search_text に連結しておき、
+検索語も同じ規則（normalize_search_text）で正規化してから照合する。
+そのため全角/半角・ひらがな/カタカナ・大文字/小文字の違いは無視される。
+
+- 3文字以上の語: SQLite の FTS5（trigram トークナイザ）の索引で部分一致
+- 2文字以下の語・FTS5 が使えない環境: search_text の LIKE（1列だけの走査）
+- 空白で区切った複数の語はすべてを含む行（AND）
+
+FTS5 のテーブルは search_text を元データとする外部コンテンツ形式で、
+原料テーブルのトリガーで自動的に同期される（マイグレーション 0012 で作成）。
+
+SQLite では原料テーブルを作り直すマイグレーション（AlterField など）でトリガーが消えるため、
+migrate のたびに ensure_fts_triggers() で確認し、消えていれば作り直して索引を再構築する。
+"""
+import logging
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models.expressions import RawSQL
+
+from .costing import ID_CHUNK_SIZE
+from .models import Material, build_search_text, normalize_search_text
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'materials_material_fts'
+# trigram トークナイザは3文字未満の語を索引で検索できない
+MIN_FTS_TERM_LENGTH = 3
+
+# 原料テーブルの変更を全文検索テーブルに反映するトリガー（0012 で作成したものと同じ）
+FTS_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""
+        CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON materials_material BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text);
+        END
+    """,
+    f'{FTS_TABLE}_ad': f"""
+        CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON materials_material BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+        END
+    """,
+    f'{FTS_TABLE}_au': f"""
+        CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF search_text ON materials_material BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+            INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text);
+        END
+    """,
+}
+
+_fts_available = {}
+
+
+def search_terms(query):
+    """検索語を正規化して空白で分割する"""
+    return normalize_search_text(query).split()
+
+
+def fts_available():
+    """現在のDBに全文検索テーブルがあるか（DBごとに1回だけ確認）"""
+    key = (connection.vendor, str(connection.settings_dict.get('NAME')))
+    if key not in _fts_available:
+        available = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                available = cursor.fetchone() is not None
+        _fts_available[key] = available
+    return _fts_available[key]
+
+
+def ensure_fts_triggers(using=DEFAULT_DB_ALIAS):
+    """
+    全文検索テーブルがあるのに同期トリガーが欠けていれば作り直し、索引を再構築する
+
+    Returns:
+        list: 作り直したトリガー名（全文検索テーブルがない・揃っている場合は空）
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return []
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT type, name FROM sqlite_master WHERE (type = 'table' AND name = %s) OR type = 'trigger'",
+            [FTS_TABLE],
+        )
+        existing = cursor.fetchall()
+        if ('table', FTS_TABLE) not in existing:
+            return []
+        missing = [name for name in FTS_TRIGGERS if ('trigger', name) not in existing]
+        if missing:
+            for name in missing:
+                cursor.execute(FTS_TRIGGERS[name])
+            # トリガーがなかった間の変更を反映する
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    if missing:
+        logger.warning(f"全文検索のトリガーが消えていたため作り直しました: {', '.join(missing)}")
+    return missing
+
+
+def ensure_fts_triggers_after_migrate(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate のハンドラ（apps.MaterialsConfig.ready で登録）"""
+    ensure_fts_triggers(using)
+
+
+def _fts_phrase(term):
+    # 検索語全体を1つのフレーズとして扱う（FTS5 の演算子・記号を無効化）
+    return '"' + term.replace('"', '""') + '"'
+
+
+def search_materials(queryset, query):
+    """
+    キーワードで原料を絞り込む
+
+    Args:
+        queryset (QuerySet): Material の QuerySet
+        query (str): 画面で入力された検索語（空白区切りで AND）
+    """
+    use_fts = None
+    for term in search_terms(query):
+        if len(term) >= MIN_FTS_TERM_LENGTH:
+            if use_fts is None:
+                use_fts = fts_available()
+            if use_fts:
+                queryset = queryset.filter(pk__in=RawSQL(
+                    f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [_fts_phrase(term)]
+                ))
+                continue
+        queryset = queryset.filter(search_text__contains=term)
+    return queryset
+
+
+def refresh_search_text(material_ids=None):
+    """
+    search_text を検索対象フィールドから再計算し、変わった行だけ更新する
+
+    bulk_create / QuerySet.update() は Material.save() を通らないため、
+    検索対象の列をすべて含まない書き込みのあとに呼び出す。
+
+    Args:
+        material_ids (list): 対象の原料ID（None ならすべて）
+
+    Returns:
+        int: 更新した件数
+    """
+    fields = ('id',) + Material.SEARCH_SOURCE_FIELDS + ('search_text',)
+    if material_ids is None:
+        chunks = [Material.objects.values_list(*fields)]
+    else:
+        material_ids = list(material_ids)
+        chunks = [
+            Material.objects.filter(material_id__in=material_ids[start:start + ID_CHUNK_SIZE]).values_list(*fields)
+            for start in range(0, len(material_ids), ID_CHUNK_SIZE)
+        ]
+
+    stale = []
+    for chunk in chunks:
+        for pk, *values, current in chunk:
+            search_text = build_search_text(values)
+            if search_text != current:
+                stale.append(Material(pk=pk, search_text=search_text))
+
+    if stale:
+        Material.objects.bulk_update(stale, ['search_text'], batch_size=500)
+        logger.debug(f"検索用テキストを更新: {len(stale)}件")
+    return len(stale)
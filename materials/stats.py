@@ -0,0 +1,87 @@
+# materials/stats.py - 原料統計（ダッシュボード・一覧ヘッダー用）
+import logging
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import cache_get, cache_set
+from .data_version import bump_data_version, get_data_version
+from .models import Material
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_TIMEOUT = getattr(settings, 'MATERIAL_STATS_CACHE_TIMEOUT', 300)
+
+
+def compute_material_stats():
+    """
+    原料統計を1クエリで集計する
+
+    分類ごとに条件付き集計（GROUP BY category）を行い、
+    全体の件数・平均単価は分類別の結果を合算して求める。
+    """
+    has_price = Q(unit_price_value__gt=0)
+    rows = (
+        Material.objects
+        .order_by()
+        .values('category')
+        .annotate(
+            total=Count('id'),
+            active=Count('id', filter=Q(is_active=True)),
+            with_price=Count('id', filter=has_price),
+            price_sum=Sum('unit_price_value', filter=has_price),
+        )
+    )
+
+    stats = {
+        'total': 0,
+        'active': 0,
+        'inactive': 0,
+        'with_price': 0,
+        'without_price': 0,
+        'avg_price': 0,
+        'categories': [],
+    }
+    price_sum = 0
+    for row in rows:
+        stats['total'] += row['total']
+        stats['active'] += row['active']
+        stats['with_price'] += row['with_price']
+        price_sum += row['price_sum'] or 0
+        stats['categories'].append({
+            'category': row['category'] or '未分類',
+            'count': row['total'],
+        })
+
+    stats['inactive'] = stats['total'] - stats['active']
+    stats['without_price'] = stats['total'] - stats['with_price']
+    if stats['with_price']:
+        stats['avg_price'] = price_sum / stats['with_price']
+    stats['categories'].sort(key=lambda c: c['count'], reverse=True)
+    return stats
+
+
+def get_material_stats():
+    """キャッシュ済みの原料統計を返す（なければ集計してキャッシュ）"""
+    # キーに版を含めるため、他のワーカーで更新された後は古い統計を使わない
+    version = get_data_version()
+    stats = cache_get('stats', version)
+    if stats is None:
+        stats = compute_material_stats()
+        cache_set('stats', version, value=stats, timeout=STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def invalidate_material_stats():
+    """原料データの更新後に呼び出し、データの版を上げる（統計・画面のキャッシュは版ごとのキーのため作り直される）"""
+    bump_data_version()
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+def _invalidate_on_change(sender, **kwargs):
+    # save()/delete() 経由の更新（管理画面の編集など）。
+    # bulk_create や QuerySet.update() はシグナルが飛ばないため呼び出し側で破棄する。
+    invalidate_material_stats()
@@ -1,3 +1,383 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import QuerySet
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from .costing import refresh_costs
+from .csv_loader import MaterialCSVLoader
+from .encoding import sniff_encoding
+from .formula_engine import CellPlan, FormulaError, FormulaRuleSet, IncrementalEvaluator, compile_formula
+from .formulation_loader import FormulationCSVLoader
+from .keyset import keyset_page, sort_queryset
+from .models import Formulation, FormulationCost, FormulationLine, ImportJob, Material
+from .purified_water import invalidate_water_index
+from .search import fts_available, search_materials
+from .upload_import import find_id_column, parse_upload, preview_upload_changes
+
+
+class MasterReloadTests(TestCase):
+    """原料マスタCSVの再読み込み"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        with open(os.path.join(self.data_dir, '原料マスタ詳細.csv'), 'w', encoding='cp932', newline='') as f:
+            f.write('原料ID,原料名\r\n')
+            for i in range(5):
+                f.write(f'M{i:03},原料{i}\r\n')
+        self.loader = MaterialCSVLoader()
+        self.loader.data_dir = self.data_dir
+
+    def test_reload_same_file_reactivates_materials_deactivated_in_admin(self):
+        self.assertTrue(self.loader.load_materials()['success'])
+
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        self.client.post(reverse('admin:materials_material_changelist'), {
+            'action': 'deactivate_materials',
+            '_selected_action': list(Material.objects.values_list('pk', flat=True)),
+        })
+        self.assertEqual(Material.objects.filter(is_active=False).count(), 5)
+
+        result = self.loader.load_materials()
+
+        self.assertTrue(result['success'])
+        self.assertEqual(Material.objects.filter(is_active=False).count(), 0)
+
+    def test_bad_row_is_reported_and_other_rows_are_written(self):
+        bulk_create = QuerySet.bulk_create
+
+        def failing_bulk_create(queryset, objs, *args, **kwargs):
+            if any(obj.material_id == 'M002' for obj in objs):
+                raise ValueError('書き込めない値')
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', failing_bulk_create):
+            result = self.loader.load_materials()
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['created'], 4)
+        self.assertEqual(result['skipped'], 1)
+        self.assertEqual(len(result['errors']), 1)
+        self.assertIn('M002', result['errors'][0])
+        self.assertFalse(Material.objects.filter(material_id='M002').exists())
+        self.assertEqual(Material.objects.count(), 4)
+        # エラーがあった取り込みは、次回も全行を読み込む
+        self.assertFalse(self.loader.load_materials().get('file_unchanged', False))
+
+    def test_unchanged_file_still_reactivates_materials(self):
+        self.assertTrue(self.loader.load_materials()['success'])
+        # updated_at を変えない書き込み（取り込み状態の照合では検知できない）
+        Material.objects.filter(material_id__in=['M000', 'M001']).update(is_active=False)
+
+        result = self.loader.load_materials()
+
+        self.assertTrue(result['file_unchanged'])
+        self.assertEqual(result['reactivated'], 2)
+        self.assertEqual(Material.objects.filter(is_active=False).count(), 0)
+
+
+    def test_materials_missing_from_the_file_are_deactivated(self):
+        self.assertTrue(self.loader.load_materials_with_overwrite('delta')['success'])
+        with open(os.path.join(self.data_dir, '原料マスタ詳細.csv'), 'w', encoding='cp932', newline='') as f:
+            f.write('原料ID,原料名\r\n')
+            for i in (0, 1, 2, 5):
+                f.write(f'M{i:03},原料{i}\r\n')
+
+        result = self.loader.load_materials_with_overwrite('delta')
+
+        self.assertTrue(result['success'])
+        self.assertEqual((result['created'], result['deactivated']), (1, 2))
+        self.assertEqual(
+            sorted(Material.objects.filter(is_active=False).values_list('material_id', flat=True)), ['M003', 'M004']
+        )
+
+    def test_blank_price_and_weight_stay_blank(self):
+        with open(os.path.join(self.data_dir, '原料マスタ詳細.csv'), 'w', encoding='cp932', newline='') as f:
+            f.write('原料ID,原料名,単価,正袋重量\r\nM000,原料0,,\r\nM001,原料1,"￥1,200",500g\r\n')
+
+        self.assertTrue(self.loader.load_materials()['success'])
+
+        blank = Material.objects.get(material_id='M000')
+        self.assertEqual((blank.unit_price, blank.main_bag_weight), ('', ''))
+        self.assertIsNone(blank.unit_price_value)
+        self.assertIsNone(blank.main_bag_weight_kg)
+        priced = Material.objects.get(material_id='M001')
+        self.assertEqual(priced.unit_price_value, Decimal('1200'))
+        self.assertEqual(priced.main_bag_weight_kg, Decimal('0.5'))
+
+class MaterialListCursorTests(TestCase):
+    """一覧・一覧APIのページ送りカーソル"""
+
+    def setUp(self):
+        for i in range(3):
+            Material.objects.create(material_id=f'M{i:03}', material_name=f'原料{i}', unit_price=str(i * 100))
+
+    def _cursor(self, payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+    def test_pages_walk_forward_and_back_across_null_prices(self):
+        for i in range(3, 8):
+            Material.objects.create(material_id=f'M{i:03}', material_name=f'原料{i}', unit_price='' if i % 2 else '150')
+        # 単価なし（NULL）は0円扱いで昇順の先頭
+        expected = list(
+            sort_queryset(Material.objects.all(), 'unit_price').values_list('material_id', flat=True)
+        )
+        self.assertEqual(expected[:3], ['M003', 'M005', 'M007'])
+
+        seen = []
+        cursor = None
+        while True:
+            page = keyset_page(Material.objects.all(), 'unit_price', per_page=3, after=cursor)
+            seen += [material.material_id for material in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+
+        last = keyset_page(Material.objects.all(), 'unit_price', per_page=3, last=True)
+        self.assertEqual([material.material_id for material in last], expected[-3:])
+        previous = keyset_page(Material.objects.all(), 'unit_price', per_page=3, before=last.prev_cursor)
+        self.assertEqual([material.material_id for material in previous], expected[-6:-3])
+        self.assertTrue(previous.has_next)
+
+    def test_garbage_cursor_returns_first_page(self):
+        for value in ('abc', {'v': 'abc'}, [1], 'NaN'):
+            for url in (reverse('materials:material_list'), reverse('materials:material_list_api')):
+                with self.subTest(value=value, url=url):
+                    response = self.client.get(url, {'sort': 'unit_price', 'cursor': self._cursor([value, 1])})
+                    self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(
+            reverse('materials:material_list_api'), {'sort': 'unit_price', 'cursor': self._cursor(['abc', 1])}
+        )
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertFalse(response.json()['has_previous'])
+
+
+class FormulationCostTests(TestCase):
+    """配合ごとの原料費の集計"""
+
+    def setUp(self):
+        invalidate_water_index()
+        self.addCleanup(invalidate_water_index)
+        self.formulation = Formulation.objects.create(factory='本社', product_id='P001', pattern='01')
+        for material_id, unit_price, order_unit, quantity in [
+            ('M001', '1000', 'kg', '2'),
+            ('M002', '50', 'g', '0.5'),
+            ('M003', '', 'kg', '1'),
+            ('M004', '300', '錠', '1'),
+            ('M005', '300', '', '1'),
+        ]:
+            Material.objects.create(
+                material_id=material_id, material_name=material_id, unit_price=unit_price, order_unit=order_unit
+            )
+            FormulationLine.objects.create(formulation=self.formulation, material_id=material_id, quantity_kg=quantity)
+
+    def test_unconvertible_units_are_counted_as_unpriced(self):
+        refresh_costs()
+
+        cost = FormulationCost.objects.get(formulation=self.formulation)
+        # 1000円/kg × 2kg + 50円/g × 0.5kg
+        self.assertEqual(cost.material_cost, Decimal('27000.00'))
+        self.assertEqual(cost.total_quantity_kg, Decimal('5.5'))
+        self.assertEqual(cost.line_count, 5)
+        # 単価なし・錠・単位なし
+        self.assertEqual(cost.unpriced_line_count, 3)
+
+    def test_price_change_is_recalculated_after_commit(self):
+        refresh_costs()
+        material = Material.objects.get(material_id='M001')
+        material.unit_price = '2000'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            material.save()
+
+        cost = FormulationCost.objects.get(formulation=self.formulation)
+        self.assertFalse(cost.is_stale)
+        self.assertEqual(cost.material_cost, Decimal('29000.00'))
+
+
+class FormulaEngineTests(TestCase):
+    """計算式ルールのコンパイルと評価"""
+
+    def _plan(self):
+        formulas = {
+            'D36': compile_formula('=+G34/G3'),
+            'D37': compile_formula('=D36*(1000/100)'),
+            'D38': compile_formula('=F40*2'),
+        }
+        return CellPlan('本社', 'P001', '', formulas, {'F40': '1,000'})
+
+    def test_compile_collects_refs_and_rejects_other_expressions(self):
+        self.assertEqual(compile_formula('=+G34/G3').refs, {'G34', 'G3'})
+        for text in ('G34/G3', '=__import__("os")', '=G34.real', '=abs(G34)'):
+            with self.subTest(text=text), self.assertRaises(FormulaError):
+                compile_formula(text)
+
+    def test_evaluate_in_dependency_order_with_line_arrays(self):
+        results = self._plan().evaluate({'G3': '4', 'G34': np.array([2.0, 8.0])})
+
+        np.testing.assert_array_equal(results['D36'], [0.5, 2.0])
+        np.testing.assert_array_equal(results['D37'], [5.0, 20.0])
+        self.assertEqual(results['D38'], 2000.0)
+
+    def test_huge_power_and_zero_division_give_nan(self):
+        plan = CellPlan('本社', 'P001', '', {
+            'A1': compile_formula('=9^9^9'),
+            'A2': compile_formula('=G3/0'),
+        }, {})
+
+        results = plan.evaluate({'G3': 5})
+
+        self.assertTrue(np.isnan(results['A1']))
+        self.assertTrue(np.isnan(results['A2']))
+
+    def test_incremental_update_recomputes_only_downstream_cells(self):
+        evaluator = IncrementalEvaluator(FormulaRuleSet({('本社', 'P001'): {'': self._plan()}}))
+        evaluator.evaluate(1, '本社', 'P001', {'G3': 4, 'G34': np.array([2.0, 8.0])}, line_ids=[10, 11])
+
+        recomputed = evaluator.update_line(1, 11, {'G34': 4})
+
+        self.assertEqual(set(recomputed), {'D36', 'D37'})
+        np.testing.assert_array_equal(evaluator.results(1)['D37'], [5.0, 10.0])
+        self.assertEqual(evaluator.counts['cells_recomputed'], 2)
+        self.assertEqual(evaluator.update(1, {'G3': 4}), {})
+
+
+class ImportJobStatusTests(TestCase):
+    """取り込みジョブの進捗"""
+
+    def test_job_left_running_by_a_restart_is_reported_as_failed(self):
+        started_at = timezone.now() - timedelta(hours=2)
+        stale = ImportJob.objects.create(kind='upload', status='running', started_at=started_at)
+        waiting = ImportJob.objects.create(kind='upload')
+        ImportJob.objects.filter(pk=waiting.pk).update(created_at=started_at)
+        running = ImportJob.objects.create(kind='upload', status='running', started_at=timezone.now())
+
+        response = self.client.get(reverse('materials:import_job_status', args=[stale.pk]))
+
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(ImportJob.objects.get(pk=waiting.pk).status, 'failed')
+        self.assertEqual(ImportJob.objects.get(pk=running.pk).status, 'running')
+
+
+class EncodingTests(TestCase):
+    """CSVのエンコーディング判定"""
+
+    def test_sniff_encoding(self):
+        self.assertEqual(sniff_encoding('\ufeff原料ID'.encode('utf-8')), 'utf-8-sig')
+        self.assertEqual(sniff_encoding('原料ID'.encode('utf-8')), 'utf-8')
+        self.assertEqual(sniff_encoding('原料ID'.encode('cp932')), 'cp932')
+        # 先頭部分の末尾で切れたマルチバイト文字はエラーにしない
+        self.assertEqual(sniff_encoding('原料ID'.encode('utf-8')[:-1]), 'utf-8')
+
+    def test_formulations_are_read_again_when_the_sniffed_encoding_fails_midway(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        file_path = os.path.join(data_dir, '配合詳細一覧.csv')
+        rows = [f'A,P{i:03},01,M001,1.5' for i in range(1000)] + ['本社,P999,01,M002,2']
+        with open(file_path, 'w', encoding='cp932', newline='') as f:
+            f.write('\r\n'.join(['工場,製品ID,パターン,原料CD,配合量(kg)', *rows]) + '\r\n')
+        loader = FormulationCSVLoader(batch_size=100)
+
+        # 先頭部分から UTF-8 と判定されたが、実際は cp932 のファイル
+        with mock.patch.object(loader, 'detect_encoding', return_value='utf-8'):
+            result = loader.load_formulations(file_path)
+
+        self.assertTrue(result['success'], result.get('error'))
+        self.assertEqual(result['encoding_used'], 'cp932')
+        self.assertEqual(result['created'], len(rows))
+        self.assertEqual(FormulationLine.objects.count(), len(rows))
+        self.assertTrue(Formulation.objects.filter(factory='本社', product_id='P999').exists())
+
+
+class PageVersionTests(TestCase):
+    """画面の ETag（データの版）"""
+
+    def setUp(self):
+        Material.objects.create(material_id='M000', material_name='原料0', unit_price='100')
+
+    def test_etag_follows_database_writes_not_the_process_cache(self):
+        url = reverse('materials:material_list')
+        etag = self.client.get(url)['ETag']
+
+        # 別のワーカー（キャッシュを共有しないプロセス）から見ても同じ版
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Material.objects.create(material_id='M001', material_name='原料1', unit_price='200')
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '原料1')
+
+
+class MaterialSearchTests(TestCase):
+    """原料のキーワード検索"""
+
+    def setUp(self):
+        Material.objects.create(material_id='M001', material_name='ポリビニルアルコール', manufacturer='ABC化学')
+        Material.objects.create(material_id='M002', material_name='精製水', product_kana='せいせいすい')
+        Material.objects.create(material_id='M003', material_name='ポリソルベート80')
+
+    def _search(self, query):
+        return sorted(search_materials(Material.objects.all(), query).values_list('material_id', flat=True))
+
+    def test_width_and_kana_differences_are_ignored(self):
+        self.assertEqual(self._search('ぽりびにる'), ['M001'])
+        self.assertEqual(self._search('ﾎﾟﾘﾋﾞﾆﾙ'), ['M001'])
+        self.assertEqual(self._search('ａｂｃ'), ['M001'])
+        self.assertEqual(self._search('セイセイ'), ['M002'])
+
+    def test_short_terms_and_multiple_terms(self):
+        self.assertEqual(self._search('ポリ'), ['M001', 'M003'])
+        self.assertEqual(self._search('ポリ 80'), ['M003'])
+        self.assertEqual(self._search('"ポリ'), [])
+
+    def test_index_follows_updates(self):
+        self.assertTrue(fts_available())
+        material = Material.objects.get(material_id='M003')
+        material.material_name = 'ステアリン酸'
+        material.save()
+
+        self.assertEqual(self._search('ポリソル'), [])
+        self.assertEqual(self._search('ステアリン'), ['M003'])
+
+
+class UploadPreviewTests(TestCase):
+    """アップロードCSVの差分プレビュー"""
+
+    def setUp(self):
+        Material.objects.create(material_id='M001', material_name='原料1', unit_price='1000')
+        Material.objects.create(material_id='M002', material_name='原料2', unit_price='2000')
+
+    def test_counts_new_changed_unchanged_and_skipped_rows(self):
+        content = '原料ID,原料名,単価\r\nM001,原料1,"1,000"\r\nM002,原料2,2500\r\nM003,原料3,300\r\n,空,0\r\nM003,重複,0\r\n'
+        df, encoding = parse_upload(SimpleUploadedFile('upload.csv', content.encode('cp932')))
+
+        preview = preview_upload_changes(df, find_id_column(df.columns))
 
-# Create your tests here.
+        self.assertEqual(encoding, 'cp932')
+        self.assertEqual(preview['existing_count'], 2)
+        self.assertEqual(preview['new_count'], 1)
+        # "1,000" は正規化すると DB の "1000" と同じ
+        self.assertEqual(preview['unchanged_count'], 1)
+        self.assertEqual(preview['changed_count'], 1)
+        self.assertEqual(preview['skipped_count'], 2)
+        self.assertEqual(preview['field_changes'], [['単価', 1]])
+        self.assertEqual(preview['new_ids'], ['M003'])
@@ -0,0 +1,97 @@
+# materials/tracing.py - 取り込み・リクエスト単位の計測ログ
+"""
+1回の取り込み（またはリクエスト）の区間ごとの所要時間と件数を集計し、最後に1行だけログに出す。
+
+    with Trace('import.materials', logger, mode='update') as trace:
+        with trace.span('parse'):
+            df = ...
+        trace.count('created', 10)
+        trace.detail('行 %s: %s', 3, '...')   # DEBUG のときだけ出力
+
+出力例（logfmt 形式。extra={'trace': {...}} でも同じ内容を渡す）:
+    import.materials status=ok total_ms=231.4 decode_ms=0.3 parse_ms=120.5 ... created=10 mode=update
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """区間の所要時間（ミリ秒）・件数・属性をまとめて1回だけログ出力する"""
+
+    def __init__(self, name, log=None, level=logging.INFO, **fields):
+        self.name = name
+        self.log = log or logger
+        self.level = level
+        self.fields = dict(fields)
+        self.spans = {}
+        self.counters = Counter()
+        self.status = 'ok'
+        self._started = time.perf_counter()
+        self._emitted = False
+
+    @contextmanager
+    def span(self, name):
+        """区間の所要時間を加算する（同じ名前の区間は合計）"""
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + (time.perf_counter() - started)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    @property
+    def detail_enabled(self):
+        return self.log.isEnabledFor(logging.DEBUG)
+
+    def detail(self, message, *args):
+        """行単位の詳細（DEBUG のときだけ出力し、それ以外は文字列も作らない）"""
+        if self.detail_enabled:
+            self.log.debug(f'{self.name} ' + message, *args)
+
+    def as_dict(self):
+        data = {
+            'status': self.status,
+            'total_ms': round((time.perf_counter() - self._started) * 1000, 1),
+        }
+        data.update({f'{name}_ms': round(seconds * 1000, 1) for name, seconds in self.spans.items()})
+        data.update(self.counters)
+        data.update(self.fields)
+        return data
+
+    def emit(self, level=None):
+        if self._emitted:
+            return
+        self._emitted = True
+        data = self.as_dict()
+        level = self.level if level is None else level
+        if self.log.isEnabledFor(level):
+            message = ' '.join(f'{key}={_format_value(value)}' for key, value in data.items())
+            self.log.log(level, f'{self.name} {message}', extra={'trace': data})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.status = 'error'
+            self.fields.setdefault('error', f'{exc_type.__name__}: {exc}')
+            self.emit(logging.ERROR)
+        else:
+            self.emit()
+        return False
+
+
+def _format_value(value):
+    text = str(value)
+    if not text or any(char in text for char in ' ="'):
+        return '"' + text.replace('"', '\\"') + '"'
+    return text
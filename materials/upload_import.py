@@ -0,0 +1,313 @@
+# materials/upload_import.py - 原料CSVアップロードの列マッピング・差分プレビュー・取り込み
+import io
+import json
+import logging
+import zlib
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .column_mapping import convert_column, get_column_plan
+from .costing import ID_CHUNK_SIZE, mark_costs_stale
+from .encoding import decode_bytes
+from .import_jobs import ImportProgress
+from .models import Material, UploadStaging
+from .search import refresh_search_text
+from .stats import invalidate_material_stats
+from .tracing import Trace
+
+logger = logging.getLogger(__name__)
+
+# プレビュー後、インポートされずに残った一時データを削除するまでの期間
+STAGING_MAX_AGE = timedelta(days=1)
+
+def find_id_column(columns):
+    """原料ID列を探す（見つからなければ None）"""
+    for col in columns:
+        if '原料ID' in col or 'ID' in col.upper():
+            return col
+    return None
+
+
+def parse_upload(uploaded_file, trace=None):
+    """
+    アップロードされたCSVを一時ファイルを使わずに1回だけデコードして読み込む
+
+    Args:
+        trace (Trace): decode / parse の所要時間の記録先
+
+    Returns:
+        (DataFrame, エンコーディング): 値はすべて文字列（空欄は ''）
+    """
+    trace = trace or Trace('upload.parse', logger)
+    with trace.span('decode'):
+        data = b''.join(uploaded_file.chunks())
+        text, encoding = decode_bytes(data)
+        del data
+    with trace.span('parse'):
+        df = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False)
+    return df, encoding
+
+
+def stage_upload(df, filename, encoding, id_column):
+    """
+    読み込んだCSVをサーバー側に保存し、インポート実行時に再利用できるようにする
+
+    Returns:
+        UploadStaging: token をプレビューのセッション・フォームに渡す
+    """
+    UploadStaging.objects.filter(created_at__lt=timezone.now() - STAGING_MAX_AGE).delete()
+    payload = json.dumps(
+        {'columns': list(df.columns), 'data': df.to_numpy(dtype=object).tolist()},
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+    return UploadStaging.objects.create(
+        filename=filename,
+        encoding=encoding,
+        id_column=id_column,
+        row_count=len(df),
+        data=zlib.compress(payload.encode('utf-8')),
+    )
+
+
+def load_staged_upload(token):
+    """
+    保存済みのアップロードを DataFrame に戻す（見つからなければ (None, None)）
+    """
+    try:
+        staging = UploadStaging.objects.get(token=token)
+    except (UploadStaging.DoesNotExist, ValidationError, ValueError):
+        return None, None
+    payload = json.loads(zlib.decompress(bytes(staging.data)))
+    df = pd.DataFrame(payload['data'], columns=payload['columns'], dtype=str)
+    return staging, df
+
+
+def upload_ids(df, id_column):
+    """原料ID列を文字列に揃える（欠損は ''）"""
+    ids = df[id_column]
+    # 空欄があると数値のIDが float として読まれるため、整数値なら '12.0' → '12' に戻す
+    if pd.api.types.is_float_dtype(ids.dtype) and (ids.dropna() % 1 == 0).all():
+        ids = ids.astype('Int64')
+    return ids.astype('string').fillna('').str.strip()
+
+
+def dedupe_upload_rows(df, id_column):
+    """原料IDが空の行を除き、同じ原料IDは最後の行だけを残す（index=原料ID）"""
+    ids = upload_ids(df, id_column)
+    rows = df.set_axis(pd.Index(ids, name=None))[ids.to_numpy() != '']
+    return rows[~rows.index.duplicated(keep='last')]
+
+
+def _fetch_current_values(ids, fields):
+    """
+    原料ID → DB上のフィールド値のタプル
+
+    まず原料IDの集合を1クエリで取得し、既存の原料が表の半分以上なら全件を1回で、
+    それ以外は既存分だけを ID_CHUNK_SIZE 件ずつの IN 句で取得する。
+    """
+    all_ids = set(Material.objects.values_list('material_id', flat=True))
+    existing_ids = [material_id for material_id in ids if material_id in all_ids]
+
+    if len(existing_ids) * 2 >= len(all_ids):
+        wanted = set(existing_ids)
+        return {
+            row[0]: row[1:]
+            for row in Material.objects.values_list('material_id', *fields).iterator(chunk_size=5000)
+            if row[0] in wanted
+        }
+
+    current = {}
+    for start in range(0, len(existing_ids), ID_CHUNK_SIZE):
+        for row in Material.objects.filter(
+            material_id__in=existing_ids[start:start + ID_CHUNK_SIZE]
+        ).values_list('material_id', *fields):
+            current[row[0]] = row[1:]
+    return current
+
+
+def preview_upload_changes(df, id_column, sample_size=10, trace=None):
+    """
+    アップロードCSVとDBの差分を集計する
+
+    既存の原料を数クエリでまとめて取得し、既存行ごとに実際に値が変わるフィールドを数える。
+    未加工の値がDBと一致するセルは正規化を省き、一致しないセルだけを正規化して比較する。
+
+    Args:
+        trace (Trace): 既存値の取得（fetch）と比較（diff）の所要時間の記録先
+
+    Returns:
+        dict: existing_count / new_count / unchanged_count / field_changes など
+    """
+    trace = trace or Trace('upload.preview', logger)
+    rows = dedupe_upload_rows(df, id_column)
+    plan = get_column_plan(df.columns)
+    columns = [(column, field) for field, column in plan.mapping.items() if field != 'material_id']
+    fields = [field for _, field in columns]
+
+    with trace.span('fetch'):
+        current = _fetch_current_values(rows.index.tolist(), fields)
+    is_existing = rows.index.isin(list(current))
+    existing = rows[is_existing]
+
+    field_changes = []
+    row_changed = np.zeros(len(existing), dtype=bool)
+    with trace.span('diff'):
+        if columns and len(existing):
+            records = [current[material_id] for material_id in existing.index.tolist()]
+            labels = {field: Material._meta.get_field(field).verbose_name for field in fields}
+
+            for (column, field), db_column in zip(columns, zip(*records)):
+                db_values = np.array(db_column, dtype=object)
+                db_values[db_values == None] = ''  # noqa: E711
+                raw = existing[column]
+                if pd.api.types.is_string_dtype(raw.dtype):
+                    candidates = raw.to_numpy(dtype=object, na_value='') != db_values
+                else:
+                    candidates = np.ones(len(raw), dtype=bool)
+                if not candidates.any():
+                    continue
+                normalized = convert_column(raw[candidates], field)
+                changed = np.flatnonzero(candidates)[normalized != db_values[candidates]]
+                if len(changed):
+                    field_changes.append([labels[field], len(changed)])
+                    row_changed[changed] = True
+            field_changes.sort(key=lambda item: -item[1])
+
+    changed_count = int(row_changed.sum())
+    new_ids = rows.index[~is_existing]
+    return {
+        'existing_count': len(existing),
+        'new_count': len(new_ids),
+        'unchanged_count': len(existing) - changed_count,
+        'changed_count': changed_count,
+        # 原料IDが空の行と、ファイル内で重複した原料IDの2行目以降
+        'skipped_count': len(df) - len(rows),
+        'field_changes': field_changes,
+        'existing_ids': existing.index[:sample_size].tolist(),
+        'new_ids': new_ids[:sample_size].tolist(),
+    }
+
+
+def _write_batch(objs, existing_ids, overwrite_mode, fields):
+    """
+    1バッチ分の Material を書き込み、((作成数, 更新数, スキップ数), 書き込んだ原料IDのリスト) を返す
+
+    呼び出し側で transaction.atomic() の中から呼ぶ。
+    """
+    new_objs = [obj for obj in objs if obj.material_id not in existing_ids]
+    old_objs = [obj for obj in objs if obj.material_id in existing_ids]
+
+    if overwrite_mode == 'skip':
+        Material.objects.bulk_create(new_objs)
+        return (len(new_objs), 0, len(old_objs)), [obj.material_id for obj in new_objs]
+
+    if overwrite_mode == 'replace':
+        Material.objects.filter(material_id__in=[obj.material_id for obj in old_objs]).delete()
+        Material.objects.bulk_create(objs)
+        return (len(objs), 0, 0), [obj.material_id for obj in objs]
+
+    # INSERT ... ON CONFLICT(material_id) DO UPDATE で作成・更新をまとめて行う
+    Material.objects.bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=['material_id'],
+        update_fields=fields + ['is_active', 'updated_at'],
+    )
+    return (len(new_objs), len(old_objs), 0), [obj.material_id for obj in objs]
+
+
+def import_upload_frame(df, id_column, overwrite_mode='update', batch_size=500, progress=None):
+    """
+    アップロードCSVを batch_size 行ずつ取り込む（バッチごとにコミット）
+
+    バッチの書き込みが失敗した場合はそのバッチだけ1行ずつ書き直し、
+    失敗した行を progress.error() に記録する。
+    区間ごとの所要時間と件数は import.upload として1回だけログに出す。
+
+    Returns:
+        dict: MaterialCSVLoader と同じ形式の結果
+    """
+    progress = progress or ImportProgress()
+    progress.start(len(df))
+    with Trace('import.upload', logger, mode=overwrite_mode) as trace:
+        result = _import_upload_frame(df, id_column, overwrite_mode, batch_size, progress, trace)
+        trace.counters.update(
+            rows=len(df), created=result['created'], updated=result['updated'], skipped=result['skipped'],
+        )
+    return result
+
+
+def _import_upload_frame(df, id_column, overwrite_mode, batch_size, progress, trace):
+
+    ids = upload_ids(df, id_column)
+    # 原料ID → CSV上の行番号（ヘッダーを1行目とし、重複時は最後の行）
+    line_numbers = dict(zip(ids.tolist(), range(2, len(ids) + 2)))
+    rows = dedupe_upload_rows(df, id_column)
+    plan = get_column_plan(df.columns)
+    fields = plan.value_fields()
+
+    created = updated = 0
+    skipped = len(df) - len(rows)
+    written_ids = []
+
+    for start in range(0, len(rows), batch_size):
+        with trace.span('clean'):
+            batch = plan.convert(rows.iloc[start:start + batch_size], exclude=('material_id',), derived=True)
+            objs = [
+                Material(material_id=material_id, is_active=True, **values)
+                for material_id, values in zip(batch.index.tolist(), batch.to_dict('records'))
+            ]
+        with trace.span('diff'):
+            existing_ids = set(
+                Material.objects.filter(material_id__in=batch.index.tolist()).values_list('material_id', flat=True)
+            )
+
+        with trace.span('write'):
+            try:
+                with transaction.atomic():
+                    counts, written = _write_batch(objs, existing_ids, overwrite_mode, fields)
+            except Exception:
+                trace.count('batch_fallbacks')
+                counts = [0, 0, 0]
+                written = []
+                for obj in objs:
+                    try:
+                        with transaction.atomic():
+                            row_counts, row_written = _write_batch([obj], existing_ids, overwrite_mode, fields)
+                        counts = [total + n for total, n in zip(counts, row_counts)]
+                        written += row_written
+                    except Exception as e:
+                        trace.count('row_errors')
+                        trace.detail('行処理エラー (原料ID: %s): %s', obj.material_id, e)
+                        progress.error(line_numbers.get(obj.material_id), obj.material_id, str(e))
+                        counts[2] += 1
+
+        created += counts[0]
+        updated += counts[1]
+        skipped += counts[2]
+        # スキップした行（既存の原料）は書き込んでいないので原料費・検索用テキストの更新対象にしない
+        written_ids.extend(written)
+        progress.update(skipped + created + updated, created=created, updated=updated, skipped=skipped)
+
+    # 書き込んだ行は is_active=True で保存済み（差分取り込みで無効化した原料は有効に戻さない）
+    mark_costs_stale(material_ids=written_ids)
+    if not plan.has_search_sources:
+        # 検索対象の列が足りないファイルは、書き込んだ行の検索用テキストをDBの値から作り直す
+        with trace.span('write'):
+            refresh_search_text(written_ids)
+    invalidate_material_stats()
+
+    return {
+        'success': True,
+        'created': created,
+        'updated': updated,
+        'skipped': skipped,
+        'total_rows': len(df),
+        'overwrite_mode': overwrite_mode,
+    }
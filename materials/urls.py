@@ -15,11 +15,22 @@ app_name = 'materials'
 
 urlpatterns = [
     path('', views.material_list, name='material_list'),
+    path('api/materials/', views.material_list_api, name='material_list_api'),
+    path('export/', views.material_export, name='material_export'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('formulation-costs/', views.formulation_costs, name='formulation_costs'),
+    path('formulation-costs/export/', views.formulation_costs_export, name='formulation_costs_export'),
+    path('formulation-costs/export-lines/', views.formulation_lines_export, name='formulation_lines_export'),
     path('load-csv/', views.load_csv_data, name='load_csv_data'),
+    path('load-csv-options/', views.load_csv_with_options, name='load_csv_with_options'),
+    path('load-formulation-csv/', views.load_formulation_data, name='load_formulation_data'),
+    path('load-product-csv/', views.load_product_data, name='load_product_data'),
+    path('load-purified-water-csv/', views.load_purified_water_data, name='load_purified_water_data'),
     # ↓ これらの行を追加
     path('upload-csv/', views.upload_csv_import, name='upload_csv_import'),
     path('clear-csv-session/', views.clear_csv_session, name='clear_csv_session'),
+    path('import-jobs/<int:pk>/', views.import_job_detail, name='import_job_detail'),
+    path('import-jobs/<int:pk>/status/', views.import_job_status, name='import_job_status'),
     # ↑ ここまで追加
     path('analyze-csv/', views.analyze_csv_structure, name='analyze_csv_structure'),
     path('detail/<int:pk>/', views.material_detail, name='material_detail'),
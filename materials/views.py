@@ -1,12 +1,34 @@
 # -*- coding: utf-8 -*-
 from django.shortcuts import render, get_object_or_404, redirect
 from django.core.paginator import Paginator
-from django.db.models import Q, Avg
+from django.db.models import Q
 from django.contrib import messages
 from django.http import JsonResponse
-from .models import Material
+from django.utils import timezone
+from django.views.decorators.http import condition
+from .models import Material, FormulationCost, FormulationLine, ImportJob, parse_price
+from .caching import cache_get, cache_set
+from .costing import mark_costs_stale, summarize_by_factory
+from .data_version import LIST_PAGE_CACHE_TIMEOUT, page_etag, revalidate, versioned_key
 from .csv_loader import MaterialCSVLoader
+from .formulation_loader import FormulationCSVLoader
+from .product_loader import ProductCSVLoader
+from .purified_water import PurifiedWaterCSVLoader
+from .upload_import import (
+    find_id_column, import_upload_frame, load_staged_upload, parse_upload, preview_upload_changes, stage_upload,
+)
+from .import_jobs import fail_stale_jobs, start_import_job
+from .export import (
+    FORMULATION_COST_EXPORT_COLUMNS, FORMULATION_LINE_EXPORT_COLUMNS, MATERIAL_EXPORT_COLUMNS, resolve_encoding,
+    streaming_csv_response,
+)
+from .keyset import DEFAULT_SORT_KEY, SORT_FIELDS, keyset_page, sort_queryset
+from .projections import LIST_API_FIELDS, list_rows
+from .search import search_materials
+from .stats import get_material_stats, invalidate_material_stats
+from .tracing import Trace
 from decimal import Decimal, InvalidOperation
+from urllib.parse import urlencode
 import logging
 from django.conf import settings
 
@@ -71,158 +93,158 @@ def top(request):
     return render(request, 'top.html')
 
 
-def material_list(request):
-    """原料一覧ページ（型エラー修正版）"""
+PER_PAGE_CHOICES = [25, 50, 100, 200]
 
-    # 🔧 デバッグ情報の収集
-    total_in_db = Material.objects.count()
-    active_in_db = Material.objects.filter(is_active=True).count()
-    inactive_in_db = Material.objects.filter(is_active=False).count()
 
-    # 🔧 修正: 安全な単価フィルタリング
+def _positive_int(value, default):
     try:
-        # データベースレベルでの単価チェック（型安全）
-        with_price = 0
-        for material in Material.objects.all():
-            if safe_price_comparison(material.unit_price, 0):
-                with_price += 1
-    except Exception as e:
-        logger.error(f"単価統計計算エラー: {e}")
-        with_price = 0
+        number = int(value)
+    except (TypeError, ValueError):
+        return default
+    return number if number > 0 else default
 
-    logger.info(f"📊 データベース状況:")
-    logger.info(f"   総件数: {total_in_db}")
-    logger.info(f"   有効: {active_in_db}")
-    logger.info(f"   無効: {inactive_in_db}")
-    logger.info(f"   単価あり: {with_price}")
-
-    # データが全て無効になっている問題の対応
-    if active_in_db == 0 and total_in_db > 0:
-        logger.warning("🚨 全データがis_active=Falseになっている！")
-        Material.objects.all().update(is_active=True)
-        active_in_db = total_in_db
-        logger.info("✅ 全データを有効化しました")
 
-    # 表示データの取得
-    show_all = request.GET.get('show_all', '0') == '1'
-    if show_all:
-        materials = Material.objects.all()
-        logger.info("📄 全データを表示")
-    else:
-        materials = Material.objects.filter(is_active=True)
-        logger.info(f"📄 有効データのみ表示: {materials.count()}件")
+def _per_page(request):
+    per_page = _positive_int(request.GET.get('per_page'), 50)
+    return per_page if per_page in PER_PAGE_CHOICES else 50
 
-    # 検索処理
-    search_query = request.GET.get('search', '').strip()
-    if search_query:
-        materials = materials.filter(
-            Q(material_id__icontains=search_query) |
-            Q(material_name__icontains=search_query) |
-            Q(manufacturer__icontains=search_query) |
-            Q(supplier__icontains=search_query)
-        )
-        logger.info(f"🔍 検索後: {materials.count()}件")
 
-    # ソート処理
-    sort_key = request.GET.get('sort', 'material_id')
+def _material_filters(request):
+    """一覧画面・一覧APIで共通の絞り込み・並び順の条件"""
+    sort_key = request.GET.get('sort', DEFAULT_SORT_KEY)
+    if sort_key not in SORT_FIELDS:
+        sort_key = DEFAULT_SORT_KEY
     sort_order = request.GET.get('order', 'asc')
+    if sort_order not in ('asc', 'desc'):
+        sort_order = 'asc'
+    return {
+        'show_all': request.GET.get('show_all', '0') == '1',
+        'search': request.GET.get('search', '').strip(),
+        'price_min': parse_price(request.GET.get('price_min', '').strip()),
+        'price_max': parse_price(request.GET.get('price_max', '').strip()),
+        'sort': sort_key,
+        'order': sort_order,
+    }
 
-    valid_sort_keys = ['material_id', 'material_name', 'unit_price', 'manufacturer', 'supplier']
-    if sort_key not in valid_sort_keys:
-        sort_key = 'material_id'
 
-    # 🔧 修正: 単価ソートの場合は特別処理
-    if sort_key == 'unit_price':
-        # 単価を安全にソートするため、Pythonレベルでソート
-        materials_list = list(materials)
-        try:
-            def sort_by_price(material):
-                try:
-                    if safe_price_comparison(material.unit_price, -1):  # 値があるかチェック
-                        if isinstance(material.unit_price, str):
-                            cleaned = material.unit_price.replace(',', '').replace('¥', '').strip()
-                            return Decimal(cleaned) if cleaned else Decimal('0')
-                        elif isinstance(material.unit_price, Decimal):
-                            return material.unit_price
-                        else:
-                            return Decimal(str(material.unit_price))
-                    else:
-                        return Decimal('0')
-                except:
-                    return Decimal('0')
-
-            materials_list.sort(key=sort_by_price, reverse=(sort_order == 'desc'))
-            # ソート済みリストからQuerySetを再構築
-            sorted_ids = [m.id for m in materials_list]
-            materials = Material.objects.filter(id__in=sorted_ids)
-            # IDの順序を保持
-            materials = sorted(materials, key=lambda x: sorted_ids.index(x.id))
-        except Exception as e:
-            logger.error(f"単価ソートエラー: {e}")
-            # フォールバック: IDでソート
-            materials = materials.order_by('material_id')
-    else:
-        # 通常のソート
-        order_prefix = '' if sort_order == 'asc' else '-'
-        materials = materials.order_by(f'{order_prefix}{sort_key}')
-
-    # ページネーション
-    per_page = int(request.GET.get('per_page', 50))
-    if per_page not in [25, 50, 100, 200]:
-        per_page = 50
-
-    # 🔧 修正: ソート済みリストの場合はそのまま使用
-    if isinstance(materials, list):
-        paginator = Paginator(materials, per_page)
-    else:
-        paginator = Paginator(materials, per_page)
+def _filter_materials(filters, queryset=None):
+    """条件で原料を絞り込む（並び順は keyset_page で付ける）"""
+    materials = Material.objects.all() if queryset is None else queryset
+    if not filters['show_all']:
+        materials = materials.filter(is_active=True)
 
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    # 原料ID・原料名・商品名（カナ）・製造所・販売者を正規化したテキストで部分一致
+    if filters['search']:
+        materials = search_materials(materials, filters['search'])
 
-    # 🔧 修正: データサンプルの安全な確認
-    if page_obj.object_list:
-        try:
-            first_item = page_obj.object_list[0]
-            logger.info(f"📋 1件目のデータ例:")
-            logger.info(f"   ID: {first_item.material_id}")
-            logger.info(f"   名前: {first_item.material_name}")
-            logger.info(f"   有効: {first_item.is_active}")
-            logger.info(f"   単価: {first_item.unit_price} (型: {type(first_item.unit_price)})")
-
-            # 🔧 修正: 安全な単価統計計算
-            current_page_materials = list(page_obj.object_list)
-            price_stats = {
-                'null_count': sum(1 for m in current_page_materials if m.unit_price is None),
-                'zero_count': sum(1 for m in current_page_materials if safe_price_equals(m.unit_price, 0)),
-                'positive_count': sum(1 for m in current_page_materials if safe_price_comparison(m.unit_price, 0)),
-            }
-            logger.info(f"   現在ページの単価統計: {price_stats}")
+    # 単価範囲フィルター
+    if filters['price_min'] is not None:
+        materials = materials.filter(unit_price_value__gte=filters['price_min'])
+    if filters['price_max'] is not None:
+        materials = materials.filter(unit_price_value__lte=filters['price_max'])
+    return materials
 
-        except Exception as e:
-            logger.error(f"データサンプル確認エラー: {e}")
 
-    # 連番計算
-    start_index = (page_obj.number - 1) * per_page + 1
-    serial_numbers = (start_index, start_index + len(page_obj.object_list) - 1)
+@condition(etag_func=page_etag)
+def material_list(request):
+    """原料一覧ページ（型エラー修正版）"""
+    # リクエストごとの所要時間・件数は最後に1行だけ DEBUG で出力する
+    trace = Trace('view.material_list', logger, level=logging.DEBUG)
 
-    # 🔧 修正: 総件数の安全な計算
-    try:
-        if isinstance(materials, list):
-            total_count = len(materials)
-        else:
-            total_count = materials.count()
-    except:
-        total_count = 0
+    with trace.span('stats'):
+        stats = get_material_stats()
+    total_in_db = stats['total']
+    active_in_db = stats['active']
+    inactive_in_db = stats['inactive']
+    with_price = stats['with_price']
+
+    # データが全て無効になっている問題の対応
+    if active_in_db == 0 and total_in_db > 0:
+        logger.warning("全データが is_active=False のため全件を有効化します")
+        Material.objects.all().update(is_active=True, updated_at=timezone.now())
+        invalidate_material_stats()
+        active_in_db = total_in_db
+        inactive_in_db = 0
+
+    filters = _material_filters(request)
+    # 一覧に表示する列だけを名前付きタプルで読み込む（Material インスタンスは作らない）
+    materials = _filter_materials(filters, list_rows(Material.objects.all()))
+    sort_key, sort_order = filters['sort'], filters['order']
+
+    filtered = filters['search'] or filters['price_min'] is not None or filters['price_max'] is not None
+
+    # ページ送り（OFFSET ではなく前後ページの境界の行を基準にする）
+    per_page = _per_page(request)
+    cursor, before, last = request.GET.get('cursor'), request.GET.get('before'), request.GET.get('last') == '1'
+    # 取得結果は条件とデータの版ごとにキャッシュする（データが更新されれば版が変わる）
+    cache_parts = versioned_key(sorted(filters.items()), per_page, cursor, before, last)
+    cached = cache_get('list', *cache_parts)
+    trace.count('page_cache_hit' if cached else 'page_cache_miss')
+    if cached:
+        page_obj, matched_count = cached
+    else:
+        with trace.span('query'):
+            page_obj = keyset_page(
+                materials, sort_key, descending=sort_order == 'desc', per_page=per_page,
+                after=cursor, before=before, last=last,
+            )
+        # 絞り込みがなければ件数は統計（キャッシュ）から取り、COUNT を発行しない
+        matched_count = None
+        if filtered:
+            with trace.span('count'):
+                matched_count = materials.count()
+        cache_set('list', *cache_parts, value=(page_obj, matched_count), timeout=LIST_PAGE_CACHE_TIMEOUT)
+    page_materials = page_obj.object_list
+
+    # 現在ページの単価の内訳（DEBUG のときだけ集計する）
+    if trace.detail_enabled:
+        trace.counters.update(
+            page_null_price=sum(1 for m in page_materials if m.unit_price is None),
+            page_zero_price=sum(1 for m in page_materials if safe_price_equals(m.unit_price, 0)),
+            page_positive_price=sum(1 for m in page_materials if safe_price_comparison(m.unit_price, 0)),
+        )
+
+    if matched_count is not None:
+        total_count = matched_count
+    else:
+        total_count = total_in_db if filters['show_all'] else active_in_db
+
+    # 連番計算（表示用の開始番号はページ送りのリンクで引き継ぐ）
+    if last:
+        start_index = max(total_count - len(page_materials), 0) + 1
+    else:
+        start_index = _positive_int(request.GET.get('start'), 1)
+    serial_numbers = (start_index, start_index + len(page_materials) - 1)
+
+    # ページ送りのリンク用（カーソル以外の条件）
+    base_query = urlencode({
+        key: value for key, value in (
+            ('search', filters['search']),
+            ('show_all', '1' if filters['show_all'] else ''),
+            ('per_page', per_page),
+            ('sort', sort_key),
+            ('order', sort_order),
+            ('price_min', request.GET.get('price_min', '').strip()),
+            ('price_max', request.GET.get('price_max', '').strip()),
+        ) if value != ''
+    })
+
+    trace.counters.update(total=total_in_db, active=active_in_db, matched=total_count, page_rows=len(page_materials))
+    trace.set(search=filters['search'], sort=sort_key, order=sort_order, start=start_index)
 
     context = {
         'page_obj': page_obj,
-        'search_query': search_query,
-        'show_all': show_all,
+        'base_query': base_query,
+        'prev_start': max(start_index - per_page, 1),
+        'next_start': start_index + len(page_materials),
+        'search_query': filters['search'],
+        'show_all': filters['show_all'],
         'per_page': per_page,
-        'per_page_choices': [25, 50, 100, 200],
+        'per_page_choices': PER_PAGE_CHOICES,
         'sort_key': sort_key,
         'sort_order': sort_order,
+        'price_min': request.GET.get('price_min', '').strip(),
+        'price_max': request.GET.get('price_max', '').strip(),
         'total_in_db': total_in_db,
         'active_in_db': active_in_db,
         'inactive_in_db': inactive_in_db,
@@ -232,9 +254,45 @@ def material_list(request):
         'debug': settings.DEBUG,
     }
 
-    return render(request, 'materials/material_list.html', context)
+    with trace.span('render'):
+        response = render(request, 'materials/material_list.html', context)
+    trace.emit()
+    return revalidate(response)
 
 
+def material_list_api(request):
+    """
+    原料一覧のJSON API（無限スクロール用）
+
+    一覧画面と同じ条件（search / show_all / price_min / price_max / sort / order / per_page）で、
+    LIST_API_FIELDS の列だけを values() で返す。次ページは next_cursor を cursor に渡して取得する。
+    """
+    filters = _material_filters(request)
+    materials = _filter_materials(filters, Material.objects.values(*LIST_API_FIELDS))
+    page = keyset_page(
+        materials, filters['sort'], descending=filters['order'] == 'desc', per_page=_per_page(request),
+        after=request.GET.get('cursor'), before=request.GET.get('before'),
+    )
+    return JsonResponse({
+        'success': True,
+        'results': page.object_list,
+        'has_next': page.has_next,
+        'has_previous': page.has_previous,
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
+
+
+def material_export(request):
+    """一覧画面の検索・絞り込み条件のままCSV出力（ストリーミング）"""
+    filters = _material_filters(request)
+    materials = sort_queryset(_filter_materials(filters), filters['sort'], descending=filters['order'] == 'desc')
+    return streaming_csv_response(
+        materials, MATERIAL_EXPORT_COLUMNS, '原料一覧.csv', resolve_encoding(request.GET.get('encoding'))
+    )
+
+
+@condition(etag_func=page_etag)
 def material_detail(request, pk):
     """原料詳細ページ（修正版）"""
     material = get_object_or_404(Material, pk=pk)
@@ -242,7 +300,7 @@ def material_detail(request, pk):
     # 🔧 フィールド情報を動的に取得
     field_data = []
     for field in material._meta.fields:
-        if field.name not in ['id']:
+        if field.name not in ['id', 'search_text']:
             value = getattr(material, field.name)
             field_data.append({
                 'name': field.name,
@@ -254,51 +312,77 @@ def material_detail(request, pk):
         'material': material,
         'field_data': field_data
     }
-    return render(request, 'materials/material_detail.html', context)
+    return revalidate(render(request, 'materials/material_detail.html', context))
 
 
+@condition(etag_func=page_etag)
 def dashboard(request):
     """ダッシュボードページ（修正版）"""
-    total_materials = Material.objects.count()
-    active_materials = Material.objects.filter(is_active=True).count()
+    stats = get_material_stats()
+
+    context = {
+        'total_materials': stats['total'],
+        'active_materials': stats['active'],
+        'materials_with_price': stats['with_price'],
+        'avg_price': stats['avg_price'],
+        'material_count': stats['total'],
+        'inactive_materials': stats['inactive'],
+        'materials_without_price': stats['without_price'],
+        'category_counts': stats['categories'],
+    }
 
-    # 🔧 修正: 安全な単価統計計算
-    materials_with_price = 0
-    total_price = Decimal('0')
-    price_count = 0
+    return revalidate(render(request, 'materials/dashboard.html', context))
 
-    try:
-        for material in Material.objects.all():
-            if safe_price_comparison(material.unit_price, 0):
-                materials_with_price += 1
-                try:
-                    if isinstance(material.unit_price, str):
-                        cleaned = material.unit_price.replace(',', '').replace('¥', '').strip()
-                        if cleaned:
-                            price_decimal = Decimal(cleaned)
-                            total_price += price_decimal
-                            price_count += 1
-                    elif isinstance(material.unit_price, Decimal):
-                        total_price += material.unit_price
-                        price_count += 1
-                except:
-                    pass
-    except Exception as e:
-        logger.error(f"ダッシュボード統計計算エラー: {e}")
 
-    avg_price = total_price / price_count if price_count > 0 else 0
+def formulation_costs(request):
+    """配合別原料費一覧"""
+    factory = request.GET.get('factory', '').strip()
+    search_query = request.GET.get('search', '').strip()
+    costs = _filter_by_formulation(FormulationCost.objects.select_related('formulation'), factory, search_query)
+    paginator = Paginator(costs, 50)
+    page_obj = paginator.get_page(request.GET.get('page', 1))
 
     context = {
-        'total_materials': total_materials,
-        'active_materials': active_materials,
-        'materials_with_price': materials_with_price,
-        'avg_price': avg_price,
-        'material_count': total_materials,
-        'inactive_materials': total_materials - active_materials,
-        'materials_without_price': active_materials - materials_with_price,
+        'page_obj': page_obj,
+        'factory': factory,
+        'search_query': search_query,
+        'export_query': urlencode({'factory': factory, 'search': search_query, 'encoding': 'cp932'}),
+        'factory_summary': summarize_by_factory(),
     }
+    return render(request, 'materials/formulation_costs.html', context)
+
+
+def _filter_by_formulation(queryset, factory, search_query):
+    """配合（工場・製品ID・製品名）で絞り込み、工場・製品ID・パターン順に並べる"""
+    if factory:
+        queryset = queryset.filter(formulation__factory=factory)
+    if search_query:
+        queryset = queryset.filter(
+            Q(formulation__product_id=search_query) |
+            Q(formulation__product_name__icontains=search_query)
+        )
+    return queryset.order_by('formulation__factory', 'formulation__product_id', 'formulation__pattern')
 
-    return render(request, 'materials/dashboard.html', context)
+
+def formulation_costs_export(request):
+    """配合別原料費のCSV出力（表示中の絞り込み条件、ストリーミング）"""
+    costs = _filter_by_formulation(
+        FormulationCost.objects.all(), request.GET.get('factory', '').strip(), request.GET.get('search', '').strip()
+    )
+    return streaming_csv_response(
+        costs, FORMULATION_COST_EXPORT_COLUMNS, '配合別原料費.csv', resolve_encoding(request.GET.get('encoding'))
+    )
+
+
+def formulation_lines_export(request):
+    """配合明細のCSV出力（表示中の絞り込み条件、ストリーミング）"""
+    lines = _filter_by_formulation(
+        FormulationLine.objects.all(), request.GET.get('factory', '').strip(), request.GET.get('search', '').strip()
+    )
+    return streaming_csv_response(
+        lines.order_by('formulation__factory', 'formulation__product_id', 'formulation__pattern', 'id'),
+        FORMULATION_LINE_EXPORT_COLUMNS, '配合明細.csv', resolve_encoding(request.GET.get('encoding')),
+    )
 
 
 def analyze_csv_structure(request):
@@ -320,8 +404,6 @@ def load_csv_data(request):
             result = csv_loader.load_materials()
 
             if result.get('success'):
-                Material.objects.all().update(is_active=True)
-
                 success_msg = f"""
 CSV読み込み完了！
 • 新規作成: {result.get('created', 0)}件
@@ -330,13 +412,12 @@ CSV読み込み完了！
 • 単価ありデータ: {result.get('with_price', 0)}件
 • 使用エンコーディング: {result.get('encoding_used', '不明')}
                 """
+                # 件数・所要時間は MaterialCSVLoader が import.materials として出力済み
                 messages.success(request, success_msg)
-                logger.info(f"CSV読み込み完了: {result}")
 
             else:
                 error_msg = f"読み込みエラー: {result.get('error', '不明')}"
                 messages.error(request, error_msg)
-                logger.error(f"CSV読み込みエラー: {result}")
 
         except Exception as e:
             error_msg = f"システムエラー: {str(e)}"
@@ -346,6 +427,96 @@ CSV読み込み完了！
     return redirect('materials:material_list')
 
 
+def load_formulation_data(request):
+    """配合詳細一覧CSVの読み込み"""
+    if request.method == 'POST':
+        try:
+            result = FormulationCSVLoader().load_formulations()
+
+            if result.get('success'):
+                success_msg = f"""
+配合CSV読み込み完了！
+• 配合: {result.get('formulations', 0)}件
+• 配合明細: {result.get('created', 0)}件
+• スキップ: {result.get('skipped', 0)}件
+• 使用エンコーディング: {result.get('encoding_used', '不明')}
+                """
+                messages.success(request, success_msg)
+                logger.info(f"配合CSV読み込み完了: {result}")
+
+            else:
+                error_msg = f"読み込みエラー: {result.get('error', '不明')}"
+                messages.error(request, error_msg)
+                logger.error(f"配合CSV読み込みエラー: {result}")
+
+        except Exception as e:
+            error_msg = f"システムエラー: {str(e)}"
+            messages.error(request, error_msg)
+            logger.error(f"配合CSV読み込みシステムエラー: {e}")
+
+    return redirect('materials:material_list')
+
+
+def load_product_data(request):
+    """製品ID管理CSVの読み込み"""
+    if request.method == 'POST':
+        try:
+            result = ProductCSVLoader().load_products()
+
+            if result.get('success'):
+                success_msg = f"""
+製品CSV読み込み完了！
+• 新規作成: {result.get('created', 0)}件
+• 更新: {result.get('updated', 0)}件
+• 削除: {result.get('deleted', 0)}件
+• スキップ: {result.get('skipped', 0)}件
+• 使用エンコーディング: {result.get('encoding_used', '不明')}
+                """
+                messages.success(request, success_msg)
+                logger.info(f"製品CSV読み込み完了: {result}")
+
+            else:
+                error_msg = f"読み込みエラー: {result.get('error', '不明')}"
+                messages.error(request, error_msg)
+                logger.error(f"製品CSV読み込みエラー: {result}")
+
+        except Exception as e:
+            error_msg = f"システムエラー: {str(e)}"
+            messages.error(request, error_msg)
+            logger.error(f"製品CSV読み込みシステムエラー: {e}")
+
+    return redirect('materials:material_list')
+
+
+def load_purified_water_data(request):
+    """精製水例外リストCSVの読み込み"""
+    if request.method == 'POST':
+        try:
+            result = PurifiedWaterCSVLoader().load_exceptions()
+
+            if result.get('success'):
+                success_msg = f"""
+精製水例外CSV読み込み完了！
+• 読み込み: {result.get('created', 0)}件
+• スキップ: {result.get('skipped', 0)}件
+• 使用エンコーディング: {result.get('encoding_used', '不明')}
+                """
+                messages.success(request, success_msg)
+                logger.info(f"精製水例外CSV読み込み完了: {result}")
+
+            else:
+                error_msg = f"読み込みエラー: {result.get('error', '不明')}"
+                messages.error(request, error_msg)
+                logger.error(f"精製水例外CSV読み込みエラー: {result}")
+
+        except Exception as e:
+            error_msg = f"システムエラー: {str(e)}"
+            messages.error(request, error_msg)
+            logger.error(f"精製水例外CSV読み込みシステムエラー: {e}")
+
+    return redirect('materials:material_list')
+
+
 def debug_material_data(request):
     """デバッグ用: 原料データの詳細確認"""
     if not settings.DEBUG:
@@ -357,17 +528,9 @@ def debug_material_data(request):
         total_count = materials.count()
         active_count = materials.filter(is_active=True).count()
 
-        with_price_count = 0
-        zero_price_count = 0
-        null_price_count = 0
-
-        for material in materials:
-            if material.unit_price is None:
-                null_price_count += 1
-            elif safe_price_equals(material.unit_price, 0):
-                zero_price_count += 1
-            elif safe_price_comparison(material.unit_price, 0):
-                with_price_count += 1
+        with_price_count = materials.filter(unit_price_value__gt=0).count()
+        zero_price_count = materials.filter(unit_price_value=0).count()
+        null_price_count = materials.filter(unit_price_value__isnull=True).count()
 
         stats = {
             'total_count': total_count,
@@ -378,13 +541,14 @@ def debug_material_data(request):
         }
 
         # サンプルデータ
-        sample_materials = materials[:5]
+        sample_materials = materials.only('material_id', 'material_name', 'unit_price', 'unit_price_value', 'is_active')[:5]
         sample_data = []
         for material in sample_materials:
             sample_data.append({
                 'id': material.material_id,
                 'name': material.material_name,
                 'price': str(material.unit_price),
+                'price_value': str(material.unit_price_value),
                 'price_type': str(type(material.unit_price)),
                 'is_active': material.is_active,
                 'safe_price_check': safe_price_comparison(material.unit_price, 0),
@@ -410,10 +574,11 @@ def fix_price_data(request):
 
     if request.method == 'POST':
         try:
-            fixed_count = 0
-            materials = Material.objects.all()
+            changed = []
+            now = timezone.now()
+            materials = Material.objects.only('id', 'material_id', 'unit_price')
 
-            for material in materials:
+            for material in materials.iterator(chunk_size=2000):
                 original_price = material.unit_price
                 fixed = False
 
@@ -432,11 +597,20 @@ def fix_price_data(request):
                         material.unit_price = None
                         fixed = True
 
-                if fixed:
-                    material.save()
-                    fixed_count += 1
-                    logger.info(f"修正: {material.material_id} {original_price} → {material.unit_price}")
-
+                # unit_price は NULL を許さない文字列の列なので、変換できない値は空にする
+                new_price = '' if material.unit_price is None else str(material.unit_price)
+                if fixed and new_price != original_price:
+                    material.unit_price = new_price
+                    material.sync_numeric_fields(skip=material.get_deferred_fields())
+                    material.updated_at = now
+                    changed.append(material)
+                    logger.debug(f"修正: {material.material_id} {original_price} → {material.unit_price}")
+
+            # 1件ずつ save() せず、変わった行だけをまとめて更新する（原料費の再計算も1回）
+            Material.objects.bulk_update(changed, ['unit_price', 'unit_price_value', 'updated_at'], batch_size=500)
+            mark_costs_stale(material_ids=[material.material_id for material in changed])
+            fixed_count = len(changed)
+            invalidate_material_stats()
             messages.success(request, f"{fixed_count}件の単価データを修正しました")
             logger.info(f"単価データ一括修正完了: {fixed_count}件")
 
@@ -453,26 +627,14 @@ def load_csv_with_options(request):
         try:
             overwrite_mode = request.POST.get('overwrite_mode', 'update')
             csv_loader = MaterialCSVLoader()
-            result = csv_loader.load_materials_with_overwrite(overwrite_mode)
-
-            if result.get('success'):
-                Material.objects.all().update(is_active=True)
-
-                success_msg = f"""
-CSV読み込み完了！
-• 新規作成: {result.get('created', 0)}件
-• 更新: {result.get('updated', 0)}件
-• スキップ: {result.get('skipped', 0)}件
-• 上書きモード: {result.get('overwrite_mode', '不明')}
-• 使用エンコーディング: {result.get('encoding_used', '不明')}
-                """
-                messages.success(request, success_msg)
-                logger.info(f"CSV読み込み完了: {result}")
-
-            else:
-                error_msg = f"読み込みエラー: {result.get('error', '不明')}"
-                messages.error(request, error_msg)
-                logger.error(f"CSV読み込みエラー: {result}")
+            # 読み込みはバックグラウンドジョブで行い、すぐに進捗画面へ移る
+            job = start_import_job(
+                'master',
+                lambda progress: csv_loader.load_materials_with_overwrite(overwrite_mode, progress=progress),
+                filename=csv_loader.csv_file,
+                overwrite_mode=overwrite_mode,
+            )
+            return redirect('materials:import_job_detail', pk=job.pk)
 
         except Exception as e:
             error_msg = f"システムエラー: {str(e)}"
@@ -487,9 +649,10 @@ CSV読み込み完了！
         csv_analysis = csv_loader.analyze_csv_structure()
 
         # データベースの現在の状況を取得
+        stats = get_material_stats()
         db_status = {
-            'total_count': Material.objects.count(),
-            'active_count': Material.objects.filter(is_active=True).count(),
+            'total_count': stats['total'],
+            'active_count': stats['active'],
         }
 
         context = {
@@ -519,279 +682,110 @@ def upload_csv_import(request):
             uploaded_file = request.FILES['csv_file']
 
             try:
-                import tempfile
-                import os
-                import pandas as pd
-
-                # 一時ファイルに保存
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
-                    for chunk in uploaded_file.chunks():
-                        tmp_file.write(chunk)
-                    tmp_file_path = tmp_file.name
-
-                # 複数エンコーディングで読み込み
-                encodings = ['cp932', 'shift_jis', 'utf-8', 'utf-8-sig']
-                df = None
-                used_encoding = None
-
-                for encoding in encodings:
+                with Trace('view.upload_preview', logger, file=uploaded_file.name) as trace:
+                    # 一時ファイルを使わず、1回のデコードで読み込む
                     try:
-                        df = pd.read_csv(tmp_file_path, encoding=encoding)
-                        used_encoding = encoding
-                        break
-                    except:
-                        continue
-
-                if df is None:
-                    messages.error(request, 'CSVファイルを読み込めませんでした。')
-                    return redirect('materials:upload_csv_import')
-
-                # 原料ID列を確認
-                id_column = None
-                for col in df.columns:
-                    if '原料ID' in col or 'ID' in col.upper():
-                        id_column = col
-                        break
-
-                if id_column is None:
-                    messages.error(request, '原料ID列が見つかりませんでした。')
-                    return redirect('materials:upload_csv_import')
-
-                # 重複チェック
-                existing_ids = []
-                new_ids = []
-
-                for _, row in df.iterrows():
-                    material_id = str(row.get(id_column, '')).strip()
-                    if material_id:
-                        if Material.objects.filter(material_id=material_id).exists():
-                            existing_ids.append(material_id)
-                        else:
-                            new_ids.append(material_id)
-
-                # セッションに情報を保存
-                request.session['csv_preview_data'] = {
-                    'filename': uploaded_file.name,
-                    'total_rows': len(df),
-                    'columns': list(df.columns),
-                    'encoding': used_encoding,
-                    'id_column': id_column,
-                    'existing_count': len(existing_ids),
-                    'new_count': len(new_ids),
-                    'existing_ids': existing_ids[:10],
-                    'new_ids': new_ids[:10]
-                }
-
-                # 一時ファイルを削除
-                os.unlink(tmp_file_path)
-
-                return render(request, 'materials/csv_preview.html', {
-                    'preview_data': request.session['csv_preview_data']
-                })
+                        df, used_encoding = parse_upload(uploaded_file, trace)
+                    except (UnicodeDecodeError, ValueError) as e:
+                        trace.status = 'rejected'
+                        messages.error(request, f'CSVファイルを読み込めませんでした。({e})')
+                        return redirect('materials:upload_csv_import')
+
+                    # 原料ID列を確認
+                    id_column = find_id_column(df.columns)
+
+                    if id_column is None:
+                        trace.status = 'rejected'
+                        messages.error(request, '原料ID列が見つかりませんでした。')
+                        return redirect('materials:upload_csv_import')
+
+                    # 既存IDの判定と項目ごとの変更件数をまとめて集計
+                    diff = preview_upload_changes(df, id_column, trace=trace)
+
+                    # 読み込み結果をサーバー側に保存し、インポート時に再利用する
+                    with trace.span('stage'):
+                        staging = stage_upload(df, uploaded_file.name, used_encoding, id_column)
+                    trace.counters.update(rows=len(df), new=diff['new_count'], changed=diff['changed_count'])
+
+                    # セッションに情報を保存
+                    request.session['csv_preview_data'] = {
+                        'filename': uploaded_file.name,
+                        'total_rows': len(df),
+                        'columns': list(df.columns),
+                        'encoding': used_encoding,
+                        'id_column': id_column,
+                        'staging_token': str(staging.token),
+                        **diff,
+                    }
+
+                    return render(request, 'materials/csv_preview.html', {
+                        'preview_data': request.session['csv_preview_data']
+                    })
 
             except Exception as e:
                 messages.error(request, f'ファイル処理エラー: {str(e)}')
                 return redirect('materials:upload_csv_import')
 
         elif action == 'import':
-            # インポート実行段階
+            # インポート実行段階（プレビューで保存したデータを使う）
             overwrite_mode = request.POST.get('overwrite_mode', 'update')
-
-            if 'csv_file' not in request.FILES:
-                messages.error(request, 'CSVファイルが選択されていません。')
-                return redirect('materials:upload_csv_import')
-
-            uploaded_file = request.FILES['csv_file']
+            preview_data = request.session.get('csv_preview_data', {})
+            token = request.POST.get('staging_token') or preview_data.get('staging_token')
 
             try:
-                import tempfile
-                import os
-                import pandas as pd
-                from django.db import transaction
-
-                # 一時ファイルに保存
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
-                    for chunk in uploaded_file.chunks():
-                        tmp_file.write(chunk)
-                    tmp_file_path = tmp_file.name
-
-                # CSVファイル読み込み
-                encodings = ['cp932', 'shift_jis', 'utf-8', 'utf-8-sig']
-                df = None
-
-                for encoding in encodings:
-                    try:
-                        df = pd.read_csv(tmp_file_path, encoding=encoding)
-                        break
-                    except:
-                        continue
-
-                if df is None:
-                    messages.error(request, 'CSVファイルを読み込めませんでした。')
+                staging, df = load_staged_upload(token) if token else (None, None)
+                if staging is None:
+                    messages.error(request, 'プレビューデータが見つかりません。もう一度CSVファイルをアップロードしてください。')
                     return redirect('materials:upload_csv_import')
 
-                # 原料ID列を確認
-                id_column = None
-                for col in df.columns:
-                    if '原料ID' in col or 'ID' in col.upper():
-                        id_column = col
-                        break
-
-                # 完全フィールドマッピング
-                field_mapping = {
-                    'ラベル用備考': 'label_note',
-                    'ラベル発行枚数': 'label_issue_count',
-                    'リテスト延長使用期限': 'retest_extension_expiry',
-                    'リテスト試験日数': 'retest_days',
-                    '使用剤形': 'usage_form',
-                    '使用期限表示': 'expiry_display',
-                    '保障期間': 'guarantee_period',
-                    '公差使用': 'tolerance_usage',
-                    '分類': 'category',
-                    '単価': 'unit_price',
-                    '原料コード': 'material_code',
-                    '原料区分': 'material_category',
-                    '原料名': 'material_name',
-                    '原料簿コード（サブ）': 'material_sub_code',
-                    '原料簿コード（メイン）': 'material_main_code',
-                    '原産国表示': 'origin_country',
-                    '受入試験後使用期限': 'post_test_expiry',
-                    '品質管理備考': 'qc_note',
-                    '商品名': 'product_name',
-                    '商品名カナ': 'product_kana',
-                    '在庫単位（係数）': 'stock_unit_coefficient',
-                    '変更申請／変更指示': 'change_request',
-                    '差分警告割合': 'diff_warn_rate',
-                    '正袋秤量': 'main_bag_weighing',
-                    '正袋重量': 'main_bag_weight',
-                    '生産本部備考': 'hq_note',
-                    '画像パス': 'image_path',
-                    '発注単位': 'order_unit',
-                    '荷姿': 'packaging',
-                    '補正情報': 'correction_info',
-                    '製造所': 'manufacturer',
-                    '規格': 'standard',
-                    '調達区分': 'procurement_type',
-                    '販売者': 'supplier',
-                    '風袋重量': 'tare_weight',
-                    'Unnamed: 36': 'unnamed_36',
-                    'Unnamed: 37': 'unnamed_37',
-                }
-
-                # データベース処理
-                created_count = 0
-                updated_count = 0
-                skipped_count = 0
-                error_count = 0
-
-                with transaction.atomic():
-                    for index, row in df.iterrows():
-                        try:
-                            material_id = str(row.get(id_column, '')).strip()
-                            if not material_id:
-                                skipped_count += 1
-                                continue
-
-                            # 全フィールドをマッピング
-                            field_data = {}
-
-                            for csv_column, model_field in field_mapping.items():
-                                if csv_column in df.columns:
-                                    value = row.get(csv_column, '')
-
-                                    # 単価の特別処理
-                                    if csv_column == '単価':
-                                        if pd.notna(value) and str(value).strip():
-                                            try:
-                                                # カンマと通貨記号を除去
-                                                cleaned_price = str(value).replace(',', '').replace('¥', '').replace(
-                                                    '￥', '').strip()
-                                                if cleaned_price and cleaned_price not in ['nan', 'NaN', '']:
-                                                    field_data[model_field] = cleaned_price
-                                                else:
-                                                    field_data[model_field] = '0'
-                                            except:
-                                                field_data[model_field] = '0'
-                                        else:
-                                            field_data[model_field] = '0'
-                                    else:
-                                        # 通常フィールドの処理
-                                        if pd.notna(value):
-                                            field_data[model_field] = str(value).strip()
-                                        else:
-                                            field_data[model_field] = ''
-
-                            # 必須フィールド設定
-                            field_data['is_active'] = True
-
-                            # 上書きモード処理
-                            if overwrite_mode == 'update':
-                                material, created = Material.objects.update_or_create(
-                                    material_id=material_id,
-                                    defaults=field_data
-                                )
-                                if created:
-                                    created_count += 1
-                                else:
-                                    updated_count += 1
-
-                            elif overwrite_mode == 'skip':
-                                if Material.objects.filter(material_id=material_id).exists():
-                                    skipped_count += 1
-                                else:
-                                    field_data['material_id'] = material_id
-                                    Material.objects.create(**field_data)
-                                    created_count += 1
-
-                            elif overwrite_mode == 'replace':
-                                Material.objects.filter(material_id=material_id).delete()
-                                field_data['material_id'] = material_id
-                                Material.objects.create(**field_data)
-                                created_count += 1
-
-                        except Exception as e:
-                            error_count += 1
-                            logger.error(f"行処理エラー (原料ID: {material_id}): {e}")
-
-                # 全データを有効化
-                Material.objects.all().update(is_active=True)
-
-                # 一時ファイルを削除
-                os.unlink(tmp_file_path)
-
-                # 結果メッセージ
-                success_msg = f"""
-CSVインポート完了！
-• ファイル名: {uploaded_file.name}
-• 処理モード: {overwrite_mode}
-• 新規作成: {created_count}件
-• 更新: {updated_count}件
-• スキップ: {skipped_count}件
-• エラー: {error_count}件
-• 全38フィールド対応
-                """
-                messages.success(request, success_msg)
+                def run_import(progress):
+                    result = import_upload_frame(df, staging.id_column, overwrite_mode, progress=progress)
+                    staging.delete()
+                    return result
+
+                # 書き込みはバックグラウンドジョブで行い、すぐに進捗画面へ移る
+                job = start_import_job(
+                    'upload',
+                    run_import,
+                    filename=staging.filename,
+                    overwrite_mode=overwrite_mode,
+                )
 
                 # セッションクリア
                 if 'csv_preview_data' in request.session:
                     del request.session['csv_preview_data']
 
-                return redirect('materials:material_list')
+                return redirect('materials:import_job_detail', pk=job.pk)
 
             except Exception as e:
                 messages.error(request, f'インポート処理エラー: {str(e)}')
                 return redirect('materials:upload_csv_import')
 
     # GET リクエスト: アップロード画面
+    stats = get_material_stats()
     context = {
         'db_status': {
-            'total_count': Material.objects.count(),
-            'active_count': Material.objects.filter(is_active=True).count(),
+            'total_count': stats['total'],
+            'active_count': stats['active'],
         }
     }
 
     return render(request, 'materials/csv_upload_complete.html', context)
 
+def import_job_detail(request, pk):
+    """取り込みジョブの進捗画面"""
+    fail_stale_jobs()
+    job = get_object_or_404(ImportJob, pk=pk)
+    return render(request, 'materials/import_job.html', {'job': job})
+
+
+def import_job_status(request, pk):
+    """取り込みジョブの進捗（JSON）"""
+    fail_stale_jobs()
+    job = get_object_or_404(ImportJob, pk=pk)
+    return JsonResponse(job.to_dict())
+
+
 def clear_csv_session(request):
     """とりあえず動くバージョン"""
     return redirect('materials:material_list')
\ No newline at end of file